@@ -5,10 +5,13 @@
 # Circuits are managed by the Node circuit-manager (VPN/StateManager).
 # ============================================================================
 
-from flask import Flask, request, jsonify, render_template_string, redirect
+from flask import Flask, Response, request, jsonify, redirect
 from pathlib import Path
-import subprocess, time, os, json, re, signal, uuid
-import urllib.parse
+import subprocess, time, os, sys, json, re, signal, uuid, threading, queue
+from array import array
+import gzip, hashlib, http.client, socket, ssl, urllib.parse
+
+import broker, bypass, circuitpool, conntrack, controlport, firewall, metrics, proctrace, socks5, statefile, wifi
 
 app = Flask(__name__, static_folder="static")
 
@@ -22,27 +25,11 @@ def _exit_country_from_manager() -> str:
     Authoritative exit country comes from the Node circuit-manager (/status).
     Falls back to AUTO if unavailable.
     """
-    try:
-        # Prefer internal helper if present
-        if "_cm_request" in globals():
-            r = _cm_request("/status", method="GET", payload=None, timeout=2.0)
-            if isinstance(r, dict):
-                ecs = r.get("exitCountries") or []
-                if isinstance(ecs, list) and ecs:
-                    cc = str(ecs[0] or "").strip().upper()
-                    return cc or "AUTO"
-                return "AUTO"
-        # Fallback: stdlib urllib (no requests dependency)
-        import urllib.request, json as _json
-        base = globals().get("CIRCUIT_MGR_BASE", "http://127.0.0.1:8787").rstrip("/")
-        with urllib.request.urlopen(base + "/status", timeout=2.0) as resp:
-            data = _json.loads(resp.read().decode("utf-8","replace"))
-        ecs = data.get("exitCountries") or []
-        if isinstance(ecs, list) and ecs:
-            cc = str(ecs[0] or "").strip().upper()
-            return cc or "AUTO"
-    except Exception:
-        pass
+    r = _cm_status_cached()
+    ecs = (r.get("exitCountries") or []) if isinstance(r, dict) else []
+    if isinstance(ecs, list) and ecs:
+        cc = str(ecs[0] or "").strip().upper()
+        return cc or "AUTO"
     return "AUTO"
 
 
@@ -51,15 +38,39 @@ def _exit_country_from_manager() -> str:
 # ──────────────────────────────────────────────
 ANONRC_PATH = os.environ.get("ANONRC_PATH", "/etc/anonrc")
 KILLSWITCH_SCRIPT = os.environ.get("KILLSWITCH_SCRIPT", "/usr/local/bin/anyone_killswitch.sh")
+BOOT_REPORT_PATH = os.environ.get("BOOT_REPORT_PATH", "/run/anyone-stick-boot.json")
+DNS_STATS_PATH = os.environ.get("DNS_STATS_PATH", "/run/anyone-stick-dns.json")
+CIRCUIT_POOL_PATH = os.environ.get("CIRCUIT_POOL_PATH", "/var/lib/anyone-stick/circuit_pool.json")
+
+# ──────────────────────────────────────────────
+# Privileged calls — one RPC to the root broker (broker.py) when it is
+# listening, otherwise the direct sudo / nmcli path
+# ──────────────────────────────────────────────
+_broker = broker.BrokerClient(broker.BROKER_SOCKET)
+
+def _privileged(cmd: str, fallback, timeout: float | None = None, **args):
+    """Broker result for cmd, or fallback() if no broker runs. Broker-side failures raise BrokerError."""
+    if _broker.available():
+        try:
+            return _broker.call(cmd, timeout=timeout, **args)
+        except broker.BrokerUnavailable:
+            pass
+    return fallback()
 
 # ──────────────────────────────────────────────
 # Mode switch runner (async, non-blocking)
 # ──────────────────────────────────────────────
 MODE_STATE_PATH = os.environ.get("MODE_STATE_PATH", "/run/anyone-stick-mode.json")
+MODE_SWITCH_TIMEOUT = 120.0
+MODE_SWITCH_MAX_WAIT = 30.0      # longest ?wait= a status request may hold
+
+_mode_cond = threading.Condition()
+_mode_active = None              # run_id of the switch this process is watching
 
 def _mode_write(state: dict):
+    # Atomic replace: the mode engine updates the same file with step timings.
     try:
-        Path(MODE_STATE_PATH).write_text(json.dumps(state), encoding="utf-8")
+        statefile.write_json(MODE_STATE_PATH, state)
     except Exception:
         pass
 
@@ -69,140 +80,753 @@ def _mode_read():
     except Exception:
         return {"running": False}
 
-def _run_mode_async(kind: str):
-    """
-    Runs mode_privacy.sh / mode_normal.sh asynchronously using systemd-run.
-    Returns run_id immediately. UI can poll /api/mode/switch to see progress.
-    """
-    run_id = str(uuid.uuid4())[:8]
-    unit = f"anyone-stick-mode-{kind}-{run_id}"
-    script = "/usr/local/bin/mode_privacy.sh" if kind == "privacy" else "/usr/local/bin/mode_normal.sh"
-    _mode_write({"running": True, "kind": kind, "run_id": run_id, "unit": unit, "ts": time.time(), "exit": None})
+def _mode_status():
+    st = _mode_read()
+    if st.get("running") and st.get("run_id") != _mode_active \
+            and time.time() - float(st.get("ts") or 0) > MODE_SWITCH_TIMEOUT:
+        # Nobody is watching this switch any more (portal restarted mid-switch).
+        st.update(running=False, exit=-1, result="lost", error="switch outcome unknown (portal restarted)")
+    return st
+
+def _mode_finish(run_id: str, exit_code: int, result: str, error: str | None = None):
+    """Records the outcome of a switch (once, by its watcher) and wakes long-polling requests."""
+    global _mode_active
+    st = _mode_read()
+    if st.get("run_id") != run_id:
+        st = {"run_id": run_id}
+    st.update(running=False, exit=exit_code, result=result, finished_ts=time.time())
+    if error:
+        st["error"] = error
+    _mode_write(st)
+    _fw_invalidate()
+    with _mode_cond:
+        if _mode_active == run_id:
+            _mode_active = None
+        _mode_cond.notify_all()
+
+def _mode_watch(kind: str, run_id: str, unit: str, via_broker: bool):
+    """Runs one switch to completion — a broker RPC or a reaped `systemd-run --wait` child."""
+    if via_broker:
+        try:
+            res = _broker.call("mode.apply", timeout=MODE_SWITCH_TIMEOUT, kind=kind)
+        except broker.BrokerUnavailable:
+            st = _mode_read()
+            st.update(runner="systemd-run", unit=unit)
+            _mode_write(st)
+        except broker.BrokerError as e:
+            return _mode_finish(run_id, -1, e.code, str(e))
+        else:
+            if res.get("ok"):
+                return _mode_finish(run_id, 0, "success")
+            err = next((f"{s['step']}: {s.get('error')}" for s in res.get("steps") or [] if not s.get("ok")), None)
+            return _mode_finish(run_id, 1, "exit-code", err or res.get("error"))
 
-    # Start transient unit; do NOT block request
-    # We rely on systemd to capture logs and exit status.
+    engine = [sys.executable, os.path.abspath(firewall.__file__), "apply", kind, "--state", MODE_STATE_PATH]
     try:
-        subprocess.Popen([
+        proc = proctrace.Popen([
             "sudo", "systemd-run",
             "--unit", unit,
             "--collect",
             "--no-ask-password",
-            script
-        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            "--wait", "--quiet",
+            *engine
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
     except Exception as e:
-        _mode_write({"running": False, "kind": kind, "run_id": run_id, "unit": unit, "ts": time.time(), "exit": -1, "error": str(e)})
+        return _mode_finish(run_id, -1, "spawn-failed", str(e))
+    try:
+        _, err = proc.communicate(timeout=MODE_SWITCH_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.communicate()
+        return _mode_finish(run_id, -1, "timeout", f"no result after {MODE_SWITCH_TIMEOUT:.0f}s")
+    rc = proc.returncode
+    # --wait: systemd-run exits with the unit's main process status.
+    _mode_finish(run_id, rc, "success" if rc == 0 else "exit-code",
+                 None if rc == 0 else ((err or "").strip()[-300:] or f"rc={rc}"))
+
+def _run_mode_async(kind: str):
+    """
+    Applies the privacy / normal ruleset asynchronously: through the broker,
+    or (no broker) in a systemd-run transient unit. Either runs the firewall
+    engine (one atomic iptables-restore) and records per-step timings into
+    MODE_STATE_PATH; one watcher thread per switch records the outcome.
+    Returns run_id immediately. /api/mode/switch?wait=N long-polls for the end.
+    """
+    global _mode_active
+    run_id = str(uuid.uuid4())[:8]
+    unit = f"anyone-stick-mode-{kind}-{run_id}"
+    _fw_invalidate()
+    via_broker = _broker.available()
+    st = {"running": True, "kind": kind, "run_id": run_id, "ts": time.time(), "exit": None}
+    st.update({"runner": "broker"} if via_broker else {"runner": "systemd-run", "unit": unit})
+    with _mode_cond:
+        _mode_active = run_id
+    _mode_write(st)
+    threading.Thread(target=_mode_watch, args=(kind, run_id, unit, via_broker), name=f"mode-{run_id}", daemon=True).start()
     return run_id
 
 
 # ──────────────────────────────────────────────
-# Tiny HTTP client (stdlib) to talk to Node
-# ── Status cache (avoid hammering circuit-manager) ──────────
-_status_cache = {"data": None, "ts": 0}
+# Single-flight cache (stale-while-revalidate)
+# ──────────────────────────────────────────────
+class _SingleFlightCache:
+    """
+    Cache for upstream data where at most ONE refresh per key is in flight.
 
-def _cm_status_cached(max_age=3.0):
-    import time as _t
-    if _t.time() - _status_cache["ts"] < max_age and _status_cache["data"]:
-        return _status_cache["data"]
-    result = _cm_request("/status", method="GET", payload=None, timeout=2.0)
-    if isinstance(result, dict) and result.get("ok"):
-        _status_cache["data"] = result
-        _status_cache["ts"] = _t.time()
-    return result
+      age < ttl                 -> cached value
+      ttl <= age < max_stale    -> cached value immediately, one background refresh
+      no value / age >= max_stale -> wait for the single in-flight load
+
+    Only results passing `accept` are cached; a rejected result (e.g. {"ok": False})
+    is still handed to everyone who waited on that load, but not kept.
+    """
+
+    class _Entry:
+        __slots__ = ("value", "ts", "last", "inflight")
+
+        def __init__(self):
+            self.value = None
+            self.ts = None          # monotonic time of the cached value
+            self.last = None        # last loader result (accepted or not)
+            self.inflight = None    # threading.Event while a load runs
+
+    def __init__(self, ttl: float, max_stale: float, accept=None, wait_timeout: float = 30.0):
+        self.ttl = float(ttl)
+        self.max_stale = float(max_stale)
+        self.accept = accept or (lambda v: v is not None)
+        self.wait_timeout = float(wait_timeout)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.counts = {"hit": 0, "stale": 0, "miss": 0, "wait": 0, "load": 0, "error": 0}
+
+    def _load(self, e, loader, ev, trigger=None):
+        try:
+            with proctrace.context(trigger or proctrace.current()):
+                v = loader()
+        except Exception as ex:
+            v = {"ok": False, "error": str(ex) or ex.__class__.__name__}
+        with self._lock:
+            self.counts["load"] += 1
+            e.last = v
+            if self.accept(v):
+                e.value, e.ts = v, time.monotonic()
+            else:
+                self.counts["error"] += 1
+            e.inflight = None
+        ev.set()
+        return v
+
+    def _load_bg(self, e, loader, ev):
+        # Subprocesses the load spawns are attributed to whoever asked for it.
+        threading.Thread(target=self._load, args=(e, loader, ev, proctrace.current()), daemon=True).start()
+
+    def get(self, loader, key=None, ttl: float | None = None):
+        ttl = self.ttl if ttl is None else float(ttl)
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = self._entries[key] = self._Entry()
+            age = (time.monotonic() - e.ts) if e.ts is not None else None
+            if age is not None and age < ttl:
+                self.counts["hit"] += 1
+                return e.value
+            leader = e.inflight is None
+            if leader:
+                e.inflight = threading.Event()
+            ev = e.inflight
+            if age is not None and age < self.max_stale:
+                self.counts["stale"] += 1
+                if leader:
+                    self._load_bg(e, loader, ev)
+                return e.value
+            self.counts["miss" if leader else "wait"] += 1
+        if leader:
+            return self._load(e, loader, ev)
+        ev.wait(self.wait_timeout)
+        with self._lock:
+            if e.ts is not None and time.monotonic() - e.ts < self.max_stale:
+                return e.value
+            return e.last
+
+    def refresh(self, loader, key=None):
+        """Loads now regardless of age (joins the in-flight load if there is one)."""
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = self._entries[key] = self._Entry()
+            leader = e.inflight is None
+            if leader:
+                e.inflight = threading.Event()
+            ev = e.inflight
+        if leader:
+            return self._load(e, loader, ev)
+        ev.wait(self.wait_timeout)
+        with self._lock:
+            return e.last
+
+    def get_nowait(self, loader, key=None):
+        """Cached value of any age (or None) without blocking; starts a background load if stale."""
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                e = self._entries[key] = self._Entry()
+            fresh = e.ts is not None and time.monotonic() - e.ts < self.ttl
+            if fresh or e.inflight is not None:
+                return e.value
+            ev = e.inflight = threading.Event()
+        self._load_bg(e, loader, ev)
+        return e.value
+
+    def loading(self, key=None) -> bool:
+        """True while a load for key is in flight."""
+        with self._lock:
+            e = self._entries.get(key)
+            return e is not None and e.inflight is not None
+
+    def peek(self, key=None):
+        """(value, age_seconds) without triggering a load; (None, None) if empty."""
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None or e.ts is None:
+                return None, None
+            return e.value, time.monotonic() - e.ts
+
+    def invalidate(self, key=None):
+        with self._lock:
+            e = self._entries.get(key)
+            if e is not None:
+                e.ts = None
 
 # ──────────────────────────────────────────────
-def _cm_request(path: str, method: str = "GET", payload: dict | None = None, timeout: float = 2.5):
-    import urllib.request
-    import urllib.error
+# Tiny HTTP client (stdlib) to talk to Node
+# Persistent HTTP/1.1 keep-alive connections, bounded idle list, per-call timeouts.
+# ──────────────────────────────────────────────
+CM_POOL_SIZE = 4             # idle sockets kept; concurrent calls are not capped
+CM_POOL_IDLE_SECONDS = 4.0   # Node closes idle keep-alive sockets after 5s
 
-    url = CIRCUIT_MGR_BASE + path
-    data = None
+class _KeepAlivePool:
+    """
+    Thread-safe pool of persistent connections to a single HTTP origin. At
+    most `size` idle sockets are kept for reuse; a call that finds none free
+    opens a fresh connection, so concurrency is never limited by the pool.
+    """
+
+    def __init__(self, base: str, size: int = CM_POOL_SIZE, idle: float = CM_POOL_IDLE_SECONDS):
+        u = urllib.parse.urlsplit(base)
+        self.https = (u.scheme == "https")
+        self.host = u.hostname or "127.0.0.1"
+        self.port = u.port or (443 if self.https else 80)
+        self.prefix = u.path.rstrip("/")
+        self.idle = float(idle)
+        self._lock = threading.Lock()
+        self.size = int(size)
+        self._free = []  # LIFO of (conn, released_at) — reuse the warmest socket first
+
+    def _checkout(self, timeout: float):
+        now = time.monotonic()
+        with self._lock:
+            while self._free:
+                conn, released = self._free.pop()
+                if now - released < self.idle and conn.sock is not None:
+                    return conn, True
+                conn.close()
+        cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=timeout), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            self._free.append((conn, time.monotonic()))
+            if len(self._free) <= self.size:
+                return
+            oldest, _ = self._free.pop(0)
+        oldest.close()
+
+    def request(self, method: str, path: str, body: bytes | None = None,
+                headers: dict | None = None, timeout: float = 2.5):
+        """Returns (status, reason, body bytes). Raises on network errors/timeouts."""
+        # Only idempotent requests are replayed: a POST may have reached the server.
+        retry = method in ("GET", "HEAD")
+        for attempt in (0, 1):
+            conn, reused = self._checkout(timeout)
+            try:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout)
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                resp = conn.getresponse()
+                data = resp.read()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError):
+                conn.close()
+                # The server dropped an idle keep-alive socket: retry once on a fresh one.
+                if retry and reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                self._checkin(conn)
+            return resp.status, resp.reason, data
+
+_cm_pool = _KeepAlivePool(CIRCUIT_MGR_BASE)
+
+def _cm_raw(path: str, method: str = "GET", payload: dict | None = None, timeout: float = 2.5):
+    """(status, reason, body bytes) from the circuit-manager; raises on network errors."""
     headers = {"Accept": "application/json"}
+    data = None
     if payload is not None:
         data = json.dumps(payload).encode("utf-8")
         headers["Content-Type"] = "application/json"
+    return _cm_pool.request(method.upper(), path, body=data, headers=headers, timeout=timeout)
 
-    req = urllib.request.Request(url, data=data, method=method.upper(), headers=headers)
+_CM_LATENCY = metrics.Histogram("portal_upstream_request_duration_seconds",
+                                "circuit-manager call latency", ("path", "method"))
+_CM_ERRORS = metrics.Counter("portal_upstream_errors_total",
+                             "circuit-manager calls that failed (network error or HTTP >= 400)", ("path", "method"))
+
+def _cm_request(path: str, method: str = "GET", payload: dict | None = None, timeout: float = 2.5):
+    url = CIRCUIT_MGR_BASE + path
+    labels = (path.partition("?")[0], method.upper())
+    t0 = time.perf_counter()
     try:
-        with urllib.request.urlopen(req, timeout=timeout) as r:
-            raw = r.read().decode("utf-8", errors="replace")
-            return json.loads(raw) if raw else {}
+        status, reason, body = _cm_raw(path, method, payload, timeout)
+        if status >= 400:
+            _CM_ERRORS.inc(labels)
+            return {"ok": False, "error": f"HTTP Error {status}: {reason}", "url": url}
+        raw = body.decode("utf-8", errors="replace")
+        return json.loads(raw) if raw else {}
     except Exception as e:
-        return {"ok": False, "error": str(e), "url": url}
+        _CM_ERRORS.inc(labels)
+        return {"ok": False, "error": str(e) or e.__class__.__name__, "url": url}
+    finally:
+        _CM_LATENCY.observe(time.perf_counter() - t0, labels)
+
+# ── Upstream caches (avoid hammering circuit-manager) ──────────
+def _cm_ok(r) -> bool:
+    return isinstance(r, dict) and r.get("ok") is not False
+
+_status_cache = _SingleFlightCache(ttl=3.0, max_stale=15.0, accept=lambda r: isinstance(r, dict) and bool(r.get("ok")))
+_exits_cache = _SingleFlightCache(ttl=60.0, max_stale=600.0, accept=_cm_ok)
+
+def _cm_status_load():
+    return _cm_request("/status", method="GET", payload=None, timeout=2.0)
+
+def _cm_status_cached(max_age=3.0):
+    return _status_cache.get(_cm_status_load, ttl=max_age)
 
 # ──────────────────────────────────────────────
-# Traffic (usb0) — totals are resettable via offsets
+# Background workers (started lazily, one thread per name)
 # ──────────────────────────────────────────────
-stats = {"rx": 0, "tx": 0, "time": 0, "speed_rx": 0, "speed_tx": 0}
+_bg_lock = threading.Lock()
+_bg_threads = {}
+
+def _start_bg(name: str, target):
+    with _bg_lock:
+        t = _bg_threads.get(name)
+        if t is not None and t.is_alive():
+            return t
+        t = threading.Thread(target=target, name=name, daemon=True)
+        _bg_threads[name] = t
+        t.start()
+        return t
+
+# ──────────────────────────────────────────────
+# Traffic (usb0) — one sampler thread feeds a ring buffer
+# Totals are resettable via offsets; speeds are EWMA-smoothed.
+# ──────────────────────────────────────────────
+TRAFFIC_IFACE = os.environ.get("TRAFFIC_IFACE", "usb0")
+PROC_NET_DEV = os.environ.get("PROC_NET_DEV", "/proc/net/dev")
+TRAFFIC_SAMPLE_INTERVAL = 1.0
+TRAFFIC_HISTORY_SECONDS = 3600
+TRAFFIC_EWMA_ALPHA = 0.3
+
+class _TrafficRing:
+    """
+    Fixed-size ring of samples, one array('d') per column so memory stays flat
+    (3600 samples x 5 columns x 8 bytes = ~140 KB) regardless of uptime.
+    Columns: ts, raw_rx, raw_tx, speed_rx, speed_tx.
+    """
+    def __init__(self, size: int):
+        self.size = int(size)
+        zeros = [0.0] * self.size
+        self.ts = array("d", zeros)
+        self.rx = array("d", zeros)
+        self.tx = array("d", zeros)
+        self.srx = array("d", zeros)
+        self.stx = array("d", zeros)
+        self.head = 0      # next write position
+        self.count = 0
+
+    def append(self, ts, rx, tx, srx, stx):
+        i = self.head
+        self.ts[i], self.rx[i], self.tx[i], self.srx[i], self.stx[i] = ts, rx, tx, srx, stx
+        self.head = (i + 1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def latest(self):
+        if not self.count:
+            return None
+        i = (self.head - 1) % self.size
+        return (self.ts[i], self.rx[i], self.tx[i], self.srx[i], self.stx[i])
+
+    def window(self, seconds: float, step: int = 1):
+        """Samples newer than now-seconds, oldest first, every `step`-th sample."""
+        if not self.count:
+            return []
+        cutoff = self.ts[(self.head - 1) % self.size] - float(seconds)
+        out = []
+        n = self.count
+        start = (self.head - n) % self.size
+        for k in range(0, n, max(1, int(step))):
+            i = (start + k) % self.size
+            if self.ts[i] <= cutoff:
+                continue
+            out.append((self.ts[i], self.rx[i], self.tx[i], self.srx[i], self.stx[i]))
+        return out
+
+_traffic_lock = threading.Lock()
+_traffic_ring = _TrafficRing(int(TRAFFIC_HISTORY_SECONDS / TRAFFIC_SAMPLE_INTERVAL))
 _traffic_offset = {"rx": 0, "tx": 0}
-_traffic_raw_prev = {"rx": 0, "tx": 0, "time": 0.0}
 
+def _read_iface_counters(iface: str = TRAFFIC_IFACE):
+    """Returns (raw_rx, raw_tx) bytes for iface from /proc/net/dev, or None."""
+    try:
+        with open(PROC_NET_DEV) as f:
+            for line in f:
+                name, sep, rest = line.partition(":")
+                if sep and name.strip() == iface:
+                    d = rest.split()
+                    return int(d[0]), int(d[8])
+    except Exception:
+        pass
+    return None
+
+def _traffic_sampler_loop():
+    prev = None  # (t, raw_rx, raw_tx)
+    ewma_rx = ewma_tx = 0.0
+    tick = 0
+    while True:
+        t0 = time.monotonic()
+        if tick % CLIENT_SAMPLE_EVERY == 0 and time.monotonic() < _clients_wanted_until:
+            _clients_sample()
+        tick += 1
+        raw = _read_iface_counters()
+        if raw is not None:
+            t = time.time()
+            raw_rx, raw_tx = raw
+            if prev is not None and raw_rx >= prev[1] and raw_tx >= prev[2]:
+                dt = max(t - prev[0], 0.001)
+                a = TRAFFIC_EWMA_ALPHA
+                ewma_rx = a * ((raw_rx - prev[1]) / dt) + (1.0 - a) * ewma_rx
+                ewma_tx = a * ((raw_tx - prev[2]) / dt) + (1.0 - a) * ewma_tx
+            else:
+                # first sample, or usb0 was re-created and counters restarted
+                ewma_rx = ewma_tx = 0.0
+            prev = (t, raw_rx, raw_tx)
+            with _traffic_lock:
+                _traffic_ring.append(t, raw_rx, raw_tx, ewma_rx, ewma_tx)
+        time.sleep(max(0.05, TRAFFIC_SAMPLE_INTERVAL - (time.monotonic() - t0)))
+
+def _ensure_traffic_sampler():
+    _start_bg("traffic-sampler", _traffic_sampler_loop)
+
+def update_stats():
+    """Latest traffic sample (totals relative to the reset offsets). Never touches /proc."""
+    _ensure_traffic_sampler()
+    with _traffic_lock:
+        last = _traffic_ring.latest()
+        off_rx, off_tx = _traffic_offset["rx"], _traffic_offset["tx"]
+    if last is None:
+        return {"rx": 0, "tx": 0, "time": 0, "speed_rx": 0, "speed_tx": 0}
+    ts, raw_rx, raw_tx, srx, stx = last
+    return {
+        "rx": max(0, int(raw_rx) - off_rx),
+        "tx": max(0, int(raw_tx) - off_tx),
+        "time": ts,
+        "speed_rx": srx,
+        "speed_tx": stx,
+    }
+
+def traffic_history(window: float, step: int = 1):
+    _ensure_traffic_sampler()
+    with _traffic_lock:
+        rows = _traffic_ring.window(window, step)
+        off_rx, off_tx = _traffic_offset["rx"], _traffic_offset["tx"]
+    return [
+        [round(ts, 3), max(0, int(rx) - off_rx), max(0, int(tx) - off_tx), round(srx, 1), round(stx, 1)]
+        for ts, rx, tx, srx, stx in rows
+    ]
+
+def traffic_reset():
+    """Moves the offsets to the current raw counters. Returns False if the iface is missing."""
+    raw = _read_iface_counters()
+    if raw is None:
+        return False
+    with _traffic_lock:
+        _traffic_offset["rx"], _traffic_offset["tx"] = int(raw[0]), int(raw[1])
+        for c in _clients.values():
+            c["total"] = dict.fromkeys(c["total"], 0)
+    return True
+
+# ── Per-client accounting (firewall.ACCT_* counting rules in mangle) ──
+# The sampler reads every client's counters with one iptables-save each
+# CLIENT_SAMPLE_EVERY ticks, only while someone looks at them; totals are
+# summed deltas, so skipped samples cost resolution, not bytes.
+DNSMASQ_LEASES_PATH = os.environ.get("DNSMASQ_LEASES_PATH", "/var/lib/misc/dnsmasq.leases")
+CLIENT_SAMPLE_EVERY = 5
+CLIENT_WANTED_SECONDS = 60.0
+_clients = {}     # ip -> {"raw", "total", "speed_rx", "speed_tx", "ts", "last_active"}
+_clients_state = {"error": None, "ts": 0.0}
+_clients_wanted_until = 0.0
+_clients_sample_lock = threading.Lock()
+
+def _read_leases(path: str = DNSMASQ_LEASES_PATH) -> dict:
+    """dnsmasq lease file ('expiry mac ip hostname clientid') -> {ip: {"mac", "hostname", "expires"}}."""
+    out = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                p = line.split()
+                if len(p) >= 4:
+                    out[p[2]] = {"mac": p[1], "hostname": None if p[3] == "*" else p[3],
+                                 "expires": int(p[0]) if p[0].isdigit() else None}
+    except OSError:
+        pass
+    return out
+
+def _clients_sample(max_age: float | None = None):
+    """
+    One accounting read folded into the totals. Read and apply happen under
+    _clients_sample_lock: an older read applied after a newer one would look
+    like a counter reset and add the whole counters again.
+    With max_age, skips the read if a sample at most that old exists.
+    """
+    with _clients_sample_lock:
+        if max_age is not None and time.time() - _clients_state["ts"] <= max_age:
+            return
+        try:
+            counters = _privileged("fw.accounting", firewall.client_counters)
+        except Exception as e:
+            _clients_state["error"] = str(e) or e.__class__.__name__
+            return
+        _clients_apply(counters, time.time())
+
+def _clients_apply(counters: dict, t: float):
+    a = TRAFFIC_EWMA_ALPHA
+    with _traffic_lock:
+        for ip, raw in counters.items():
+            c = _clients.get(ip)
+            if c is None:
+                _clients[ip] = {"raw": raw, "total": dict(raw), "speed_rx": 0.0, "speed_tx": 0.0,
+                                "ts": t, "last_active": None}
+                continue
+            prev = c["raw"]
+            # A mode switch reloads the mangle table and restarts the counters.
+            if raw["rx_bytes"] < prev["rx_bytes"] or raw["tx_bytes"] < prev["tx_bytes"]:
+                delta = raw
+            else:
+                delta = {k: raw[k] - prev[k] for k in raw}
+            for k, v in delta.items():
+                c["total"][k] += v
+            dt = max(t - c["ts"], 0.001)
+            c["speed_rx"] = a * (delta["rx_bytes"] / dt) + (1.0 - a) * c["speed_rx"]
+            c["speed_tx"] = a * (delta["tx_bytes"] / dt) + (1.0 - a) * c["speed_tx"]
+            if delta["rx_packets"] or delta["tx_packets"]:
+                c["last_active"] = t
+            c["raw"], c["ts"] = raw, t
+        _clients_state.update(error=None, ts=t)
+
+def traffic_clients() -> dict:
+    """Per-client totals and rates joined with dnsmasq leases (rx/tx as seen on usb0, like update_stats)."""
+    global _clients_wanted_until
+    _ensure_traffic_sampler()
+    _clients_wanted_until = time.monotonic() + CLIENT_WANTED_SECONDS
+    max_age = CLIENT_SAMPLE_EVERY * TRAFFIC_SAMPLE_INTERVAL * 2
+    if time.time() - _clients_state["ts"] > max_age:
+        _clients_sample(max_age=max_age)
+    leases = _read_leases()
+    with _traffic_lock:
+        clients = {ip: (dict(c["total"]), c["speed_rx"], c["speed_tx"], c["last_active"]) for ip, c in _clients.items()}
+        state = dict(_clients_state)
+    rows = []
+    for ip in sorted(set(clients) | set(leases), key=lambda ip: tuple(int(x) for x in ip.split(".") if x.isdigit())):
+        total, srx, stx, last = clients.get(ip, ({}, 0.0, 0.0, None))
+        if ip not in leases and not any(total.values()):
+            continue
+        lease = leases.get(ip, {})
+        rows.append({
+            "ip": ip,
+            "mac": lease.get("mac"),
+            "hostname": lease.get("hostname"),
+            "lease_expires": lease.get("expires"),
+            "rx": total.get("rx_bytes", 0),
+            "tx": total.get("tx_bytes", 0),
+            "rx_packets": total.get("rx_packets", 0),
+            "tx_packets": total.get("tx_packets", 0),
+            "speed_rx": round(srx, 1),
+            "speed_tx": round(stx, 1),
+            "last_active": last,
+        })
+    return {"ok": state["error"] is None, "error": state["error"], "time": state["ts"],
+            "accounting": bool(clients), "clients": rows}
+
+
+# ──────────────────────────────────────────────
+# anon ControlPort — bootstrap / circuit / stream state pushed by events
+# (controlport.Monitor); readiness and the circuit view wait on it
+# ──────────────────────────────────────────────
+_cp_host, _, _cp_port = os.environ.get("CONTROL_PORT_ADDR", "127.0.0.1:9051").rpartition(":")
+_control = controlport.Monitor((_cp_host, int(_cp_port)), password=os.environ.get("CONTROL_PORT_PASSWORD"))
+
+def _control_event(kind, data):
+    if kind == "circ" and data.get("status") not in ("BUILT", "CLOSED", "FAILED"):
+        return
+    if kind in ("circ", "connected"):
+        _events_nudge("circuit", "status")
+
+_control.add_listener(_control_event)
+
+# Pre-built circuits for pinned exit countries (circuitpool.py), off unless
+# CIRCUIT_POOL=1: a manager that ignores circuitId gains nothing from them.
+# Stream attachment stays with the circuit-manager unless CIRCUIT_POOL_ATTACH=1;
+# otherwise pooled circuits are only offered to it and closed if not adopted.
+def _pool_pinned() -> list:
+    try:
+        return list(json.loads(Path(CIRCUIT_POOL_PATH).read_text(encoding="utf-8")).get("countries") or [])
+    except Exception:
+        return []
+
+_circuit_pool = circuitpool.CircuitPool(_control, _pool_pinned(),
+                                        per_country=int(os.environ.get("CIRCUIT_POOL_SIZE", circuitpool.POOL_PER_COUNTRY)),
+                                        attach=os.environ.get("CIRCUIT_POOL_ATTACH", "").strip() == "1",
+                                        enabled=os.environ.get("CIRCUIT_POOL", "").strip() == "1"
+                                        or os.environ.get("CIRCUIT_POOL_ATTACH", "").strip() == "1")
+
+def _pool_pin(countries: list):
+    _circuit_pool.set_countries(countries)
+    statefile.write_json(CIRCUIT_POOL_PATH, {"countries": _circuit_pool.countries})
+
+def _ensure_control():
+    _control.start()
+    _circuit_pool.start()
+
+def _control_payload() -> dict:
+    snap = _control.snapshot()
+    snap["built_circuits"] = sum(1 for c in snap["circuits"] if c["status"] == "BUILT")
+    return snap
 
 def _wait_for_circuit_ready(timeout=30, poll_interval=1.0):
     """
-    Poll the circuit-manager /wait-ready endpoint (or fallback to /status)
-    until at least one circuit is BUILT, or timeout.
+    Waits until at least one circuit is BUILT, or timeout. Driven by ControlPort
+    CIRC events; without a ControlPort, asks the circuit-manager's /wait-ready
+    (or, as a last resort, polls /status).
     Returns True if ready, False if timed out.
     """
-    import urllib.request, json as _json
-    base = CIRCUIT_MGR_BASE
+    _ensure_control()
+    deadline = time.time() + timeout
+    if _control.wait_until(lambda m: m.connected, min(2.0, timeout)):
+        return _control.wait_until(lambda m: bool(m.built_circuits()), max(0.0, deadline - time.time()))
 
     # Try the dedicated /wait-ready endpoint first
-    try:
-        url = f"{base}/wait-ready?timeout={int(timeout * 1000)}"
-        req = urllib.request.Request(url)
-        with urllib.request.urlopen(req, timeout=timeout + 5) as resp:
-            data = _json.loads(resp.read().decode("utf-8", "replace"))
-            return bool(data.get("ready", False))
-    except Exception:
-        pass
+    remaining = max(1.0, deadline - time.time())
+    data = _cm_request(f"/wait-ready?timeout={int(remaining * 1000)}", timeout=remaining + 5)
+    if isinstance(data, dict) and "ready" in data:
+        return bool(data.get("ready", False))
 
     # Fallback: poll /status ourselves
-    import time as _time
-    deadline = _time.time() + timeout
-    while _time.time() < deadline:
-        try:
-            with urllib.request.urlopen(f"{base}/status", timeout=3) as resp:
-                data = _json.loads(resp.read().decode("utf-8", "replace"))
-                circuits = data.get("circuits", [])
-                if isinstance(circuits, list) and len(circuits) > 0:
-                    return True
-                # Also check if bootstrapped
-                if data.get("bootstrapped") or data.get("connected"):
-                    return True
-        except Exception:
-            pass
-        _time.sleep(poll_interval)
+    while time.time() < deadline:
+        data = _cm_request("/status", timeout=3.0)
+        if isinstance(data, dict):
+            circuits = data.get("circuits", [])
+            if isinstance(circuits, list) and len(circuits) > 0:
+                return True
+            # Also check if bootstrapped
+            if data.get("bootstrapped") or data.get("connected"):
+                return True
+        time.sleep(poll_interval)
     return False
 
-def update_stats():
-    global stats, _traffic_offset, _traffic_raw_prev
+# ──────────────────────────────────────────────
+# Firewall state — one iptables-save per snapshot, shared by all endpoints
+# Invalidated on mode / kill switch changes; re-verified every 60s.
+# ──────────────────────────────────────────────
+FIREWALL_REVERIFY_SECONDS = 60.0
+_fw_cache = _SingleFlightCache(ttl=FIREWALL_REVERIFY_SECONDS, max_stale=300.0,
+                               accept=lambda s: isinstance(s, dict) and s.get("ok"))
+
+def _fw_load():
+    snap = _privileged("fw.snapshot", firewall.snapshot)
+    snap["killswitch_source"] = "ruleset"
+    if snap.get("killswitch") is None:
+        # The ruleset carries no kill switch marker: ask the script (once per snapshot).
+        snap["killswitch"] = _killswitch_script_status()
+        snap["killswitch_source"] = "script"
+    return snap
+
+def _fw_snapshot():
+    return _fw_cache.get(_fw_load)
+
+def _fw_invalidate():
+    _fw_cache.invalidate()
+
+# ──────────────────────────────────────────────
+# Split tunnel bypass — list in bypass.BYPASS_PATH, loaded into the kernel
+# sets by the broker (or sudo ipset); domains re-resolved periodically
+# ──────────────────────────────────────────────
+BYPASS_REFRESH_SECONDS = 900.0
+_bypass_lock = threading.RLock()
+
+def _bypass_apply() -> dict:
+    with _bypass_lock:
+        try:
+            return _privileged("bypass.apply", bypass.apply, timeout=60.0)
+        except broker.BrokerError as e:
+            return {"ok": False, "error": str(e)}
+
+def _bypass_refresh_loop():
+    # CDN-hosted domains move between addresses: keep their set entries current.
+    while True:
+        time.sleep(BYPASS_REFRESH_SECONDS)
+        if bypass.load()["domains"]:
+            _bypass_apply()
+
+def _ensure_bypass_refresher():
+    _start_bg("bypass-refresh", _bypass_refresh_loop)
+
+def _bypass_payload() -> dict:
+    _ensure_bypass_refresher()
     try:
-        with open("/proc/net/dev") as f:
-            for line in f:
-                if "usb0" in line:
-                    d = line.split()
-                    raw_rx, raw_tx = int(d[1]), int(d[9])
-                    t = time.time()
-
-                    prev_t = float(_traffic_raw_prev.get("time") or 0.0)
-                    if prev_t > 0:
-                        dt = max(t - prev_t, 0.001)
-                        stats["speed_rx"] = (raw_rx - int(_traffic_raw_prev.get("rx") or 0)) / dt
-                        stats["speed_tx"] = (raw_tx - int(_traffic_raw_prev.get("tx") or 0)) / dt
-
-                    _traffic_raw_prev.update({"rx": raw_rx, "tx": raw_tx, "time": t})
-
-                    off_rx = int(_traffic_offset.get("rx") or 0)
-                    off_tx = int(_traffic_offset.get("tx") or 0)
-                    stats.update({
-                        "rx": max(0, raw_rx - off_rx),
-                        "tx": max(0, raw_tx - off_tx),
-                        "time": t
-                    })
-                    break
+        counters = bypass.counters(_fw_snapshot())
     except Exception:
-        pass
-    return stats
+        counters = None
+    _value, age = _fw_cache.peek()
+    return {"ok": True, **bypass.load(), "applied": bypass.read_state(), "counters": counters,
+            "counters_age": round(age, 1) if age is not None else None}
+
+# ──────────────────────────────────────────────
+# Connection table — /proc/net/nf_conntrack folded incrementally into
+# conntrack.FlowTable; one pass per FLOWS_TTL however many viewers
+# ──────────────────────────────────────────────
+FLOWS_TTL = 2.0
+FLOWS_TOP = 10
+_flows_table = conntrack.FlowTable()
+_flows_lock = threading.Lock()
+_flows_cache = _SingleFlightCache(ttl=FLOWS_TTL, max_stale=30.0, accept=lambda s: isinstance(s, dict) and s.get("ok"))
+
+def _flows_load():
+    with _flows_lock:
+        try:
+            _flows_table.read()
+        except OSError as e:
+            return {"ok": False, "error": str(e)}
+        return {"ok": True, "error": None, **_flows_table.summary(FLOWS_TOP)}
+
+def _flows_snapshot():
+    return _flows_cache.get(_flows_load)
 
 # ──────────────────────────────────────────────
 # Privacy mode detection + (optional) anonrc ExitNodes helper
@@ -210,7 +834,7 @@ def update_stats():
 def _privacy_mode_active() -> bool:
     """
     Privacy mode is considered ACTIVE only when:
-    1) the DNAT to 127.0.0.1:9040 is present, AND
+    1) the redirect to the TransPort (127.0.0.1:9040) is present, AND
     2) privacy has been VERIFIED (marker file exists).
     This prevents UI claiming privacy ON when anon isn't ready, and avoids leaving host without internet.
     """
@@ -218,12 +842,10 @@ def _privacy_mode_active() -> bool:
         verified = os.path.exists("/var/lib/anyone-stick/privacy_verified")
         if not verified:
             return False
-        return subprocess.run(
-            "sudo iptables -t nat -S PREROUTING | grep -q -- '--to-destination 127.0.0.1:9040'",
-            shell=True, capture_output=True
-        ).returncode == 0
+        return bool(_fw_snapshot().get("privacy_redirect"))
     except Exception:
         return False
+
 def get_current_exit_country():
     return _exit_country_from_manager()
 
@@ -253,7 +875,7 @@ def set_exit_country_anonrc(country_code_upper: str):
 
     # Reload anon config via SIGHUP (best-effort)
     try:
-        pid = subprocess.check_output("pgrep -x anon", shell=True, text=True).strip().split("\n")[0]
+        pid = proctrace.check_output(["pgrep", "-x", "anon"], text=True).strip().split("\n")[0]
         os.kill(int(pid), signal.SIGHUP)
     except Exception:
         pass
@@ -262,96 +884,388 @@ def set_exit_country_anonrc(country_code_upper: str):
 # Anyone proof (socks) — lightweight, cached
 # ──────────────────────────────────────────────
 ANYONE_CHECK_URL = "https://check.en.anyone.tech/"
+SOCKS_PROXY = ("127.0.0.1", 9050)
 ANYONE_PROOF_TTL_SECONDS = 30
-_anyone_cache = {"ts": 0.0, "connected": False, "ip": "", "reason": "not_checked"}
-
-def _anyone_proof_check():
-    global _anyone_cache
-    now = time.time()
-    if (now - float(_anyone_cache.get("ts", 0.0))) < ANYONE_PROOF_TTL_SECONDS:
-        return _anyone_cache
-
-    def run_curl(url: str, max_time: str = "10", connect_timeout: str = "5"):
-        cmd = [
-            "curl", "-sS",
-            "--max-time", max_time,
-            "--connect-timeout", connect_timeout,
-            "--socks5-hostname", "127.0.0.1:9050",
-            url
-        ]
-        r = subprocess.run(cmd, capture_output=True, text=True)
-        body = (r.stdout or "") + "\n" + (r.stderr or "")
-        return r.returncode, body, (r.stdout or "")
-
-    connected = False
-    ip = ""
-    reason = "unknown"
-
-    # 1) Primary check page (nice UX when reachable)
-    rc, body, out = run_curl(ANYONE_CHECK_URL, max_time="10", connect_timeout="5")
-    if rc == 0:
+ANYONE_PROOF_MAX_STALE_SECONDS = 120
+ANYONE_PROOF_PROBES = (
+    # (name, url, timeout) — raced concurrently, first conclusive wins
+    ("checkpage", ANYONE_CHECK_URL, 10),
+    ("ipify", "https://api.ipify.org", 8),
+    ("ifconfig", "https://ifconfig.me/ip", 8),
+)
+# Probes get their own SOCKS credentials so anon keeps them on circuits
+# separate from client traffic (IsolateSOCKSAuth).
+ANYONE_PROOF_ISOLATION = ("anyone-stick", "proof")
+_anyone_cache = _SingleFlightCache(ttl=ANYONE_PROOF_TTL_SECONDS, max_stale=ANYONE_PROOF_MAX_STALE_SECONDS)
+_tunnel = socks5.TunnelHTTP(SOCKS_PROXY)
+
+def _proof_interpret(name: str, body: str) -> dict:
+    """One probe's verdict. Conclusive = connected through SOCKS and we know the exit IP."""
+    res = {"probe": name, "connected": None, "ip": "", "reason": "", "conclusive": False}
+    if name == "checkpage":
         if re.search(r"congratulations\.|you\s+can\s+be\s+anyone|connected\s+to\s+anyone", body, re.I):
-            connected = True
-            reason = "connected"
+            res.update(connected=True, reason="connected")
         elif re.search(r"(sorry\.|not\s+connected).*anyone", body, re.I):
-            connected = False
-            reason = "not_connected"
+            res.update(connected=False, reason="not_connected")
         else:
             # If the page loads via SOCKS, we treat that as connectivity OK
-            connected = True
-            reason = "socks_ok_checkpage"
-
+            res.update(connected=True, reason="socks_ok_checkpage")
         m = re.search(r"ip address appears to be:[\s<>/a-zA-Z]*?([0-9a-fA-F\.:]+)", body, re.I)
         if m:
-            ip = m.group(1).strip()
+            res["ip"] = m.group(1).strip()
     else:
-        reason = f"curl_rc_{rc}"
-
-    # 2) Fallback: fetch public IP via SOCKS (more reliable than a branded check page)
-    if not connected or not ip:
-        for url in ("https://api.ipify.org", "https://ifconfig.me/ip"):
-            rc2, body2, out2 = run_curl(url, max_time="8", connect_timeout="4")
-            cand = (out2 or "").strip()
-            if rc2 == 0 and re.fullmatch(r"[0-9]{1,3}(\.[0-9]{1,3}){3}", cand):
-                ip = cand
-                connected = True
-                reason = "socks_ok_ip"
-                break
-            if rc2 != 0 and reason.startswith("curl_rc_"):
-                reason = f"curl_rc_{rc2}"
-
-    # 3) Final fallback: use exit node IP from circuit-manager (no external call needed)
-    if not ip:
+        # Public IP via SOCKS (more reliable than a branded check page)
+        cand = (body or "").strip()
+        if re.fullmatch(r"[0-9]{1,3}(\.[0-9]{1,3}){3}", cand):
+            res.update(connected=True, ip=cand, reason="socks_ok_ip")
+        else:
+            res["reason"] = "bad_ip_response"
+    res["conclusive"] = bool(res["connected"] and res["ip"])
+    return res
+
+def _proof_error_reason(e: Exception) -> str:
+    if isinstance(e, socks5.Socks5Error):
+        return f"socks_rep_{e.reply}" if e.reply is not None else "socks_error"
+    if isinstance(e, ssl.SSLError):
+        return "tls_error"
+    if isinstance(e, (socket.timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(e, ConnectionRefusedError):
+        return "socks_down"
+    return "net_error"
+
+def _proof_race(probes=None):
+    """
+    Runs all probes at once over the in-process SOCKS client.
+    Returns (winner or None, [results received]); once one is conclusive the
+    others are cancelled (their tunnel streams are shut down).
+    """
+    probes = probes or ANYONE_PROOF_PROBES
+    results = queue.Queue()
+    reqs = [_tunnel.request("GET", url, timeout=timeout, isolation=ANYONE_PROOF_ISOLATION)
+            for _name, url, timeout in probes]
+
+    def run(name, req):
         try:
-            import requests as _rq
-            cr = _rq.get("http://127.0.0.1:8787/circuit", timeout=3).json()
-            hops = cr.get("hops") or []
-            exit_hop = next((h for h in hops if (h.get("role") or "").lower() == "exit"), None)
-            if exit_hop and exit_hop.get("ip"):
-                ip = exit_hop["ip"]
-                if not connected:
-                    connected = True
-                    reason = "cm_exit_ip"
-        except Exception:
-            pass
+            r = req.run()
+            res = _proof_interpret(name, r["body"].decode("utf-8", errors="replace"))
+            res["timings"] = r["timings"]
+            res["reused"] = r["reused"]
+        except Exception as e:
+            res = {"probe": name, "connected": None, "ip": "", "reason": _proof_error_reason(e),
+                   "error": str(e), "conclusive": False}
+        results.put(res)
+
+    for (name, _url, _t), req in zip(probes, reqs):
+        threading.Thread(target=run, args=(name, req), name=f"proof-{name}", daemon=True).start()
 
-    _anyone_cache.update({"ts": now, "connected": bool(connected), "ip": ip, "reason": reason})
-    return _anyone_cache
+    deadline = time.monotonic() + max(p[2] for p in probes) * 2 + 2.0
+    winner, got = None, []
+    while len(got) < len(probes):
+        try:
+            r = results.get(timeout=max(0.05, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        got.append(r)
+        if r["conclusive"]:
+            winner = r
+            break
+
+    for req in reqs:
+        req.cancel()
+    return winner, got
+
+def _anyone_proof_probe():
+    t0 = time.monotonic()
+    winner, got = _proof_race()
+    timings = None
+    if winner:
+        connected, ip, reason, probe = True, winner["ip"], winner["reason"], winner["probe"]
+        timings = winner.get("timings")
+    else:
+        ok = next((r for r in got if r["connected"]), None)
+        page = next((r for r in got if r["probe"] == "checkpage"), None)
+        ip = next((r["ip"] for r in got if r["ip"]), "")
+        if ok:
+            connected, reason, probe = True, ok["reason"], ok["probe"]
+        elif page and page["connected"] is False:
+            connected, reason, probe = False, page["reason"], page["probe"]
+        else:
+            connected, probe = False, None
+            reason = got[0]["reason"] if got else "timeout"
+
+        # Final fallback: use exit node IP from circuit-manager (no external call needed)
+        if not ip:
+            try:
+                cr = _cm_request("/circuit", timeout=3.0)
+                hops = cr.get("hops") or []
+                exit_hop = next((h for h in hops if (h.get("role") or "").lower() == "exit"), None)
+                if exit_hop and exit_hop.get("ip"):
+                    ip = exit_hop["ip"]
+                    if not connected:
+                        connected = True
+                        reason = "cm_exit_ip"
+            except Exception:
+                pass
+
+    return {"ts": time.time(), "connected": bool(connected), "ip": ip, "reason": reason,
+            "probe": probe, "probe_ms": round((time.monotonic() - t0) * 1000.0, 1), "probe_timings": timings}
+
+def _anyone_proof_refresher():
+    while True:
+        _anyone_cache.refresh(_anyone_proof_probe)
+        time.sleep(ANYONE_PROOF_TTL_SECONDS)
+
+def _anyone_proof_check():
+    """Last proof result with its age — never waits for probes (they run in the background)."""
+    _start_bg("anyone-proof", _anyone_proof_refresher)
+    st, age = _anyone_cache.peek()
+    if st is None:
+        return {"ts": 0.0, "connected": False, "ip": "", "reason": "not_checked", "age": None}
+    st = dict(st)
+    st["age"] = round(age, 1)
+    if age > ANYONE_PROOF_MAX_STALE_SECONDS:
+        st.update(connected=False, reason="stale")
+    return st
+
+def _anyone_proof_payload():
+    """
+    Proof result enriched with privacy mode and circuit-manager state (UI banner).
+    Never waits: like _bootstrap_state it reads the firewall and status caches
+    as they are (stale is fine, a background refresh is started); while either
+    has never loaded, connection_state is "checking".
+    """
+    st = _anyone_proof_check()
+    fw = _fw_cache.get_nowait(_fw_load)
+    privacy = None
+    if isinstance(fw, dict):
+        privacy = bool(fw.get("privacy_redirect")) and os.path.exists("/var/lib/anyone-stick/privacy_verified")
+
+    # Enrich with circuit-manager data
+    cm = _status_cache.get_nowait(_cm_status_load)
+    cm_ok = isinstance(cm, dict) and cm.get("ok", False)
+    bootstrapping = bool(cm.get("bootstrapping")) if cm_ok else False
+    circuit_count = int(cm.get("circuitsCached", 0)) if cm_ok else 0
+    country = cm.get("observed", {}).get("exitCountry") if cm_ok else None
+
+    socks_connected = bool(st.get("connected"))
+
+    # Determine connection_state based on ACTUAL connectivity, not just privacy mode
+    if privacy is None or (privacy and cm is None):
+        connection_state = "checking"
+    elif not privacy:
+        connection_state = "off"
+    elif socks_connected and cm_ok and circuit_count > 0 and not bootstrapping:
+        connection_state = "connected"
+    elif cm_ok and bootstrapping:
+        connection_state = "connecting"
+    elif cm_ok and circuit_count == 0:
+        connection_state = "connecting"
+    else:
+        connection_state = "disconnected"
+
+    st2 = dict(st)
+    st2.update({
+        "privacy": privacy,
+        "cm_ok": cm_ok,
+        "circuit_count": circuit_count,
+        "country": country,
+        "connection_state": connection_state,
+        "display_connected": bool(privacy) and socks_connected and cm_ok and circuit_count > 0,
+    })
+    return st2
 
 # ──────────────────────────────────────────────
 # Kill switch helpers
 # ──────────────────────────────────────────────
+def _killswitch_script_status():
+    def direct():
+        out = proctrace.check_output(["sudo", KILLSWITCH_SCRIPT, "status"], stderr=subprocess.STDOUT, text=True).strip()
+        return (out.upper() == "ON")
+    try:
+        return bool(_privileged("killswitch.get", direct))
+    except Exception:
+        return False
+
 def _killswitch_get():
     try:
-        out = subprocess.check_output(["sudo", KILLSWITCH_SCRIPT, "status"], stderr=subprocess.STDOUT, text=True).strip()
-        return (out.upper() == "ON")
+        return bool(_fw_snapshot().get("killswitch"))
     except Exception:
         return False
 
 def _killswitch_set(enabled: bool):
     cmd = "on" if enabled else "off"
-    out = subprocess.check_output(["sudo", KILLSWITCH_SCRIPT, cmd], stderr=subprocess.STDOUT, text=True).strip()
-    return (out.upper() == "ON")
+    def direct():
+        out = proctrace.check_output(["sudo", KILLSWITCH_SCRIPT, cmd], stderr=subprocess.STDOUT, text=True).strip()
+        return (out.upper() == "ON")
+    try:
+        return bool(_privileged("killswitch.set", direct, enabled=enabled))
+    finally:
+        _fw_invalidate()
+
+# ──────────────────────────────────────────────
+# Wi‑Fi scan cache — last result served at once with its age; radio
+# rescans rate-limited, in between NetworkManager's list is re-read
+# ──────────────────────────────────────────────
+WIFI_SCAN_TTL = 10.0
+WIFI_SCAN_MAX_STALE = 24 * 3600.0          # never block on a known list
+WIFI_RESCAN_MIN_INTERVAL = float(os.environ.get("WIFI_RESCAN_MIN_INTERVAL", "30"))
+
+_wifi_cache = _SingleFlightCache(ttl=WIFI_SCAN_TTL, max_stale=WIFI_SCAN_MAX_STALE,
+                                 accept=lambda v: isinstance(v, dict) and v.get("ok"))
+_wifi_last_rescan = 0.0   # monotonic; only touched by the single in-flight loader
+
+def _wifi_scan_load():
+    global _wifi_last_rescan
+    now = time.monotonic()
+    rescan = now - _wifi_last_rescan >= WIFI_RESCAN_MIN_INTERVAL
+    if rescan:
+        _wifi_last_rescan = now
+    return _privileged("wifi.scan", lambda: wifi.scan(rescan=rescan), timeout=25.0, rescan=rescan)
+
+def _wifi_scan(fresh: bool = False) -> dict:
+    """
+    Scan payload without waiting on the radio unless nothing is cached yet.
+    fresh=True (the Scan button) starts a background reload even inside the TTL.
+    """
+    v = _wifi_cache.get(_wifi_scan_load, ttl=0.0 if fresh else None)
+    if not isinstance(v, dict) or not v.get("ok"):
+        return {"ok": False, "error": v.get("error") if isinstance(v, dict) else "scan failed",
+                "networks": [], "age": None, "refreshing": False}
+    _, age = _wifi_cache.peek()
+    out = dict(v)
+    out.update(age=round(age, 1) if age is not None else None, refreshing=_wifi_cache.loading(),
+               next_rescan_in=round(max(0.0, WIFI_RESCAN_MIN_INTERVAL - (time.monotonic() - _wifi_last_rescan)), 1))
+    return out
+
+# ──────────────────────────────────────────────
+# Live events (SSE) — one producer, many subscribers
+# The producer only runs while at least one /api/events stream is open and
+# pushes a topic only when its JSON payload actually changed.
+# ──────────────────────────────────────────────
+EVENTS_TOPICS = {
+    # topic: (poll interval seconds, source)
+    "mode":       (4.0, lambda: {"privacy": bool(_privacy_mode_active())}),
+    "killswitch": (4.0, lambda: {"enabled": _killswitch_get()}),
+    "status":     (4.0, lambda: _cm_status_cached()),
+    # Pushed on ControlPort CIRC events; the interval is only a safety net then.
+    "circuit":    (lambda: 60.0 if _control.connected else 4.0,
+                   lambda: _cm_request("/circuit", "GET", None, timeout=12.0)),
+    "proof":      (7.0, lambda: _anyone_proof_payload()),
+    "traffic":    (2.0, lambda: update_stats()),
+    "clients":    (5.0, lambda: traffic_clients()),
+    "rotation":   (5.0, lambda: _cm_request("/rotation", "GET", None, timeout=3.0)),
+}
+# Sources that wait on the circuit-manager or forks run on their own thread, one
+# fetch in flight per topic, so a hung /circuit never holds up traffic or mode pushes.
+EVENTS_SLOW_TOPICS = {"status", "circuit", "clients", "rotation"}
+EVENTS_KEEPALIVE_SECONDS = 15.0
+EVENTS_QUEUE_MAX = 64
+
+_events_lock = threading.Lock()
+_events_subs = set()     # queue.Queue per open stream
+_events_last = {}        # topic -> last serialized payload
+_events_running = False
+_events_forced = set()   # topics to refresh on the next producer pass
+_events_wake = threading.Event()
+_events_inflight = set()  # slow topics whose fetch thread is still running
+
+def _events_nudge(*topics):
+    """Refresh topics now instead of at their next interval (no-op without subscribers)."""
+    with _events_lock:
+        if not _events_running:
+            return
+        _events_forced.update(topics)
+    _events_wake.set()
+
+def _events_publish(topic: str, data: str):
+    with _events_lock:
+        _events_last[topic] = data
+        subs = list(_events_subs)
+    for q in subs:
+        try:
+            q.put_nowait((topic, data))
+        except queue.Full:
+            # Slow/stalled client: end its stream; the browser reconnects and resyncs.
+            _events_close(q)
+
+def _events_close(q):
+    """Unsubscribes q and queues the end-of-stream marker (None), dropping backlog to make room."""
+    _events_unsubscribe(q)
+    while True:
+        try:
+            q.put_nowait(None)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+def _events_fetch(topic: str, source):
+    try:
+        with proctrace.context(f"events:{topic}"):
+            data = json.dumps(source(), sort_keys=True, separators=(",", ":"))
+    except Exception as e:
+        data = json.dumps({"ok": False, "error": str(e)})
+    with _events_lock:
+        changed = _events_last.get(topic) != data and bool(_events_subs)
+    if changed:
+        _events_publish(topic, data)
+
+def _events_fetch_bg(topic: str, source):
+    try:
+        _events_fetch(topic, source)
+    finally:
+        with _events_lock:
+            _events_inflight.discard(topic)
+
+def _events_producer_loop():
+    global _events_running
+    due = {t: 0.0 for t in EVENTS_TOPICS}
+    while True:
+        with _events_lock:
+            if not _events_subs:
+                _events_last.clear()
+                _events_running = False
+                return
+            for topic in _events_forced:
+                due[topic] = 0.0
+            _events_forced.clear()
+        now = time.monotonic()
+        for topic, (interval, source) in EVENTS_TOPICS.items():
+            if now < due[topic]:
+                continue
+            due[topic] = now + (interval() if callable(interval) else interval)
+            if topic not in EVENTS_SLOW_TOPICS:
+                _events_fetch(topic, source)
+                continue
+            with _events_lock:
+                if topic in _events_inflight:
+                    continue
+                _events_inflight.add(topic)
+            threading.Thread(target=_events_fetch_bg, args=(topic, source), name=f"events-{topic}", daemon=True).start()
+        _events_wake.wait(max(0.1, min(due.values()) - time.monotonic()))
+        _events_wake.clear()
+
+def _events_subscribe():
+    global _events_running
+    q = queue.Queue(maxsize=EVENTS_QUEUE_MAX)
+    with _events_lock:
+        _events_subs.add(q)
+        # New streams start from the current snapshot instead of waiting a full cycle.
+        for topic, data in _events_last.items():
+            q.put_nowait((topic, data))
+        start = not _events_running
+        _events_running = True
+    if start:
+        _ensure_control()
+        threading.Thread(target=_events_producer_loop, name="events-producer", daemon=True).start()
+    return q
+
+def _events_unsubscribe(q):
+    with _events_lock:
+        _events_subs.discard(q)
 
 # ──────────────────────────────────────────────
 # UI (kept compact; JS polls Node + proof + traffic)
@@ -362,11 +1276,11 @@ HTML = r"""
 <head>
 <meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
 <title>Anyone Privacy Stick</title>
-<link href="https://fonts.googleapis.com/css2?family=Mona+Sans:wght@200..900&display=swap" rel="stylesheet">
+__ASSET_HEAD__
 <style>
   :root { --primary:#0280AF; --secondary:#03BDC5; --gradient:linear-gradient(90deg,#0280AF 0%,#03BDC5 100%); --bg:#0b1116; --card:#151b23; --text:#FFF; --dim:#8b949e; --border:#30363d; }
   * { box-sizing:border-box; }
-  body { font-family:"Mona Sans",sans-serif; background:var(--bg); color:var(--text); margin:0; padding:20px 20px 80px; display:flex; flex-direction:column; align-items:center; }
+  body { font-family:"Mona Sans",system-ui,-apple-system,"Segoe UI",Roboto,sans-serif; background:var(--bg); color:var(--text); margin:0; padding:20px 20px 80px; display:flex; flex-direction:column; align-items:center; }
   .container { width:100%; max-width:420px; }
   .logo-img { max-width:180px; height:auto; display:block; margin:0 auto 20px; }
   .card { background:var(--card); border:1px solid var(--border); border-radius:12px; padding:20px; margin-bottom:16px; }
@@ -427,6 +1341,7 @@ HTML = r"""
   .proof-sub { display:block; margin-top: 4px; font-size: 11px; font-weight: 800; opacity: 0.95; text-transform: none; letter-spacing: 0; }
 
   .wifi-item { padding:12px; border-bottom:1px solid var(--border); cursor:pointer; display:flex; justify-content:space-between; font-size:14px; }
+  .wifi-meta { color:var(--dim); font-size:12px; margin-right:8px; }
   .connected-label { color:var(--secondary); font-weight:900; font-size:10px; border:1px solid var(--secondary); padding:2px 6px; border-radius:6px; }
 
   /* MODE BOX (LOUD) */
@@ -515,18 +1430,16 @@ HTML = r"""
 </head>
 <body>
 <div class="container">
-  {% if mode_error %}
-  <div class="card" style="border-color: rgba(248,81,73,0.55); background: rgba(248,81,73,0.10);">
+  <div class="card" id="mode-error" style="display:none; border-color: rgba(248,81,73,0.55); background: rgba(248,81,73,0.10);">
     <h3 style="color:#ff8a84;">Mode switch failed</h3>
     <div class="muted" style="color:#ffb4b0; font-weight:800;">
       Enable Privacy did not complete successfully. Your routing was not changed.
       Please check Wi-Fi / anon bootstrap and try again.
     </div>
-    <div class="muted" style="margin-top:8px;">Details: <span class="mono">{{ mode_error }}</span></div>
+    <div class="muted" style="margin-top:8px;">Details: <span class="mono" id="mode-error-detail"></span></div>
   </div>
-  {% endif %}
 
-  <img src="/static/logo.png" class="logo-img">
+  <img src="__LOGO_SRC__" class="logo-img" alt="Anyone"__LOGO_SIZE__>
 
   <div class="card">
     <h3>Kill Switch</h3>
@@ -647,23 +1560,17 @@ HTML = r"""
       <div class="card">
       <h3>Mode</h3>
 
-      <div class="mode-box {{ 'privacy' if privacy else 'normal' }}">
-        <div class="mode-icon">{{ '🔒' if privacy else '🌐' }}</div>
+      <div class="mode-box" id="mode-box" data-privacy="">
+        <div class="mode-icon" id="mode-icon">…</div>
         <div style="min-width:0;">
-          <div class="mode-title">{{ 'PRIVACY MODE — ACTIVE' if privacy else 'NORMAL MODE — ACTIVE' }}</div>
-          <div class="mode-sub">
-            {{ 'All client traffic is routed through Anyone (transparent proxy).' if privacy else 'Traffic goes directly to the internet (no Anyone routing).' }}
-          </div>
-          <div class="mode-route">
-            {{ 'ROUTING: VIA ANYONE' if privacy else 'ROUTING: DIRECT' }}
-          </div>
+          <div class="mode-title" id="mode-title">MODE — CHECKING…</div>
+          <div class="mode-sub" id="mode-sub">Reading the current routing state.</div>
+          <div class="mode-route" id="mode-route">ROUTING: —</div>
         </div>
       </div>
 
-      <form action="/mode/{{ 'normal' if privacy else 'privacy' }}" method="post">
-        <button class="{{ 'btn-secondary' if privacy else 'btn-primary' }}">
-          {{ 'Switch to Normal (disable privacy)' if privacy else 'Enable Privacy (route via Anyone)' }}
-        </button>
+      <form action="/mode/privacy" method="post" id="mode-form">
+        <button class="btn-secondary" id="mode-btn" disabled>…</button>
       </form>
 
       <div class="helper-text" style="margin-top:10px;">
@@ -678,7 +1585,9 @@ HTML = r"""
             <option value="AUTO">&#127758; Automatic (Best Available)</option>
           </select>
     <button class="btn-secondary" style="margin-top:10px" id="exit-apply">Apply Exit Country</button>
-    <div class="muted" style="margin-top:8px">Configured (manager): <span class="mono" id="exit-current">{{ exit_country }}</span></div>
+    <button class="btn-secondary" style="margin-top:8px" id="exit-pin">☆ Keep circuits ready for this country</button>
+    <div class="muted" style="margin-top:8px">Configured (manager): <span class="mono" id="exit-current">—</span></div>
+    <div class="muted" style="margin-top:4px">Ready circuits: <span class="mono" id="exit-pool">—</span></div>
   </div>
 
   <div class="card">
@@ -687,12 +1596,14 @@ HTML = r"""
       <div><div class="muted">DOWNLOAD</div><div style="font-size:18px;font-weight:900" id="rx">0 MB</div><div class="muted" id="s_rx">0 KB/s</div></div>
       <div><div class="muted">UPLOAD</div><div style="font-size:18px;font-weight:900" id="tx">0 MB</div><div class="muted" id="s_tx">0 KB/s</div></div>
     </div>
+    <div id="clients" style="margin-top:10px"></div>
     <button class="btn-secondary" style="margin-top:10px" id="traffic-reset">⟲ Reset totals</button>
   </div>
 
   <div class="card">
     <h3>Wi‑Fi</h3>
     <button class="btn-secondary" id="scan-btn">Scan Networks</button>
+    <div class="muted" id="wifi-age" style="margin-top:8px"></div>
     <div id="list" style="margin-top:10px"></div>
     <div id="connect" style="display:none;margin-top:14px">
       <div style="font-weight:800" id="ssid-name"></div>
@@ -707,9 +1618,13 @@ HTML = r"""
   <span class="proof-sub" id="proof-sub">Checking…</span>
 </div>
 
+<script id="boot" type="application/json">__BOOTSTRAP__</script>
 <script>
 let targetSSID = '';
 
+// Server state embedded in the page (from the portal's caches; fields may be null right after boot)
+const BOOT = (()=>{ try { return JSON.parse(document.getElementById('boot').textContent || '{}'); } catch(e){ return {}; } })();
+
 function safeBind(id, evt, fn){
   const el = document.getElementById(id);
   if(!el) return false;
@@ -809,10 +1724,24 @@ function setHopUiBusy(on, label){
   }
 }
 
+// Circuit events from the live stream (server pushes on anon CIRC events).
+let __events = null;
+let __circuitWaiters = [];
+function nextCircuitEvent(ms){
+  return new Promise(resolve => {
+    const fn = (d) => { clearTimeout(t); resolve(d); };
+    const t = setTimeout(() => { __circuitWaiters = __circuitWaiters.filter(f => f !== fn); resolve(null); }, Math.max(0, ms));
+    __circuitWaiters.push(fn);
+  });
+}
+
 async function waitForCircuitChange(prevKey, timeoutMs=15000){
   const t0 = Date.now();
   while ((Date.now() - t0) < timeoutMs){
-    const d = await jget('/api/cm/circuit', 2500).catch(()=>({hops:[]}));
+    const live = !!(__events && __events.readyState === 1);
+    const d = live
+      ? await nextCircuitEvent(timeoutMs - (Date.now() - t0))
+      : await jget('/api/cm/circuit', 2500).catch(()=>({hops:[]}));
     const hops = (d && d.hops) ? d.hops : [];
     if (hops && hops.length){
       const key = hops.map(h => [
@@ -826,7 +1755,7 @@ async function waitForCircuitChange(prevKey, timeoutMs=15000){
 
       if (key && key !== (prevKey || "")) return { ok:true, hops, key };
     }
-    await new Promise(r => setTimeout(r, 250));
+    if (!live) await new Promise(r => setTimeout(r, 250));
   }
   return { ok:false, hops:[], key: prevKey || "" };
 }
@@ -1036,10 +1965,14 @@ async function refreshStatus(){
 }
 
 async function refreshCircuit(){
+  const d = await jget('/api/cm/circuit', 8000).catch(()=>({hops:[]}));
+  applyCircuit(d);
+}
+
+function applyCircuit(d){
   window.__lastGoodHops = window.__lastGoodHops || [];
   window.__lastGoodTs = window.__lastGoodTs || 0;
 
-  const d = await jget('/api/cm/circuit', 8000).catch(()=>({hops:[]}));
   const hops = (d && d.hops) ? d.hops : [];
 
   const now = Date.now();
@@ -1153,7 +2086,13 @@ async function newnym(){
 }
 
 async function updateProof(){
-  jget('/api/anyone/proof', 18000).then(function(st){
+  jget('/api/anyone/proof', 18000).then(applyProof).catch(function(){
+    var main = document.getElementById('proof-main');
+    if (main) main.textContent = 'Checking connection\u2026';
+  });
+}
+
+function applyProof(st){
     if (!st) st = {connected:false, ip:'', privacy:false, connection_state:'disconnected'};
     var b = document.getElementById('proof-banner');
     var sub = document.getElementById('proof-sub');
@@ -1166,6 +2105,9 @@ async function updateProof(){
     } else if (connState === 'connecting') {
       if (b) b.className = 'proof-banner connecting';
       if (main) main.textContent = 'Connecting to Anyone\u2026';
+    } else if (connState === 'checking') {
+      if (b) b.className = 'proof-banner connecting';
+      if (main) main.textContent = 'Checking connection\u2026';
     } else if (connState === 'off') {
       if (b) b.className = 'proof-banner disconnected';
       if (main) main.textContent = 'Privacy Mode is OFF';
@@ -1174,17 +2116,18 @@ async function updateProof(){
       if (main) main.textContent = 'Not connected to Anyone';
     }
     var msg = '';
-    if (!st.privacy) msg += 'Privacy mode is OFF. ';
+    if (st.privacy === false) msg += 'Privacy mode is OFF. ';
     if (st.privacy && st.ip) msg += 'Exit IP: ' + st.ip + '. ';
+    if (st.privacy && st.age != null) msg += 'Checked ' + fmtAge(st.age) + ' ago.';
     if (sub) sub.textContent = msg.trim() || '\u2014';
-  }).catch(function(){
-    var main = document.getElementById('proof-main');
-    if (main) main.textContent = 'Checking connection\u2026';
-  });
 }
 
 async function pollTraffic(){
   const d = await jget('/api/traffic', 2000).catch(()=>null);
+  applyTraffic(d);
+}
+
+function applyTraffic(d){
   if(!d) return;
   document.getElementById('rx').textContent = (d.rx/1048576).toFixed(1)+' MB';
   document.getElementById('tx').textContent = (d.tx/1048576).toFixed(1)+' MB';
@@ -1192,14 +2135,73 @@ async function pollTraffic(){
   document.getElementById('s_tx').textContent = d.speed_tx>1048576?(d.speed_tx/1048576).toFixed(1)+' MB/s':(d.speed_tx/1024).toFixed(1)+' KB/s';
 }
 
+function fmtRate(b){ return b>1048576?(b/1048576).toFixed(1)+' MB/s':(b/1024).toFixed(1)+' KB/s'; }
+
+async function pollClients(){
+  const d = await jget('/api/traffic/clients', 4000).catch(()=>null);
+  applyClients(d);
+}
+
+function applyClients(d){
+  const box = document.getElementById('clients');
+  if(!box || !d) return;
+  box.innerHTML = '';
+  const rows = d.clients || [];
+  if (rows.length < 2) return; // one device: the totals above say it all
+  rows.forEach(c=>{
+    const div = document.createElement('div');
+    div.className = 'wifi-item';
+    const left = document.createElement('span');
+    left.textContent = c.hostname || c.ip;
+    left.title = [c.ip, c.mac].filter(Boolean).join(' · ');
+    const right = document.createElement('span');
+    right.className = 'wifi-meta';
+    right.textContent = '↓ ' + fmtRate(c.speed_rx) + ' · ↑ ' + fmtRate(c.speed_tx) + ' · ' + ((c.rx + c.tx)/1048576).toFixed(1) + ' MB';
+    div.appendChild(left); div.appendChild(right);
+    box.appendChild(div);
+  });
+}
+
 async function resetTraffic(){
   await jpost('/api/traffic/reset', {}, 2500).catch(()=>null);
   await pollTraffic();
+  await pollClients();
+}
+
+// Mode box (pushed via /api/events or polled; first paint from BOOT when the firewall state is cached)
+async function refreshMode(){
+  const st = await jget('/api/mode', 3000).catch(()=>null);
+  if (st && st.ok) applyMode(st);
+}
+
+function applyMode(st){
+  if(!st) return;
+  const box = document.getElementById('mode-box');
+  if(!box) return;
+  const privacy = !!st.privacy;
+  if (box.dataset.privacy === (privacy ? '1' : '0')) return;
+  box.dataset.privacy = privacy ? '1' : '0';
+  box.className = 'mode-box ' + (privacy ? 'privacy' : 'normal');
+  document.getElementById('mode-icon').textContent = privacy ? '🔒' : '🌐';
+  document.getElementById('mode-title').textContent = privacy ? 'PRIVACY MODE — ACTIVE' : 'NORMAL MODE — ACTIVE';
+  document.getElementById('mode-sub').textContent = privacy
+    ? 'All client traffic is routed through Anyone (transparent proxy).'
+    : 'Traffic goes directly to the internet (no Anyone routing).';
+  document.getElementById('mode-route').textContent = privacy ? 'ROUTING: VIA ANYONE' : 'ROUTING: DIRECT';
+  document.getElementById('mode-form').action = '/mode/' + (privacy ? 'normal' : 'privacy');
+  const btn = document.getElementById('mode-btn');
+  btn.disabled = false;
+  btn.className = privacy ? 'btn-secondary' : 'btn-primary';
+  btn.textContent = privacy ? 'Switch to Normal (disable privacy)' : 'Enable Privacy (route via Anyone)';
 }
 
 // Kill Switch UI
 async function refreshKillSwitch(){
   const st = await jget('/api/killswitch/status', 2000).catch(()=>({enabled:false}));
+  applyKillSwitch(st);
+}
+
+function applyKillSwitch(st){
   const btn = document.getElementById('ks-btn');
   const sub = document.getElementById('ks-sub');
   const on = !!st.enabled;
@@ -1219,25 +2221,48 @@ async function toggleKillSwitch(){
 async function scan(){
   const btn = document.getElementById('scan-btn');
   btn.disabled = true; btn.textContent = 'Scanning…';
-  const container = document.getElementById('list');
-  container.innerHTML = '';
   try{
-    const d = await jget('/wifi/scan', 15000);
-    (d.networks||[]).forEach(n=>{
-      const div = document.createElement('div');
-      div.className = 'wifi-item';
-      const left = document.createElement('span');
-      left.textContent = n.ssid;
-      const right = document.createElement('span');
-      right.innerHTML = n.connected ? '<span class="connected-label">CONNECTED</span>' : '›';
-      div.appendChild(left); div.appendChild(right);
-      div.addEventListener('click', ()=>sel(n.ssid));
-      container.appendChild(div);
-    });
+    let d = await jget('/wifi/scan?fresh=1', 30000);
+    renderNetworks(d);
+    // Cached list shown at once; pick up the background rescan when it lands.
+    if (d && d.refreshing){
+      await new Promise(r=>setTimeout(r, 4000));
+      d = await jget('/wifi/scan', 15000);
+      renderNetworks(d);
+    }
   } catch(e){} finally {
     btn.disabled = false; btn.textContent = 'Scan Networks';
   }
 }
+function renderNetworks(d){
+  const container = document.getElementById('list');
+  container.innerHTML = '';
+  const age = document.getElementById('wifi-age');
+  if (d && d.ok === false) age.textContent = 'Scan failed' + (d.error ? ': ' + d.error : '');
+  else if (d && d.age != null) age.textContent = 'Updated ' + fmtAge(d.age) + ' ago' + (d.refreshing ? ' · rescanning…' : '');
+  else age.textContent = '';
+  ((d && d.networks)||[]).forEach(n=>{
+    const div = document.createElement('div');
+    div.className = 'wifi-item';
+    const left = document.createElement('span');
+    left.textContent = n.ssid;
+    const right = document.createElement('span');
+    const meta = document.createElement('span');
+    meta.className = 'wifi-meta';
+    meta.textContent = (n.security ? '🔒 ' : '') + n.signal + '%' + (n.bssids > 1 ? ' · ' + n.bssids + ' APs' : '');
+    right.appendChild(meta);
+    if (n.connected){
+      const c = document.createElement('span');
+      c.className = 'connected-label'; c.textContent = 'CONNECTED';
+      right.appendChild(c);
+    } else {
+      right.appendChild(document.createTextNode('›'));
+    }
+    div.appendChild(left); div.appendChild(right);
+    div.addEventListener('click', ()=>sel(n.ssid));
+    container.appendChild(div);
+  });
+}
 function sel(ssid){
   targetSSID = ssid;
   document.getElementById('ssid-name').textContent = ssid;
@@ -1263,8 +2288,13 @@ async function connectWifi(){
 async function waitForExit(targetCC, timeoutMs=12000){
   const want = String(targetCC || '').toUpperCase();
   const t0 = Date.now();
+  let first = true;
   while ((Date.now() - t0) < timeoutMs){
-    const d = await jget('/api/cm/circuit', 2500).catch(()=>({hops:[]}));
+    const live = !first && !!(__events && __events.readyState === 1);
+    first = false;
+    const d = live
+      ? await nextCircuitEvent(timeoutMs - (Date.now() - t0))
+      : await jget('/api/cm/circuit', 2500).catch(()=>({hops:[]}));
     const hops = (d && d.hops) ? d.hops : [];
     if (hops.length){
       const exitHop = hops.find(h => (h.role || '').toLowerCase() === 'exit') || hops[hops.length-1];
@@ -1275,11 +2305,44 @@ async function waitForExit(targetCC, timeoutMs=12000){
       }
       if (got && got === want) return true;
     }
-    await new Promise(r => setTimeout(r, 5000));
+    if (!live) await new Promise(r => setTimeout(r, 5000));
   }
   return false;
 }
 
+// Pre-built circuit pool (pinned exit countries)
+let __poolCountries = [];
+function renderPool(p){
+  __poolCountries = (p && p.countries) || [];
+  const el = document.getElementById('exit-pool');
+  if (el){
+    const parts = __poolCountries.map(cc => cc + ' ×' + (((p.pool || {})[cc]) || []).length);
+    const rate = (p && p.hit_rate != null) ? ' · hit rate ' + Math.round(p.hit_rate * 100) + '%' : '';
+    if (p && p.support === 'off') el.textContent = 'off';
+    else if (p && p.support === 'unsupported') el.textContent = 'unused — the circuit-manager ignores offered circuits';
+    else el.textContent = parts.length ? parts.join(', ') + rate : 'none pinned';
+  }
+  const off = !p || p.support === 'off' || p.support === 'unsupported';
+  const cc = document.getElementById('exit-select')?.value || 'AUTO';
+  const btn = document.getElementById('exit-pin');
+  if (btn){
+    btn.disabled = cc === 'AUTO' || off;
+    btn.textContent = __poolCountries.includes(cc) ? '★ Circuits kept ready — unpin' : '☆ Keep circuits ready for this country';
+  }
+}
+async function refreshPool(){
+  const p = await jget('/api/cm/pool', 2500).catch(()=>null);
+  if (p) renderPool(p);
+}
+async function togglePin(){
+  const cc = document.getElementById('exit-select')?.value || 'AUTO';
+  if (cc === 'AUTO') return;
+  const countries = __poolCountries.includes(cc) ? __poolCountries.filter(c => c !== cc) : [...__poolCountries, cc];
+  const p = await jpost('/api/cm/pool', { countries }, 5000).catch(e=>({ok:false,error:String(e)}));
+  if (!p || !p.ok) showJsError('Pin failed: ' + ((p && p.error) || 'unknown error'));
+  else renderPool(p);
+}
+
 
 async function applyExit(){
   const cc = document.getElementById('exit-select')?.value || 'AUTO';
@@ -1297,9 +2360,10 @@ async function applyExit(){
     }
 
     await refreshStatus();
-    // wait for circuit to be BUILT (and optionally match exit)
-    await waitForExit(cc, 20000);
+    // wait for circuit to be BUILT (and optionally match exit); a pool hit is already built
+    await waitForExit(cc, (resp.pool && resp.pool.hit) ? 5000 : 20000);
     await refreshCircuit();
+    refreshPool();
 
     // authoritative display
     await initExitUi();
@@ -1376,6 +2440,8 @@ safeBind('scan-btn','click', scan);
 safeBind('conn-btn','click', connectWifi);
 safeBind('ks-btn','click', toggleKillSwitch);
 safeBind('exit-apply','click', applyExit);
+safeBind('exit-pin','click', togglePin);
+safeBind('exit-select','change', refreshPool);
 
 // Timers
 
@@ -1397,31 +2463,35 @@ async function pollModeSwitch(){
 
   // show switching for longer (mode switch may take > 15s on cold start)
   uiSetSwitching(true, 60000);
-  try{
-    let tries = 0;
-    while (tries++ < 240){ // ~120s at 500ms
-      const cur = await jget('/api/mode/switch', 1500).catch(()=>({running:false}));
-      if (!cur || !cur.running){
-        // switch finished -> reload clean URL without query params
-        window.location.href = '/';
-        return;
-      }
-      await new Promise(r => setTimeout(r, 500));
-    }
-    // timeout -> reload anyway (shows error card if backend wrote one)
-    window.location.href = '/';
-  } finally {
-    // UI will reset on reload
+  const t0 = Date.now();
+  let cur = null;
+  // Long-poll: the server answers as soon as the switch ends (or after 25s).
+  while ((Date.now() - t0) < 120000){
+    cur = await jget('/api/mode/switch?wait=25', 30000).catch(()=>null);
+    if (cur && !cur.running) break;
+    if (!cur) await new Promise(r => setTimeout(r, 1000));  // portal busy/restarting
   }
+  // finished (or timed out) -> reload clean URL, with the error card if the switch failed
+  const failed = cur && !cur.running && cur.exit != null && cur.exit !== 0;
+  window.location.href = failed ? '/?mode_error=' + encodeURIComponent(cur.error || cur.result || ('exit ' + cur.exit)) : '/';
 }
 // Kick off early on load
 pollModeSwitch().catch(()=>{});
-refreshKillSwitch(); setInterval(refreshKillSwitch, 4000);
-initExitUi();
-refreshStatus(); setInterval(refreshStatus, 4000);
-refreshCircuit(); setInterval(refreshCircuit, 4000);
-updateProof(); setInterval(updateProof, 7000);
-pollTraffic(); setInterval(pollTraffic, 5000);
+
+// First paint from the bootstrap; the event stream fills in the rest.
+(function applyBootstrap(){
+  if (typeof BOOT.privacy === 'boolean') applyMode({privacy: BOOT.privacy});
+  else refreshMode();   // firewall cache was cold (e.g. the reload right after a mode switch)
+  if (typeof BOOT.killswitch === 'boolean') applyKillSwitch({enabled: BOOT.killswitch});
+  const ec = document.getElementById('exit-current');
+  if (ec && BOOT.exit_country) ec.textContent = BOOT.exit_country;
+  const err = qs('mode_error');
+  if (err){
+    document.getElementById('mode-error-detail').textContent = err;
+    document.getElementById('mode-error').style.display = 'block';
+  }
+})();
+initExitUi().then(refreshPool);
 
 // ================= Rotation =================
 let __rotNextTs = 0;
@@ -1437,6 +2507,10 @@ function fmtCountdown(sec){
 
 async function refreshRotation(){
   const d = await jget('/api/cm/rotation', 2500).catch(()=>null);
+  applyRotation(d);
+}
+
+function applyRotation(d){
   if(!d) return;
 
   document.getElementById('rot-privacy').textContent =
@@ -1584,21 +2658,295 @@ safeBind('rot-toggle','click', toggleRotation);
 safeBind('rot-save','click', saveRotation);
 safeBind('rot-trigger','click', triggerRotation);
 
-refreshRotation();
-setInterval(refreshRotation, 5000);
 setInterval(updateRotationCountdown, 1000);
+
+// ================= Live state: SSE with polling fallback =================
+// One EventSource replaces the refresh timers. The server pushes only
+// changed topics; if the stream drops we poll until it reconnects.
+let __pollTimers = [];
+
+function startPolling(){
+  if (__pollTimers.length) return;
+  refreshMode(); refreshKillSwitch(); refreshStatus(); refreshCircuit(); updateProof(); pollTraffic(); pollClients(); refreshRotation();
+  __pollTimers = [
+    setInterval(refreshMode, 4000),
+    setInterval(refreshKillSwitch, 4000),
+    setInterval(refreshStatus, 4000),
+    setInterval(refreshCircuit, 4000),
+    setInterval(updateProof, 7000),
+    setInterval(pollTraffic, 5000),
+    setInterval(pollClients, 10000),
+    setInterval(refreshRotation, 5000),
+  ];
+}
+
+function stopPolling(){
+  __pollTimers.forEach(clearInterval);
+  __pollTimers = [];
+}
+
+function startEvents(){
+  if (!window.EventSource){ startPolling(); return; }
+  const es = __events = new EventSource('/api/events');
+  const on = (topic, fn) => es.addEventListener(topic, (e)=>{
+    try { fn(JSON.parse(e.data)); } catch(err){ showJsError(String(err)); }
+  });
+  on('mode', applyMode);
+  on('killswitch', applyKillSwitch);
+  on('status', updateConn);
+  on('circuit', (d)=>{ applyCircuit(d); __circuitWaiters.splice(0).forEach(fn => fn(d)); });
+  on('proof', applyProof);
+  on('traffic', applyTraffic);
+  on('clients', applyClients);
+  on('rotation', applyRotation);
+  es.addEventListener('open', stopPolling);
+  // EventSource reconnects by itself; poll in the meantime.
+  es.addEventListener('error', startPolling);
+}
+startEvents();
 // ============================================================
 </script>
 </body></html>
 """
 
+# ──────────────────────────────────────────────
+# Static assets — content-hashed output of build_assets.py
+# (static/dist/manifest.json), served precompressed and immutable
+# ──────────────────────────────────────────────
+ASSET_DIR = os.path.join(app.root_path, "static", "dist")
+ASSET_URL = "/assets/"
+ASSET_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_ASSET_ENC_SUFFIX = {"br": ".br", "gzip": ".gz"}
+
+def _load_asset_manifest() -> dict:
+    try:
+        with open(os.path.join(ASSET_DIR, "manifest.json"), encoding="utf-8") as f:
+            return json.load(f).get("assets") or {}
+    except Exception:
+        return {}
+
+_assets = _load_asset_manifest()
+_asset_files = {a["file"]: a for a in _assets.values() if isinstance(a, dict) and a.get("file")}
+_asset_lock = threading.Lock()
+_asset_blobs = {}   # (file, encoding) -> bytes; a few files, read once
+
+def _asset_head() -> str:
+    """Preload + @font-face for the bundled font; empty (system font stack) when none was built."""
+    font = _assets.get("font")
+    if not font:
+        return ""
+    url = ASSET_URL + font["file"]
+    ext = font["file"].rsplit(".", 1)[-1]
+    fmt = {"ttf": "truetype", "otf": "opentype"}.get(ext, ext)
+    return (f'<link rel="preload" href="{url}" as="font" type="{font["type"]}" crossorigin>\n'
+            f'<style>@font-face {{ font-family:"Mona Sans"; src:url({url}) format("{fmt}"); '
+            f'font-weight:200 900; font-display:swap; }}</style>')
+
+def _with_assets(html: str) -> str:
+    logo = _assets.get("logo")
+    src = ASSET_URL + logo["file"] if logo else "/static/logo.png"
+    size = f' width="{logo["width"]}" height="{logo["height"]}"' if logo and logo.get("width") else ""
+    return html.replace("__ASSET_HEAD__", _asset_head()).replace("__LOGO_SRC__", src).replace("__LOGO_SIZE__", size)
+
+def _accepted_encodings() -> set:
+    out = set()
+    for part in (request.headers.get("Accept-Encoding") or "").split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        if "q=" in params:
+            try:
+                q = float(params.split("q=", 1)[1])
+            except ValueError:
+                pass
+        if token and q > 0:
+            out.add(token.lower())
+    return out
+
+def _asset_blob(name: str, enc: str | None) -> bytes:
+    key = (name, enc)
+    with _asset_lock:
+        blob = _asset_blobs.get(key)
+    if blob is None:
+        with open(os.path.join(ASSET_DIR, name + _ASSET_ENC_SUFFIX.get(enc, "")), "rb") as f:
+            blob = f.read()
+        with _asset_lock:
+            _asset_blobs[key] = blob
+    return blob
+
+# ──────────────────────────────────────────────
+# Portal shell — compiled once; per-request work is a tiny JSON bootstrap
+# built from the caches (never waits on iptables or the circuit-manager)
+# ──────────────────────────────────────────────
+_SHELL_HEAD, _SHELL_TAIL = (p.encode("utf-8") for p in _with_assets(HTML).split("__BOOTSTRAP__"))
+_shell_lock = threading.Lock()
+_shell_variants = {}   # bootstrap bytes -> (body, gzip body, etag); a handful of states at most
+
+def _bootstrap_state() -> dict:
+    fw = _fw_cache.get_nowait(_fw_load)
+    privacy = None
+    if isinstance(fw, dict):
+        privacy = bool(fw.get("privacy_redirect")) and os.path.exists("/var/lib/anyone-stick/privacy_verified")
+    cm = _status_cache.get_nowait(_cm_status_load)
+    exit_country = None
+    if isinstance(cm, dict):
+        ecs = cm.get("exitCountries") or []
+        exit_country = (str(ecs[0] or "").strip().upper() or "AUTO") if isinstance(ecs, list) and ecs else "AUTO"
+    return {
+        "privacy": privacy,
+        "killswitch": fw.get("killswitch") if isinstance(fw, dict) else None,
+        "exit_country": exit_country,
+    }
+
+def _shell_for(state: dict):
+    boot = json.dumps(state, sort_keys=True, separators=(",", ":")).replace("</", "<\\/").encode("utf-8")
+    with _shell_lock:
+        hit = _shell_variants.get(boot)
+    if hit:
+        return hit
+    body = _SHELL_HEAD + boot + _SHELL_TAIL
+    gz = gzip.compress(body, compresslevel=9, mtime=0)
+    etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+    with _shell_lock:
+        if len(_shell_variants) >= 8:
+            _shell_variants.clear()
+        _shell_variants[boot] = (body, gz, etag)
+    return body, gz, etag
+
+# ──────────────────────────────────────────────
+# Metrics (/metrics) — per-route latency and in-flight requests; upstream,
+# cache, subprocess and traffic figures are read from their owners
+# ──────────────────────────────────────────────
+_HTTP_LATENCY = metrics.Histogram("portal_http_request_duration_seconds", "Portal request latency (to headers)",
+                                  ("route", "method"))
+_HTTP_REQUESTS = metrics.Counter("portal_http_requests_total", "Portal requests", ("route", "method", "status"))
+_HTTP_INFLIGHT = metrics.Gauge("portal_http_requests_in_flight", "Portal requests being handled", ("route",))
+
+_METRIC_CACHES = {
+    "status": _status_cache, "anyone": _anyone_cache, "exits": _exits_cache,
+    "firewall": _fw_cache, "wifi": _wifi_cache, "flows": _flows_cache,
+}
+
+def _cache_counts():
+    return {(name, k): v for name, c in _METRIC_CACHES.items() for k, v in c.counts.items()}
+
+def _cache_hit_ratio():
+    out = {}
+    for name, c in _METRIC_CACHES.items():
+        n = sum(c.counts[k] for k in ("hit", "stale", "miss", "wait"))
+        if n:
+            out[(name,)] = round((c.counts["hit"] + c.counts["stale"]) / n, 4)
+    return out
+
+def _traffic_metrics():
+    st = update_stats()
+    return {("rx",): st["rx"], ("tx",): st["tx"]}
+
+def _traffic_speed_metrics():
+    st = update_stats()
+    return {("rx",): round(st["speed_rx"], 1), ("tx",): round(st["speed_tx"], 1)}
+
+def _client_metrics():
+    with _traffic_lock:
+        return {(ip, d): c["total"][f"{d}_bytes"] for ip, c in _clients.items() for d in ("rx", "tx")}
+
+metrics.FuncGauge("portal_cache_events_total", "Single-flight cache lookups and loads by result",
+                  _cache_counts, ("cache", "result"), kind="counter")
+metrics.FuncGauge("portal_cache_hit_ratio", "Share of cache lookups served without waiting for a load",
+                  _cache_hit_ratio, ("cache",))
+metrics.FuncGauge("portal_usb_bytes_total", f"{TRAFFIC_IFACE} bytes since the last reset",
+                  _traffic_metrics, ("direction",), kind="counter")
+metrics.FuncGauge("portal_usb_speed_bytes", f"{TRAFFIC_IFACE} EWMA throughput, bytes/s",
+                  _traffic_speed_metrics, ("direction",))
+metrics.FuncGauge("portal_client_bytes_total", "Per-client bytes on the USB subnet (while accounting is sampled)",
+                  _client_metrics, ("client", "direction"), kind="counter")
+metrics.FuncGauge("portal_events_subscribers", "Open /api/events streams",
+                  lambda: {(): len(_events_subs)})
+
+def _bypass_metrics():
+    # From the cached snapshot only: a scrape never costs an iptables-save.
+    c = bypass.counters(_fw_cache.peek()[0] or {})
+    return {("tx",): c["tx_bytes"], ("rx",): c["rx_bytes"]} if c["active"] else {}
+
+metrics.FuncGauge("portal_bypass_bytes_total", "Forwarded bytes that skipped the tunnel (split tunnel sets)",
+                  _bypass_metrics, ("direction",), kind="counter")
+
+def _dns_stats() -> dict:
+    return json.loads(Path(DNS_STATS_PATH).read_text(encoding="utf-8"))
+
+def _dns_metrics():
+    st = _dns_stats()
+    return {(k,): st.get(k, 0) for k in ("hits", "negative_hits", "misses", "coalesced", "prefetches", "servfail",
+                                         "blocked")}
+
+metrics.FuncGauge("portal_dns_queries_total", "DNS proxy queries by result (dnsproxy.py)",
+                  _dns_metrics, ("result",), kind="counter")
+metrics.FuncGauge("portal_dns_hit_ratio", "Share of DNS lookups answered from the proxy cache",
+                  lambda: {(): _dns_stats()["hit_rate"] or 0.0})
+
+def _route_label():
+    return request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+@app.before_request
+def _metrics_begin():
+    request.environ["portal.t0"] = time.perf_counter()
+    _HTTP_INFLIGHT.inc((_route_label(),))
+    proctrace.set_context(f"{request.method} {_route_label()}")
+
+@app.after_request
+def _metrics_status(resp):
+    _HTTP_REQUESTS.inc((_route_label(), request.method, str(resp.status_code)))
+    return resp
+
+@app.teardown_request
+def _metrics_end(exc=None):
+    proctrace.set_context(None)
+    t0 = request.environ.pop("portal.t0", None)
+    if t0 is None:
+        return
+    route = _route_label()
+    _HTTP_INFLIGHT.dec((route,))
+    _HTTP_LATENCY.observe(time.perf_counter() - t0, (route, request.method))
+    if exc is not None:
+        _HTTP_REQUESTS.inc((route, request.method, "500"))
+
 # ============================================================================
 # Routes
 # ============================================================================
 
 @app.route("/")
 def index():
-    return render_template_string(HTML, privacy=_privacy_mode_active(), exit_country=get_current_exit_country(), mode_error=(request.args.get("mode_error") or ""))
+    body, gz, etag = _shell_for(_bootstrap_state())
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+    use_gzip = "gzip" in _accepted_encodings()
+    if use_gzip:
+        headers["ETag"] = etag = etag[:-1] + '-gz"'
+    if etag in (request.headers.get("If-None-Match") or ""):
+        return Response(status=304, headers=headers)
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        return Response(gz, mimetype="text/html", headers=headers)
+    return Response(body, mimetype="text/html", headers=headers)
+
+@app.get("/assets/<name>")
+def static_asset(name):
+    meta = _asset_files.get(name)
+    if meta is None:
+        return Response("not found", status=404, mimetype="text/plain")
+    available = meta.get("encodings") or {}
+    accepted = _accepted_encodings()
+    enc = next((e for e in ("br", "gzip") if e in available and e in accepted), None)
+    headers = {"Cache-Control": ASSET_CACHE_CONTROL, "ETag": f'"{name}{"-" + enc if enc else ""}"'}
+    if available:
+        headers["Vary"] = "Accept-Encoding"
+    if headers["ETag"] in (request.headers.get("If-None-Match") or ""):
+        return Response(status=304, headers=headers)
+    try:
+        blob = _asset_blob(name, enc)
+    except OSError:
+        return Response("not found", status=404, mimetype="text/plain")
+    if enc:
+        headers["Content-Encoding"] = enc
+    return Response(blob, mimetype=meta["type"], headers=headers)
 
 # ---- Node circuit-manager proxy endpoints ----
 
@@ -1632,13 +2980,11 @@ def api_cm_newnym():
 
 @app.get("/api/cm/available-exits")
 def api_cm_available_exits():
-    """Proxy to circuit-manager /available-exits"""
-    import requests as _req
-    try:
-        r = _req.get(f"{CIRCUIT_MGR_BASE}/available-exits", timeout=5)
-        return (r.content, r.status_code, {"Content-Type": "application/json"})
-    except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 502
+    """Proxy to circuit-manager /available-exits (cached; the exit list changes slowly)"""
+    r = _exits_cache.get(lambda: _cm_request("/available-exits", timeout=5.0))
+    if not _cm_ok(r):
+        return jsonify(r), 502
+    return jsonify(r)
 
 @app.post("/api/cm/exit")
 def api_cm_exit():
@@ -1653,12 +2999,33 @@ def api_cm_exit():
     if not re.fullmatch(r"[A-Z]{2}|AUTO", cc or ""):
         return jsonify({"ok": False, "error": "exitCountry must be ISO-2 or AUTO"}), 400
 
+    # A pooled circuit for cc is offered to the manager as a hint, so it can
+    # switch at once instead of building; the pool rebuilds in the background.
+    # It only counts as a hit once the manager echoes the id back (or streams
+    # show up on it); an offer nobody adopts is closed by the pool.
+    _ensure_control()
+    t0 = time.monotonic()
+    pooled = _circuit_pool.take(cc) if cc != "AUTO" else None
+    payload = {"exitCountry": cc, "wait": wait, "timeoutMs": timeout_ms}
+    if pooled:
+        payload["circuitId"] = pooled["id"]
     resp = _cm_request(
         "/exit",
         "POST",
-        {"exitCountry": cc, "wait": wait, "timeoutMs": timeout_ms},
+        payload,
         timeout=min(8.0, (timeout_ms / 1000.0) + 1.0),
     )
+    hit = False
+    if pooled and _cm_ok(resp):
+        if _circuit_pool.attach:
+            _circuit_pool.switched()
+            hit = True
+        elif str(resp.get("circuitId") or "") == pooled["id"]:
+            hit = _circuit_pool.adopted(pooled["id"])
+    if isinstance(resp, dict) and cc != "AUTO":
+        resp["pool"] = {"hit": hit, "offered": pooled is not None and not _circuit_pool.attach,
+                        "circuit_id": pooled["id"] if pooled else None,
+                        "request_ms": round((time.monotonic() - t0) * 1000.0, 1)}
 
     # Do NOT mirror into /etc/anonrc by default — it can break explicit circuit building.
     # If you really need legacy mirroring, set MIRROR_EXIT_TO_ANONRC=1.
@@ -1670,6 +3037,29 @@ def api_cm_exit():
 
     return jsonify(resp)
 
+@app.get("/api/cm/pool")
+def api_cm_pool():
+    """Pre-built circuit pool: pinned countries, pool contents, hit/miss, build and switch timings."""
+    _ensure_control()
+    return jsonify(_circuit_pool.stats())
+
+@app.post("/api/cm/pool")
+def api_cm_pool_set():
+    d = request.get_json(silent=True) or {}
+    countries = [str(c).strip().upper() for c in (d.get("countries") or [])]
+    if not all(re.fullmatch(r"[A-Z]{2}", c) for c in countries):
+        return jsonify({"ok": False, "error": "countries must be ISO-2 codes"}), 400
+    if len(set(countries)) > circuitpool.POOL_MAX_TOTAL:
+        return jsonify({"ok": False, "error": f"at most {circuitpool.POOL_MAX_TOTAL} countries"}), 400
+    if not _circuit_pool.enabled:
+        return jsonify({"ok": False, "error": "circuit pool is off (set CIRCUIT_POOL=1)"}), 409
+    _ensure_control()
+    try:
+        _pool_pin(countries)
+    except OSError as e:
+        return jsonify({"ok": False, "error": str(e)}), 500
+    return jsonify({"ok": True, **_circuit_pool.stats()})
+
 @app.get("/api/cm/rotation")
 def api_cm_rotation():
     return jsonify(_cm_request("/rotation", "GET", None, timeout=3.0))
@@ -1695,24 +3085,33 @@ def api_cm_rotation_trigger():
 def api_traffic():
     return jsonify(update_stats())
 
+@app.get("/api/traffic/history")
+def api_traffic_history():
+    try:
+        window = float(request.args.get("window") or 300)
+    except Exception:
+        window = 300.0
+    window = max(TRAFFIC_SAMPLE_INTERVAL, min(float(TRAFFIC_HISTORY_SECONDS), window))
+    # Keep responses small: at most ~600 points, downsampled by striding.
+    step = max(1, int(window / TRAFFIC_SAMPLE_INTERVAL / 600))
+    return jsonify({
+        "ok": True,
+        "window": window,
+        "interval": TRAFFIC_SAMPLE_INTERVAL * step,
+        "fields": ["ts", "rx", "tx", "speed_rx", "speed_tx"],
+        "samples": traffic_history(window, step),
+    }), 200
+
+@app.get("/api/traffic/clients")
+def api_traffic_clients():
+    """Per-client bytes/packets and rates on usb0, keyed by dnsmasq lease."""
+    return jsonify(traffic_clients()), 200
+
 @app.post("/api/traffic/reset")
 def api_traffic_reset():
-    global _traffic_offset, _traffic_raw_prev, stats
     try:
-        raw_rx = raw_tx = None
-        with open("/proc/net/dev") as f:
-            for line in f:
-                if "usb0" in line:
-                    d = line.split()
-                    raw_rx, raw_tx = int(d[1]), int(d[9])
-                    break
-        if raw_rx is None or raw_tx is None:
-            return jsonify({"ok": False, "error": "usb0 not found"}), 404
-        _traffic_offset["rx"] = int(raw_rx)
-        _traffic_offset["tx"] = int(raw_tx)
-        now = time.time()
-        _traffic_raw_prev.update({"rx": int(raw_rx), "tx": int(raw_tx), "time": now})
-        stats.update({"rx": 0, "tx": 0, "time": now, "speed_rx": 0, "speed_tx": 0})
+        if not traffic_reset():
+            return jsonify({"ok": False, "error": f"{TRAFFIC_IFACE} not found"}), 404
         return jsonify({"ok": True, "rx": 0, "tx": 0}), 200
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
@@ -1720,40 +3119,31 @@ def api_traffic_reset():
 
 @app.get("/api/anyone/proof")
 def api_anyone_proof():
-    st = _anyone_proof_check()
-    privacy = _privacy_mode_active()
-
-    # Enrich with circuit-manager data
-    cm = _cm_status_cached(max_age=5.0)
-    cm_ok = isinstance(cm, dict) and cm.get("ok", False)
-    bootstrapping = bool(cm.get("bootstrapping")) if cm_ok else False
-    circuit_count = int(cm.get("circuitsCached", 0)) if cm_ok else 0
-    country = cm.get("observed", {}).get("exitCountry") if cm_ok else None
-
-    socks_connected = bool(st.get("connected"))
-
-    # Determine connection_state based on ACTUAL connectivity, not just privacy mode
-    if not privacy:
-        connection_state = "off"
-    elif socks_connected and cm_ok and circuit_count > 0 and not bootstrapping:
-        connection_state = "connected"
-    elif cm_ok and bootstrapping:
-        connection_state = "connecting"
-    elif cm_ok and circuit_count == 0:
-        connection_state = "connecting"
-    else:
-        connection_state = "disconnected"
-
-    st2 = dict(st)
-    st2.update({
-        "privacy": bool(privacy),
-        "cm_ok": cm_ok,
-        "circuit_count": circuit_count,
-        "country": country,
-        "connection_state": connection_state,
-        "display_connected": bool(privacy) and socks_connected and cm_ok and circuit_count > 0,
-    })
-    return jsonify(st2), 200
+    return jsonify(_anyone_proof_payload()), 200
+
+@app.get("/api/events")
+def api_events():
+    """Server-Sent Events: pushes mode/killswitch/status/circuit/proof/traffic/rotation on change."""
+    def stream():
+        # Subscribed only once the response starts streaming: a client gone before that leaves no queue behind.
+        q = _events_subscribe()
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    item = q.get(timeout=EVENTS_KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is None:
+                    return      # dropped as too slow: closing lets EventSource reconnect
+                topic, data = item
+                yield f"event: {topic}\ndata: {data}\n\n"
+        finally:
+            _events_unsubscribe(q)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/exit/current")
 def api_exit_current():
@@ -1774,18 +3164,7 @@ def api_killswitch_set():
 # ---- Wi‑Fi ----
 @app.get("/wifi/scan")
 def w_scan():
-    raw = subprocess.check_output("nmcli -t -f SSID,ACTIVE dev wifi list", shell=True).decode("utf-8", errors="replace")
-    nets, seen = [], set()
-    for line in raw.splitlines():
-        if not line.strip():
-            continue
-        ssid, *rest = line.split(":", 1)
-        if not ssid or ssid in seen:
-            continue
-        active = (rest[0].strip() == "yes") if rest else False
-        nets.append({"ssid": ssid, "connected": active})
-        seen.add(ssid)
-    return jsonify({"networks": nets})
+    return jsonify(_wifi_scan(fresh=request.args.get("fresh") == "1"))
 
 @app.post("/wifi/connect")
 def w_conn():
@@ -1795,12 +3174,15 @@ def w_conn():
     if not ssid:
         return jsonify({"status": "Missing SSID"}), 400
     try:
-        subprocess.run(f'nmcli dev wifi connect "{ssid}" password "{pw}"', shell=True, check=True, capture_output=True, timeout=30)
+        res = _privileged("wifi.connect", lambda: wifi.connect(ssid, pw), timeout=35.0, ssid=ssid, password=pw)
+    except broker.BrokerError as e:
+        res = {"ok": False, "error": "timeout" if e.code == "timeout" else str(e)}
+    if res.get("ok"):
+        _wifi_cache.invalidate()
         return jsonify({"status": "Connected!"})
-    except subprocess.CalledProcessError:
-        return jsonify({"status": "Connection failed"})
-    except subprocess.TimeoutExpired:
+    if res.get("error") == "timeout":
         return jsonify({"status": "Timeout"})
+    return jsonify({"status": "Connection failed"})
 
 # ---- Mode scripts ----
 @app.post("/mode/privacy")
@@ -1817,12 +3199,119 @@ def mode_normal():
 
 @app.get("/api/mode")
 def api_mode_get():
+    privacy = bool(_privacy_mode_active())
     return jsonify({
         "ok": True,
-        "privacy": bool(_privacy_mode_active()),
-        "routing": "ANYONE" if _privacy_mode_active() else "DIRECT"
+        "privacy": privacy,
+        "routing": "ANYONE" if privacy else "DIRECT"
     }), 200
 
+@app.get("/api/anon/control")
+def api_anon_control():
+    """ControlPort view: connection, bootstrap, circuits, streams, bandwidth (all event-fed)."""
+    _ensure_control()
+    return jsonify(_control_payload())
+
+@app.get("/api/flows")
+def api_flows():
+    """Active connections from conntrack: counts per client / port / state, top talkers."""
+    snap = _flows_snapshot()
+    return jsonify(snap), (200 if snap.get("ok") else 503)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of the portal's metrics."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.get("/api/debug/subprocess")
+def api_debug_subprocess():
+    """External commands over the last `window` seconds: spawns/min, p50/p99 and who triggered them."""
+    try:
+        window = min(max(float(request.args.get("window") or proctrace.SUMMARY_WINDOW), 1.0), 86400.0)
+        recent = min(max(int(request.args.get("recent") or 20), 0), proctrace.LOG_SIZE)
+    except ValueError:
+        return jsonify({"ok": False, "error": "bad window/recent"}), 400
+    return jsonify(dict(proctrace.summary(window), ok=True, recent=proctrace.entries(recent)))
+
+@app.get("/api/boot")
+def api_boot():
+    """Per-stage boot timings written by supervisor.py."""
+    try:
+        return jsonify(json.loads(Path(BOOT_REPORT_PATH).read_text(encoding="utf-8")))
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+
+@app.get("/api/bypass")
+def api_bypass():
+    """Split tunnel list, the last set load (resolved domains) and bypassed bytes per direction."""
+    return jsonify(_bypass_payload())
+
+@app.post("/api/bypass")
+def api_bypass_set():
+    """
+    {"nets"|"ports"|"domains": [...]} replaces those lists; {"add": [...], "remove": [...]}
+    edits single entries (kind detected). Saved, then loaded into the kernel sets.
+    """
+    d = request.get_json(silent=True) or {}
+    with _bypass_lock:
+        cfg = bypass.load()
+        try:
+            cfg.update({k: d[k] for k in bypass.KINDS if k in d})
+            for op in ("add", "remove"):
+                items = d.get(op) or []
+                for item in ([items] if isinstance(items, str) else items):
+                    kind, v = bypass.classify(item)
+                    if op == "add" and v not in cfg[kind]:
+                        cfg[kind].append(v)
+                    elif op == "remove" and v in cfg[kind]:
+                        cfg[kind].remove(v)
+            bypass.save(cfg)
+        except ValueError as e:
+            return jsonify({"ok": False, "error": str(e)}), 400
+        except OSError as e:
+            return jsonify({"ok": False, "error": str(e)}), 500
+        res = _bypass_apply()
+    out = _bypass_payload()
+    out.update(ok=bool(res.get("ok")), error=res.get("error"))
+    return jsonify(out), 200 if res.get("ok") else 502
+
+@app.get("/api/dns")
+def api_dns():
+    """DNS proxy cache stats (hit rate, upstream latency, time saved) written by dnsproxy.py."""
+    try:
+        st = _dns_stats()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+    st["age"] = round(time.time() - st.get("ts", 0), 1)
+    return jsonify(st)
+
+@app.get("/api/blocklist")
+def api_blocklist():
+    """DNS sinkhole: list size, blocked queries, top blocked names and the bytes they kept out of the tunnel."""
+    try:
+        st = _dns_stats()
+    except Exception as e:
+        return jsonify({"ok": False, "error": str(e)}), 404
+    out = st.get("blocklist") or {"enabled": False}
+    out["age"] = round(time.time() - st.get("ts", 0), 1)
+    return jsonify(out)
+
+@app.get("/api/firewall")
+def api_firewall():
+    """Structured firewall snapshot: derived state plus per-rule packet/byte counters."""
+    snap = _fw_snapshot()
+    _value, age = _fw_cache.peek()
+    out = {k: v for k, v in snap.items() if k != "tables"}
+    out["age"] = round(age, 1) if age is not None else None
+    out["tables"] = {
+        name: {
+            "chains": t["chains"],
+            "rules": [{k: r[k] for k in ("chain", "spec", "target", "packets", "bytes")} for r in t["rules"]],
+        }
+        for name, t in (snap.get("tables") or {}).items()
+    }
+    return jsonify(out), 200 if snap.get("ok") else 503
+
 @app.post("/api/mode/privacy")
 def api_mode_privacy():
     # API callers get JSON, not a redirect
@@ -1838,33 +3327,15 @@ def api_mode_normal():
 
 @app.get("/api/mode/switch")
 def api_mode_switch_status():
-    st = _mode_read()
-    # If a unit is running, ask systemd for its status (best-effort)
-    unit = st.get("unit") if isinstance(st, dict) else None
-    if unit:
-        try:
-            rc = subprocess.run(["systemctl", "is-active", unit], capture_output=True, text=True)
-            active = (rc.stdout or "").strip()
-            if active in ("inactive", "failed", "active"):
-                st["systemd"] = active
-            # If not active anymore, read exit code
-            if active in ("inactive", "failed"):
-                show = subprocess.run(["systemctl", "show", unit, "-p", "ExecMainStatus", "-p", "Result"], capture_output=True, text=True)
-                exec_status = None
-                result = None
-                for ln in (show.stdout or "").splitlines():
-                    if ln.startswith("ExecMainStatus="):
-                        try: exec_status = int(ln.split("=",1)[1].strip() or "0")
-                        except: exec_status = None
-                    if ln.startswith("Result="):
-                        result = ln.split("=",1)[1].strip()
-                st["exit"] = exec_status
-                st["result"] = result
-                st["running"] = False
-                _mode_write(st)
-        except Exception as e:
-            st["systemd_error"] = str(e)
-    return jsonify(st), 200
+    # ?wait=N holds the request (up to MODE_SWITCH_MAX_WAIT) until the watched switch ends.
+    try:
+        wait = min(max(float(request.args.get("wait") or 0), 0.0), MODE_SWITCH_MAX_WAIT)
+    except ValueError:
+        wait = 0.0
+    if wait:
+        with _mode_cond:
+            _mode_cond.wait_for(lambda: _mode_active is None, timeout=wait)
+    return jsonify(_mode_status()), 200
 
 
 @app.get("/api/status")
@@ -1875,4 +3346,7 @@ def api_status():
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=80, threaded=True)
+    _ensure_traffic_sampler()
+    _ensure_control()
+    _start_bg("anyone-proof", _anyone_proof_refresher)
+    app.run(host="0.0.0.0", port=int(os.environ.get("PORTAL_PORT", "80")), threaded=True)
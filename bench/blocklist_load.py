@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Benchmark: blocklist.Blocklist on a synthetic hosts-format list (tracker
+# style names: random second-level domains over common TLDs, a share of them
+# with subdomains that the compiled list folds into their parent). Times the
+# compile from the text list, the reload from the binary cache and lookups
+# of blocked and unlisted names, and reports memory held after the load
+# (tracemalloc) next to a plain set of the same names for reference, plus the
+# Bloom filter's measured false-positive rate.
+# ============================================================================
+
+import argparse, json, os, random, sys, tempfile, time, tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import blocklist
+
+TLDS = ["com"] * 6 + ["net"] * 2 + ["org", "io", "de", "co.uk", "info", "xyz", "ru", "cn"]
+SUBS = ["ads", "track", "pixel", "metrics", "cdn", "stats", "collect", "beacon", "t", "s1"]
+_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+
+def _label(rng, lo: int = 4, hi: int = 14) -> str:
+    return "".join(rng.choice(_CHARS) for _ in range(rng.randint(lo, hi)))
+
+
+def synth(n: int, seed: int = 1) -> list:
+    rng = random.Random(seed)
+    out = []
+    while len(out) < n:
+        name = f"{_label(rng)}.{rng.choice(TLDS)}"
+        r = rng.random()
+        if r < 0.45:
+            name = f"{rng.choice(SUBS)}.{name}"
+        elif r < 0.55:
+            name = f"{_label(rng, 2, 6)}.{rng.choice(SUBS)}.{name}"
+        out.append(name)
+    return out
+
+
+def _best(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _traced(fn):
+    tracemalloc.start()
+    try:
+        obj = fn()
+        return obj, tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+
+def run(n: int, lookups: int, repeat: int, tmp: str) -> dict:
+    names = synth(n)
+    source, cache = os.path.join(tmp, f"hosts-{n}.txt"), os.path.join(tmp, f"blocklist-{n}.bin")
+    with open(source, "w", encoding="ascii") as f:
+        f.writelines(f"0.0.0.0 {name}\n" for name in names)
+
+    t0 = time.perf_counter()
+    bl = blocklist.Blocklist.open(source, cache)
+    compile_s = time.perf_counter() - t0
+    assert not bl.from_cache
+    load_s = _best(lambda: blocklist.Blocklist.open(source, cache), repeat)
+    del bl
+    bl, (held, peak) = _traced(lambda: blocklist.Blocklist.open(source, cache))
+    assert bl.from_cache
+    ref, (set_held, _) = _traced(lambda: {name.encode() for name in names})
+    del ref
+
+    rng = random.Random(3)
+    hits = [f"x{i}.{rng.choice(names)}".encode() for i in range(lookups)]
+    misses = [f"www.{_label(rng)}.{rng.choice(TLDS)}".encode() for _ in range(lookups)]
+    assert all(bl.match(h) for h in hits[:1000])
+    hit_s = _best(lambda: [bl.match(h) for h in hits], repeat)
+    miss_s = _best(lambda: [bl.match(m) for m in misses], repeat)
+    keys = [blocklist._key(f"{_label(rng)}.{rng.choice(TLDS)}".encode()) for _ in range(lookups)]
+    fp = sum(1 for k in keys if bl._maybe(k) and not bl._has(k))
+    return {
+        "listed": n,
+        "entries": bl.entries,
+        "source_bytes": os.path.getsize(source),
+        "cache_bytes": os.path.getsize(cache),
+        "compile_ms": round(compile_s * 1e3, 1),
+        "load_ms": round(load_s * 1e3, 1),
+        "memory_bytes": bl.nbytes(),
+        "traced_bytes": held,
+        "traced_peak_bytes": peak,
+        "bytes_per_entry": round(held / max(1, bl.entries), 1),
+        "set_of_names_bytes": set_held,
+        "blocked_lookup_us": round(hit_s / lookups * 1e6, 2),
+        "unlisted_lookup_us": round(miss_s / lookups * 1e6, 2),
+        "bloom_false_positive_rate": round(fp / len(keys), 4),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark the compiled DNS blocklist")
+    ap.add_argument("--entries", type=int, nargs="+", default=[50000, 500000])
+    ap.add_argument("--lookups", type=int, default=50000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run(n, args.lookups, args.repeat, tmp) for n in args.entries]
+    json.dump({"bench": "blocklist_load", "results": results}, sys.stdout, indent=2)
+    print()
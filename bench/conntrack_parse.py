@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Benchmark: conntrack.FlowTable on a synthetic /proc/net/nf_conntrack dump
+# (privacy-mode mix: REDIRECTed TCP from the USB clients, DNS to 9053,
+# anon's own relay connections). Times a cold pass, incremental passes with
+# a share of changed/new/closed flows, summary(), and a parse-everything
+# reference that splits every line into key=value pairs on every pass.
+# ============================================================================
+
+import argparse, json, os, random, re, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import conntrack
+
+TCP_STATES = ["ESTABLISHED"] * 8 + ["TIME_WAIT", "SYN_SENT", "CLOSE_WAIT", "FIN_WAIT"]
+_TIMEOUT_RE = re.compile(r"^(\S+\s+\d+\s+\S+\s+\d+\s+)(\d+)")
+
+
+def _line(rng, i: int, acct: bool) -> str:
+    client = f"192.168.7.{2 + i % 4}"
+    sport = 32768 + i % 28000
+    kind = rng.random()
+    if kind < 0.75:
+        dst = f"{rng.randrange(1, 223)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+        dport = rng.choice((443, 443, 443, 80, 993, 5222))
+        st = rng.choice(TCP_STATES)
+        c1 = f" packets={rng.randrange(1, 900)} bytes={rng.randrange(60, 900000)}" if acct else ""
+        c2 = f" packets={rng.randrange(1, 900)} bytes={rng.randrange(60, 9000000)}" if acct else ""
+        return (f"ipv4     2 tcp      6 {rng.randrange(1, 432000)} {st} src={client} dst={dst} sport={sport} "
+                f"dport={dport}{c1} src=127.0.0.1 dst={client} sport={conntrack.TRANS_PORT} dport={sport}{c2} "
+                f"[ASSURED] mark=0 zone=0 use=2")
+    if kind < 0.92:
+        c = " packets=1 bytes=72" if acct else ""
+        return (f"ipv4     2 udp      17 {rng.randrange(1, 30)} src={client} dst=192.168.7.1 sport={sport} dport=53{c} "
+                f"src=127.0.0.1 dst={client} sport={conntrack.DNS_PORT} dport={sport}{c} mark=0 zone=0 use=2")
+    relay = f"{rng.randrange(1, 223)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}"
+    return (f"ipv4     2 tcp      6 {rng.randrange(1, 432000)} ESTABLISHED src=10.0.0.23 dst={relay} sport={sport} "
+            f"dport=9001 src={relay} dst=10.0.0.23 sport=9001 dport={sport} [ASSURED] mark=0 zone=0 use=2")
+
+
+def synth(n: int, seed: int = 1, acct: bool = True) -> list:
+    rng = random.Random(seed)
+    return [_line(rng, i, acct) + "\n" for i in range(n)]
+
+
+def churn(lines: list, share: float, seed: int = 2) -> list:
+    """
+    Next pass one second later: every timeout ticks down, `share` of the flows
+    move counters, share/4 close and share/4 new ones appear.
+    """
+    rng = random.Random(seed)
+    out = []
+    for line in lines:
+        r = rng.random()
+        if r < share / 4:
+            continue
+        line = _TIMEOUT_RE.sub(lambda m: m.group(1) + str(max(0, int(m.group(2)) - 1)), line)
+        if r < share:
+            line = line.replace(" packets=", " packets=1", 1) if " packets=" in line else line.replace(" use=2", " use=3", 1)
+        out.append(line)
+    out += synth(int(len(lines) * share / 4), seed=seed + 7)
+    return out
+
+
+def _full_parse(lines: list) -> dict:
+    table = {}
+    for line in lines:
+        f = line.split()
+        kv = {}
+        for x in f:
+            k, eq, v = x.partition("=")
+            if eq:
+                kv.setdefault(k, v)
+        table[(f[2], kv.get("src"), kv.get("dst"), kv.get("sport"), kv.get("dport"))] = (f, kv)
+    return table
+
+
+def _best(fn, repeat: int, setup=None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        t0 = time.perf_counter()
+        fn(arg)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _primed(lines):
+    def setup():
+        t = conntrack.FlowTable()
+        t.update(lines)
+        return t
+    return setup
+
+
+def run(n: int, share: float, repeat: int, acct: bool) -> dict:
+    base = synth(n, acct=acct)
+    ticked = churn(base, 0.0)
+    nxt = churn(base, share)
+    t = _primed(base)()
+    stats = t.update(nxt)
+    assert len(t.flows) == len(_full_parse(nxt))
+    return {
+        "flows": n,
+        "churn": share,
+        "acct": acct,
+        "cold_ms": round(_best(lambda _: conntrack.FlowTable().update(base), repeat) * 1e3, 2),
+        "unchanged_pass_ms": round(_best(lambda t: t.update(ticked), repeat, _primed(base)) * 1e3, 2),
+        "incremental_pass_ms": round(_best(lambda t: t.update(nxt), repeat, _primed(base)) * 1e3, 2),
+        "reparsed_lines": stats["parsed"],
+        "summary_ms": round(_best(lambda _: t.summary(), repeat) * 1e3, 2),
+        "full_parse_ms": round(_best(lambda _: _full_parse(nxt), repeat) * 1e3, 2),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark the incremental conntrack table")
+    ap.add_argument("--flows", type=int, nargs="+", default=[1000, 5000, 20000])
+    ap.add_argument("--churn", type=float, default=0.1, help="share of flows that change between passes")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--no-acct", action="store_true", help="dump without packets=/bytes= (nf_conntrack_acct=0)")
+    ap.add_argument("--write", metavar="PATH", help="also write the synthetic dump (first size) to PATH")
+    args = ap.parse_args()
+    if args.write:
+        with open(args.write, "w", encoding="ascii") as f:
+            f.writelines(synth(args.flows[0], acct=not args.no_acct))
+    results = [run(n, args.churn, args.repeat, not args.no_acct) for n in args.flows]
+    json.dump({"bench": "conntrack_parse", "results": results}, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Load generator: N dashboard tabs against a real portal on the stand-ins
+# (bench/standins.py), replaying the page's own request schedule.
+#   page load   GET /, /api/mode/switch, /api/exit/current,
+#               /api/cm/available-exits, /api/cm/pool
+#   --transport sse   one /api/events stream per tab (the page today);
+#                     polls only while the stream is down (retry 3s)
+#   --transport poll  the timer set: killswitch 4s, cm/status 4s,
+#                     cm/circuit 4s, proof 7s, traffic 5s, clients 10s,
+#                     rotation 5s (setInterval: calls may overlap)
+#   bursts (per tab, Poisson): hop switch, exit switch (waitForExit),
+#               New Circuit followed by the waitForCircuitChange pattern
+#               (cm/circuit every 250ms, or the next circuit event), mode
+#               switch (POST + /api/mode/switch?wait=25 long-poll + reload)
+# The 1s countdown timers are client-side only and send nothing.
+# Every request uses the page's own abort timeout; one that runs past it is
+# a UI timeout. For each tab count: server CPU, peak RSS and threads, req/s,
+# p50/p95/p99 per endpoint, timeouts. Long-polls and streams are excluded
+# from the latency figures.
+# ============================================================================
+
+import argparse, asyncio, json, random, sys, time
+from urllib.parse import urlsplit
+
+import standins
+
+# (path, abort timeout s, interval s) — startPolling()
+POLL_TIMERS = [
+    ("/api/mode", 3.0, 4.0),
+    ("/api/killswitch/status", 2.0, 4.0),
+    ("/api/cm/status", 2.0, 4.0),
+    ("/api/cm/circuit", 8.0, 4.0),
+    ("/api/anyone/proof", 18.0, 7.0),
+    ("/api/traffic", 2.0, 5.0),
+    ("/api/traffic/clients", 4.0, 10.0),
+    ("/api/cm/rotation", 2.5, 5.0),
+]
+EVENTS_RETRY = 3.0
+LONG_POLL = {"/api/mode/switch?wait=25", "/api/events"}
+EXIT_CHOICES = ("AUTO", "DE", "NL", "SE", "CH")
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+class Recorder:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.lat = {}           # endpoint -> [seconds]
+        self.timeouts = {}
+        self.errors = {}
+        self.events = 0
+        self.t0 = time.monotonic()
+
+    def record(self, endpoint: str, seconds: float | None, timed_out=False, error=False):
+        if timed_out:
+            self.timeouts[endpoint] = self.timeouts.get(endpoint, 0) + 1
+        elif error:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        elif endpoint not in LONG_POLL:
+            self.lat.setdefault(endpoint, []).append(seconds)
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.t0
+        per, every = {}, []
+        for ep in sorted(set(self.lat) | set(self.timeouts) | set(self.errors)):
+            v = sorted(self.lat.get(ep, []))
+            every.extend(v)
+            per[ep] = {"n": len(v), "timeouts": self.timeouts.get(ep, 0), "errors": self.errors.get(ep, 0),
+                       "p50_ms": _ms(_pct(v, 50)), "p95_ms": _ms(_pct(v, 95)), "p99_ms": _ms(_pct(v, 99)),
+                       "max_ms": _ms(v[-1] if v else None)}
+        every.sort()
+        return {"requests": len(every), "rps": round(len(every) / elapsed, 1) if elapsed else None,
+                "timeouts": sum(self.timeouts.values()), "errors": sum(self.errors.values()),
+                "events": self.events, "p50_ms": _ms(_pct(every, 50)), "p95_ms": _ms(_pct(every, 95)),
+                "p99_ms": _ms(_pct(every, 99)), "max_ms": _ms(every[-1] if every else None), "endpoints": per}
+
+
+def _ms(v):
+    return round(v * 1e3, 1) if v is not None else None
+
+
+def _endpoint(path: str) -> str:
+    return path if path in LONG_POLL else path.partition("?")[0]
+
+
+async def http(host: str, port: int, method: str, path: str, body=None):
+    """(status, body) for one request on a fresh connection (the dev server closes it anyway)."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = json.dumps(body).encode() if body is not None else b""
+        head = f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\nConnection: close\r\n"
+        if body is not None:
+            head += f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+        writer.write(head.encode() + b"\r\n" + data)
+        raw = await reader.read()
+    finally:
+        writer.close()
+    status_line, _, rest = raw.partition(b"\r\n")
+    return int(status_line.split(b" ", 2)[1]), rest.partition(b"\r\n\r\n")[2]
+
+
+class Tab:
+    def __init__(self, gen, idx: int):
+        self.gen = gen
+        self.idx = idx
+        self.rng = random.Random(gen.seed * 1000 + idx)
+        self.live = False
+        self.circuit_key = ""
+        self._waiters = []
+        self._poll = []
+
+    # ---- requests (jget / jpost) ----
+    async def req(self, method: str, path: str, timeout: float, body=None):
+        ep = _endpoint(path)
+        t0 = time.monotonic()
+        try:
+            status, data = await asyncio.wait_for(http(self.gen.host, self.gen.port, method, path, body), timeout)
+        except asyncio.TimeoutError:
+            self.gen.rec.record(ep, None, timed_out=True)
+            return None
+        except (OSError, ValueError, IndexError):
+            self.gen.rec.record(ep, None, error=True)
+            return None
+        self.gen.rec.record(ep, time.monotonic() - t0, error=status >= 500)
+        try:
+            return json.loads(data) if status < 400 and data else None
+        except ValueError:
+            return None
+
+    def jget(self, path, timeout=2.5):
+        return self.req("GET", path, timeout)
+
+    def jpost(self, path, body, timeout=3.5):
+        return self.req("POST", path, timeout, body or {})
+
+    # ---- page ----
+    async def page_load(self):
+        await self.req("GET", "/", 10.0)
+        await self.jget("/api/mode/switch", 1.5)
+        await self.jget("/api/exit/current", 2.0)
+        await self.jget("/api/cm/available-exits", 3.0)
+        await self.jget("/api/cm/pool", 2.5)
+
+    def start_polling(self):
+        if self._poll:
+            return
+        self._poll = [asyncio.ensure_future(self._timer(path, timeout, every))
+                      for path, timeout, every in POLL_TIMERS]
+
+    def stop_polling(self):
+        for t in self._poll:
+            t.cancel()
+        self._poll = []
+
+    async def _timer(self, path, timeout, every):
+        # setInterval: fires on schedule whether or not the last call returned.
+        pending = set()
+        try:
+            while True:
+                task = asyncio.ensure_future(self._poll_once(path, timeout))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                await asyncio.sleep(every)
+        finally:
+            for t in list(pending):
+                t.cancel()
+
+    async def _poll_once(self, path, timeout):
+        d = await self.jget(path, timeout)
+        if path == "/api/cm/circuit" and d:
+            self._circuit(d)
+
+    def _circuit(self, d):
+        hops = (d or {}).get("hops") or []
+        self.circuit_key = ";".join(f"{h.get('role')}|{h.get('fingerprint')}" for h in hops)
+        for fut in self._waiters:
+            if not fut.done():
+                fut.set_result(d)
+        self._waiters = []
+
+    async def events(self):
+        """EventSource: stream until it drops, poll meanwhile, reconnect after `retry`."""
+        while True:
+            writer = None
+            try:
+                reader, writer = await asyncio.open_connection(self.gen.host, self.gen.port)
+                writer.write(f"GET /api/events HTTP/1.1\r\nHost: {self.gen.host}\r\n"
+                             f"Accept: text/event-stream\r\n\r\n".encode())
+                status = await asyncio.wait_for(reader.readline(), 10.0)
+                if b" 200 " not in status:
+                    raise OSError(status.decode(errors="replace").strip())
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.live = True
+                self.stop_polling()
+                topic = None
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    line = line.rstrip(b"\r\n")
+                    if line.startswith(b"event: "):
+                        topic = line[7:].decode()
+                    elif line.startswith(b"data: "):
+                        self.gen.rec.events += 1
+                        if topic == "circuit":
+                            try:
+                                self._circuit(json.loads(line[6:]))
+                            except ValueError:
+                                pass
+            except (OSError, asyncio.TimeoutError):
+                self.gen.rec.record("/api/events", None, error=True)
+            finally:
+                if writer is not None:
+                    writer.close()
+            self.live = False
+            self.start_polling()
+            await asyncio.sleep(EVENTS_RETRY)
+
+    async def next_circuit_event(self, timeout):
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            return await asyncio.wait_for(fut, max(0.0, timeout))
+        except asyncio.TimeoutError:
+            return None
+
+    # ---- bursts ----
+    async def wait_for_circuit_change(self, prev_key: str, timeout=15.0):
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < timeout:
+            if self.live:
+                await self.next_circuit_event(timeout - (time.monotonic() - t0))
+            else:
+                d = await self.jget("/api/cm/circuit", 2.5)
+                if d:
+                    self._circuit(d)
+            if self.circuit_key and self.circuit_key != prev_key:
+                return True
+            if not self.live:
+                await asyncio.sleep(0.25)
+        return False
+
+    async def newnym(self):
+        prev = self.circuit_key
+        await self.jpost("/api/cm/newnym", {}, 4.0)
+        await self.wait_for_circuit_change(prev)
+
+    async def hop_switch(self):
+        hc = self.rng.choice((2, 3))
+        await self.jpost("/api/cm/hopmode", {"hopCount": hc}, 22.0)
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < 22.0:
+            d = await self.jget("/api/cm/circuit", 8.0)
+            if d and len(d.get("hops") or []) in ((2, 3) if hc == 2 else (3,)):
+                break
+            await asyncio.sleep(5.0)
+        await asyncio.sleep(0.25)
+        await self.jget("/api/cm/status", 2.0)
+        d = await self.jget("/api/cm/circuit", 8.0)
+        if d:
+            self._circuit(d)
+
+    async def exit_switch(self):
+        cc = self.rng.choice(EXIT_CHOICES)
+        resp = await self.jpost("/api/cm/exit", {"exitCountry": cc}, 20.0)
+        await self.jget("/api/cm/status", 2.0)
+        if resp and resp.get("ok"):
+            hit = bool((resp.get("pool") or {}).get("hit"))
+            t0, timeout, first = time.monotonic(), (5.0 if hit else 20.0), True
+            while time.monotonic() - t0 < timeout:
+                live = not first and self.live
+                first = False
+                d = (await self.next_circuit_event(timeout - (time.monotonic() - t0)) if live
+                     else await self.jget("/api/cm/circuit", 2.5))
+                hops = (d or {}).get("hops") or []
+                if hops and (cc == "AUTO" or str(hops[-1].get("country_code") or "").upper() == cc):
+                    break
+                if not live:
+                    await asyncio.sleep(5.0)
+            await self.jget("/api/cm/circuit", 8.0)
+            await self.jget("/api/cm/pool", 2.5)
+        await self.jget("/api/exit/current", 2.0)
+        await self.jget("/api/cm/available-exits", 3.0)
+
+    async def mode_switch(self):
+        kind = self.rng.choice(("privacy", "normal"))
+        await self.jpost(f"/api/mode/{kind}", {}, 10.0)
+        await self.jget("/api/mode/switch", 1.5)
+        t0 = time.monotonic()
+        while time.monotonic() - t0 < 120.0:
+            cur = await self.jget("/api/mode/switch?wait=25", 30.0)
+            if cur and not cur.get("running"):
+                break
+            if not cur:
+                await asyncio.sleep(1.0)
+        self.gen.mode_switches += 1
+        raise _Reload()
+
+    async def _bursts(self, name, mean_every):
+        while True:
+            await asyncio.sleep(self.rng.expovariate(1.0 / mean_every))
+            await getattr(self, name)()
+
+    # ---- lifetime ----
+    async def run(self):
+        while True:
+            tasks = []
+            try:
+                await self.page_load()
+                if self.gen.transport == "sse":
+                    tasks.append(asyncio.ensure_future(self.events()))
+                else:
+                    self.start_polling()
+                for name, every in self.gen.bursts.items():
+                    if every > 0:
+                        tasks.append(asyncio.ensure_future(self._bursts(name, every)))
+                if not tasks:
+                    await asyncio.Event().wait()
+                await asyncio.gather(*tasks)
+            except _Reload:
+                pass
+            finally:
+                self.stop_polling()
+                for t in tasks:
+                    t.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class _Reload(Exception):
+    """window.location.href = '/': the tab starts over."""
+
+
+class LoadGen:
+    def __init__(self, portal, transport: str, bursts: dict, seed: int = 1):
+        self.portal = portal
+        u = urlsplit(portal.url)
+        self.host, self.port = u.hostname, u.port
+        self.transport = transport
+        self.bursts = bursts
+        self.seed = seed
+        self.rec = Recorder()
+        self.mode_switches = 0
+
+    async def step(self, tabs: int, ramp: float, warmup: float, duration: float) -> dict:
+        self.rec.reset()
+        runners = []
+        for i in range(tabs):
+            runners.append(asyncio.ensure_future(self._open(Tab(self, i), ramp * i / max(1, tabs))))
+        await asyncio.sleep(ramp + warmup)
+        self.rec.reset()
+        self.mode_switches = 0
+        s0, t0 = self.portal.stats(), time.monotonic()
+        peak_rss, peak_threads = s0["rss"], s0["threads"]
+        while time.monotonic() - t0 < duration:
+            await asyncio.sleep(min(1.0, duration - (time.monotonic() - t0)))
+            s = self.portal.stats()
+            peak_rss, peak_threads = max(peak_rss, s["rss"]), max(peak_threads, s["threads"])
+        s1, elapsed = self.portal.stats(), time.monotonic() - t0
+        summary = self.rec.summary()
+        for r in runners:
+            r.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+        return {
+            "tabs": tabs,
+            "seconds": round(elapsed, 1),
+            "cpu_pct": round((s1["cpu"] - s0["cpu"]) * 100.0 / elapsed, 1),
+            "child_cpu_pct": round((s1["child_cpu"] - s0["child_cpu"]) * 100.0 / elapsed, 1),
+            "rss_peak_bytes": peak_rss,
+            "threads_peak": peak_threads,
+            "mode_switches": self.mode_switches,
+            **summary,
+        }
+
+    async def _open(self, tab, delay):
+        await asyncio.sleep(delay)
+        await tab.run()
+
+
+def run(args) -> dict:
+    bursts = {"hop_switch": args.hop_every, "exit_switch": args.exit_every,
+              "newnym": args.newnym_every, "mode_switch": args.mode_every}
+    steps = []
+    with standins.Portal(args.port, args.cm_latency, args.cm_jitter, args.shim_delay,
+                         args.conntrack_flows, quiet=not args.verbose) as portal:
+        time.sleep(args.settle)
+        base = portal.stats()
+        gen = LoadGen(portal, args.transport, bursts, args.seed)
+        for n in args.tabs:
+            r = asyncio.run(gen.step(n, args.ramp, args.warmup, args.duration))
+            steps.append(r)
+            print(f"{n:>4} tabs  cpu {r['cpu_pct']}% (+{r['child_cpu_pct']}% children)  "
+                  f"rss {r['rss_peak_bytes'] / 1e6:.1f}MB  threads {r['threads_peak']}  {r['rps']} req/s  "
+                  f"p99 {r['p99_ms']}ms  timeouts {r['timeouts']}", file=sys.stderr)
+            if args.stop_on_timeouts and r["timeouts"]:
+                break
+    ok = [s["tabs"] for s in steps if not s["timeouts"]]
+    return {
+        "bench": "loadgen",
+        "commit": standins.git_rev(),
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "config": {"transport": args.transport, "duration": args.duration, "warmup": args.warmup,
+                   "ramp": args.ramp, "bursts_every": bursts, "cm_latency": args.cm_latency,
+                   "cm_jitter": args.cm_jitter, "shim_delay": args.shim_delay, "seed": args.seed},
+        "idle": {"rss_bytes": base["rss"], "threads": base["threads"]},
+        "max_tabs_without_timeouts": max(ok) if ok else 0,
+        "steps": steps,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Simulate N dashboard tabs against the portal on local stand-ins")
+    ap.add_argument("--tabs", type=int, nargs="+", default=[1, 5, 10, 20, 40])
+    ap.add_argument("--transport", choices=("sse", "poll"), default="sse",
+                    help="sse: the page's event stream; poll: its fallback timer set")
+    ap.add_argument("--duration", type=float, default=30.0, help="measured seconds per step")
+    ap.add_argument("--warmup", type=float, default=5.0)
+    ap.add_argument("--ramp", type=float, default=4.0, help="seconds over which the tabs are opened")
+    ap.add_argument("--hop-every", type=float, default=300.0, help="mean seconds between hop switches per tab (0: off)")
+    ap.add_argument("--exit-every", type=float, default=300.0, help="mean seconds between exit switches per tab (0: off)")
+    ap.add_argument("--newnym-every", type=float, default=120.0, help="mean seconds between New Circuit clicks per tab (0: off)")
+    ap.add_argument("--mode-every", type=float, default=900.0, help="mean seconds between mode switches per tab (0: off)")
+    ap.add_argument("--stop-on-timeouts", action="store_true", help="stop after the first step with UI timeouts")
+    ap.add_argument("--port", type=int, help="portal port (default: a free one)")
+    ap.add_argument("--cm-latency", type=float, default=0.02)
+    ap.add_argument("--cm-jitter", type=float, default=0.25)
+    ap.add_argument("--shim-delay", type=float, default=0.0)
+    ap.add_argument("--conntrack-flows", type=int, default=500)
+    ap.add_argument("--settle", type=float, default=2.0)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", help="result file (default: bench/results/loadgen-<commit>-<time>.json, - for stdout only)")
+    ap.add_argument("--verbose", action="store_true", help="show the portal's own output")
+    args = ap.parse_args()
+
+    result = run(args)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if args.out != "-":
+        print(f"wrote {standins.save_result(result, args.out)}", file=sys.stderr)
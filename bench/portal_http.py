@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Benchmark: the portal's HTTP endpoints end to end. Starts `app.py` against
+# the stand-ins (bench/standins.py), hammers each endpoint with a fixed
+# number of requests from a few concurrent clients and reports p50/p99
+# latency, throughput and the portal's CPU per request (its own threads,
+# and the shims it forked). CPU is corrected for the idle baseline measured
+# first (traffic sampler, ControlPort monitor, proof refresher).
+# Results go to bench/results/ as JSON; --compare diffs against an old run.
+# ============================================================================
+
+import argparse, json, os, sys, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import standins
+
+# What the dashboard polls, plus the heavier views; state-changing POSTs only on request.
+DEFAULT_ENDPOINTS = [
+    "GET /",
+    "GET /api/mode",
+    "GET /api/killswitch/status",
+    "GET /api/cm/status",
+    "GET /api/cm/circuit",
+    "GET /api/cm/circuits",
+    "GET /api/cm/available-exits",
+    "GET /api/cm/rotation",
+    "GET /api/anyone/proof",
+    "GET /api/traffic",
+    "GET /api/traffic/history",
+    "GET /api/traffic/clients",
+    "GET /api/firewall",
+    "GET /api/flows",
+    "GET /wifi/scan",
+    "GET /metrics",
+]
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+def _idle(portal, seconds: float) -> dict:
+    s0, t0 = portal.stats(), time.monotonic()
+    time.sleep(seconds)
+    s1, dt = portal.stats(), time.monotonic() - t0
+    return {"cpu_per_s": (s1["cpu"] - s0["cpu"]) / dt, "child_cpu_per_s": (s1["child_cpu"] - s0["child_cpu"]) / dt}
+
+
+def _spawns(portal) -> int:
+    """Commands the portal has forked so far (portal_subprocess_spawns_total over all classes)."""
+    status, body = standins.request(portal.url, "GET", "/metrics")
+    if status != 200:
+        return 0
+    return int(sum(float(line.rpartition(" ")[2]) for line in body.decode().splitlines()
+                   if line.startswith("portal_subprocess_spawns_total{")))
+
+
+def bench_endpoint(portal, spec: str, requests: int, concurrency: int, idle: dict, warmup: int = 5) -> dict:
+    method, _, path = spec.partition(" ")
+    body = {} if method == "POST" else None
+    for _ in range(warmup):
+        standins.request(portal.url, method, path, body)
+    lat, codes, errors = [], {}, []
+    lock = threading.Lock()
+    todo = iter(range(requests))
+
+    def worker():
+        while True:
+            with lock:
+                if next(todo, None) is None:
+                    return
+            t0 = time.perf_counter()
+            try:
+                status, _ = standins.request(portal.url, method, path, body)
+            except OSError as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            dt = time.perf_counter() - t0
+            with lock:
+                lat.append(dt)
+                codes[status] = codes.get(status, 0) + 1
+
+    spawns0 = _spawns(portal)
+    s0, t0 = portal.stats(), time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    s1, elapsed = portal.stats(), time.monotonic() - t0
+    spawns = _spawns(portal) - spawns0
+    n = max(1, len(lat))
+    cpu = max(0.0, (s1["cpu"] - s0["cpu"]) - idle["cpu_per_s"] * elapsed)
+    child = max(0.0, (s1["child_cpu"] - s0["child_cpu"]) - idle["child_cpu_per_s"] * elapsed)
+    return {
+        "endpoint": spec,
+        "requests": len(lat),
+        "errors": len(errors),
+        "status": {str(k): v for k, v in sorted(codes.items())},
+        "p50_ms": round(_pct(lat, 50) * 1e3, 2) if lat else None,
+        "p99_ms": round(_pct(lat, 99) * 1e3, 2) if lat else None,
+        "max_ms": round(max(lat) * 1e3, 2) if lat else None,
+        "rps": round(len(lat) / elapsed, 1),
+        "cpu_ms_per_req": round(cpu * 1e3 / n, 3),
+        "child_cpu_ms_per_req": round(child * 1e3 / n, 3),
+        "spawns_per_req": round(spawns / n, 3),
+    }
+
+
+def compare(old: dict, new: dict) -> list:
+    """Per-endpoint ratios new/old for p50, p99, rps and CPU per request (>1 is slower/costlier except rps)."""
+    prev = {r["endpoint"]: r for r in old.get("results", [])}
+    out = []
+    for r in new.get("results", []):
+        o = prev.get(r["endpoint"])
+        if not o:
+            continue
+        row = {"endpoint": r["endpoint"]}
+        for k in ("p50_ms", "p99_ms", "rps", "cpu_ms_per_req"):
+            if o.get(k) and r.get(k) is not None:
+                row[k] = round(r[k] / o[k], 2)
+        out.append(row)
+    return out
+
+
+def run(args) -> dict:
+    endpoints = args.endpoint or DEFAULT_ENDPOINTS
+    with standins.Portal(args.port, args.cm_latency, args.cm_jitter, args.shim_delay,
+                         args.conntrack_flows, quiet=not args.verbose) as portal:
+        time.sleep(args.settle)
+        idle = _idle(portal, args.idle)
+        results = []
+        for spec in endpoints:
+            r = bench_endpoint(portal, spec, args.requests, args.concurrency, idle)
+            results.append(r)
+            print(f"{spec:<32} p50 {r['p50_ms']}ms  p99 {r['p99_ms']}ms  {r['rps']} req/s  "
+                  f"cpu {r['cpu_ms_per_req']}ms (+{r['child_cpu_ms_per_req']}ms children)", file=sys.stderr)
+        final = portal.stats()
+    return {
+        "bench": "portal_http",
+        "commit": standins.git_rev(),
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "config": {"requests": args.requests, "concurrency": args.concurrency, "cm_latency": args.cm_latency,
+                   "cm_jitter": args.cm_jitter, "shim_delay": args.shim_delay, "conntrack_flows": args.conntrack_flows},
+        "idle_cpu_pct": round(idle["cpu_per_s"] * 100.0, 2),
+        "rss_bytes": final["rss"],
+        "threads": final["threads"],
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark the portal's endpoints against local stand-ins")
+    ap.add_argument("--endpoint", action="append", metavar="'METHOD /path'",
+                    help="endpoint to time (repeatable; default: the dashboard's GETs)")
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--port", type=int, help="portal port (default: a free one)")
+    ap.add_argument("--cm-latency", type=float, default=0.02, help="fake circuit-manager latency, seconds")
+    ap.add_argument("--cm-jitter", type=float, default=0.25, help="+- share of --cm-latency")
+    ap.add_argument("--shim-delay", type=float, default=0.0, help="sleep in every shim binary, seconds")
+    ap.add_argument("--conntrack-flows", type=int, default=500)
+    ap.add_argument("--settle", type=float, default=2.0, help="seconds to let background threads start")
+    ap.add_argument("--idle", type=float, default=3.0, help="seconds of idle CPU baseline")
+    ap.add_argument("--out", help="result file (default: bench/results/portal_http-<commit>-<time>.json, - for stdout only)")
+    ap.add_argument("--compare", metavar="OLD.json", help="print ratios against an earlier result")
+    ap.add_argument("--verbose", action="store_true", help="show the portal's own output")
+    args = ap.parse_args()
+
+    result = run(args)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            result["compare"] = {"against": args.compare, "ratios": compare(json.load(f), result)}
+    json.dump(result, sys.stdout, indent=2)
+    print()
+    if args.out != "-":
+        print(f"wrote {standins.save_result(result, args.out)}", file=sys.stderr)
@@ -0,0 +1,453 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Benchmark stand-ins: everything app.py talks to, on one machine without
+# root. A fake Node circuit-manager (HTTP, configurable latency), shim
+# sudo / iptables-save / iptables-restore / nmcli / systemctl / systemd-run /
+# pgrep / kill switch scripts on PATH, a /proc/net/dev that counts up, a
+# conntrack dump, dnsmasq leases and a FakeControlPort. Portal() wires them
+# into the environment of a real `python3 app.py` on a free port.
+# ============================================================================
+
+import http.client, json, os, random, shutil, socket, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, ROOT)
+
+import controlport, firewall
+import conntrack_parse
+
+NMCLI_RECORDING = os.path.join(HERE, "data", "nmcli_wifi_list.txt")
+CLIENTS = ("192.168.7.2", "192.168.7.3", "192.168.7.4")
+
+COUNTRIES = ("DE", "NL", "FR", "SE", "CH", "US", "CA", "RO")
+COUNTRY_NAMES = {"DE": "Germany", "NL": "Netherlands", "FR": "France", "SE": "Sweden", "CH": "Switzerland",
+                 "US": "United States", "CA": "Canada", "RO": "Romania"}
+# (fingerprint, nickname, ip, flags, country)
+RELAYS = [(f"{i:040X}", f"relay{i}", f"10.{i // 250}.{i % 250}.1",
+           ("Fast", "Running", "Valid") + (("Guard",) if i % 3 == 0 else ()) + (("Exit",) if i % 2 else ()),
+           COUNTRIES[i % len(COUNTRIES)].lower())
+          for i in range(1, 97)]
+
+
+# ──────────────────────────────────────────────
+# Fake circuit-manager
+# ──────────────────────────────────────────────
+class FakeCircuitManager:
+    """
+    The Node circuit-manager's HTTP API on 127.0.0.1 with canned state.
+      latency:  seconds added to every response
+      jitter:   +- share of latency, uniformly
+    Hop/exit changes and NEWNYM build a new circuit after build_delay
+    seconds (the old one is served until then, like the real manager).
+    Request counts per path are kept in .requests.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, build_delay: float = 0.5, seed: int = 1):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.build_delay = float(build_delay)
+        self.requests = {}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.hop_count = 3
+        self.exit_country = "AUTO"
+        self.rotation = {"enabled": False, "intervalSeconds": 600, "variancePercent": 20}
+        self._rotated_at = time.time()
+        self._circuits = [self._build() for _ in range(4)]
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.base = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name="fake-circuit-manager", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # ---- state ----
+    def _build(self) -> dict:
+        cc = self.exit_country if self.exit_country != "AUTO" else self._rng.choice(COUNTRIES)
+        exits = [r for r in RELAYS if "Exit" in r[3] and r[4].upper() == cc] or RELAYS
+        roles = ["entry", "exit"] if self.hop_count == 2 else ["entry", "middle", "exit"]
+        hops = []
+        for role in roles:
+            fp, nick, ip, _flags, rcc = self._rng.choice(exits if role == "exit" else RELAYS)
+            hops.append({"role": role, "fingerprint": fp, "nickname": nick, "ip": ip,
+                         "country_code": rcc.upper(), "country_name": COUNTRY_NAMES.get(rcc.upper(), rcc.upper())})
+        return {"id": str(self._rng.randrange(10000, 99999)), "status": "BUILT", "hops": hops,
+                "createdAt": int(time.time() * 1000)}
+
+    def _rebuild_later(self):
+        def run():
+            time.sleep(self.build_delay)
+            with self._lock:
+                self._circuits.insert(0, self._build())
+                del self._circuits[6:]
+                self._rotated_at = time.time()
+        threading.Thread(target=run, daemon=True).start()
+
+    def _status(self) -> dict:
+        exit_cc = self._circuits[0]["hops"][-1]["country_code"]
+        return {"ok": True, "hopCount": self.hop_count, "bootstrapping": False, "circuitsCached": len(self._circuits),
+                "exitCountries": [] if self.exit_country == "AUTO" else [self.exit_country],
+                "observed": {"exitCountry": exit_cc}}
+
+    def handle(self, method: str, path: str, body: dict):
+        """(status, payload) for one request."""
+        url = urlsplit(path)
+        p = url.path
+        with self._lock:
+            self.requests[p] = self.requests.get(p, 0) + 1
+            if method == "GET" and p == "/status":
+                return 200, self._status()
+            if method == "GET" and p == "/circuit":
+                return 200, {"ok": True, **self._circuits[0]}
+            if method == "GET" and p == "/circuits":
+                order = "asc" if "order=asc" in (url.query or "") else "desc"
+                circs = sorted(self._circuits, key=lambda c: c["createdAt"], reverse=order == "desc")
+                return 200, {"ok": True, "circuits": circs}
+            if method == "GET" and p == "/available-exits":
+                return 200, {"ok": True, "countries": list(COUNTRIES)}
+            if method == "GET" and p == "/wait-ready":
+                return 200, {"ready": True}
+            if method == "GET" and p == "/rotation":
+                nxt = self._rotated_at + self.rotation["intervalSeconds"]
+                return 200, {"ok": True, **self.rotation, "lastRotationTs": int(self._rotated_at * 1000),
+                             "nextRotationTs": int(nxt * 1000) if self.rotation["enabled"] else 0}
+            if method == "POST" and p == "/rotation":
+                self.rotation.update({k: body[k] for k in self.rotation if k in body})
+                return 200, {"ok": True, **self.rotation}
+            if method == "POST" and p in ("/newnym", "/rotation/trigger"):
+                self._rebuild_later()
+                return 200, {"ok": True}
+            if method == "POST" and p == "/hopmode":
+                self.hop_count = 2 if int(body.get("hopCount") or 3) == 2 else 3
+                self._rebuild_later()
+                return 200, {"ok": True, "hopCount": self.hop_count}
+            if method == "POST" and p == "/exit":
+                self.exit_country = str(body.get("exitCountry") or "AUTO").upper()
+                self._rebuild_later()
+                return 200, {"ok": True, "exitCountry": self.exit_country}
+        return 404, {"ok": False, "error": f"no route {method} {p}"}
+
+    def _delay(self):
+        if self.latency > 0:
+            d = self.latency * (1.0 + self.jitter * (2.0 * random.random() - 1.0))
+            time.sleep(max(0.0, d))
+
+    def _handler(self):
+        cm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, method):
+                n = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(n) or b"{}") if n else {}
+                except ValueError:
+                    body = {}
+                cm._delay()
+                status, payload = cm.handle(method, self.path, body if isinstance(body, dict) else {})
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._reply("GET")
+
+            def do_POST(self):
+                self._reply("POST")
+
+            def log_message(self, *a):
+                pass
+
+        return Handler
+
+
+# ──────────────────────────────────────────────
+# Shim binaries (plain sh: a Python shim's startup would swamp the portal's own cost)
+# ──────────────────────────────────────────────
+_DELAY = '[ -n "$BENCH_SHIM_DELAY" ] && sleep "$BENCH_SHIM_DELAY"\n'
+
+SHIMS = {
+    # sudo [-n ...] cmd args -> cmd args
+    "sudo": 'while [ "$#" -gt 0 ]; do case "$1" in -*) shift;; *) break;; esac; done\nexec "$@"\n',
+    "iptables-save": _DELAY + 'cat "$BENCH_DIR/ruleset.txt"\n',
+    "iptables-restore": _DELAY + 'cat > "$BENCH_DIR/restored.txt"\n',
+    "ipset": _DELAY + 'cat > "$BENCH_DIR/ipset.txt"\n',
+    "nmcli": _DELAY + 'case " $* " in\n'
+                      '  *" list "*) cat "$BENCH_DIR/nmcli_wifi_list.txt";;\n'
+                      '  *" connect "*) echo "Device \'wlan0\' successfully activated.";;\n'
+                      'esac\n',
+    "systemctl": _DELAY + 'echo active\n',
+    # systemd-run [--unit X --flags...] cmd args -> cmd args
+    "systemd-run": 'while [ "$#" -gt 0 ]; do case "$1" in --unit|-u|-p|--property) shift 2;; -*) shift;; *) break;; esac; done\n'
+                   'exec "$@"\n',
+    "pgrep": "exit 1\n",
+    "anyone_killswitch.sh": _DELAY + 'case "$1" in\n'
+                                     '  on) echo ON > "$BENCH_DIR/killswitch"; echo ON;;\n'
+                                     '  off) echo OFF > "$BENCH_DIR/killswitch"; echo OFF;;\n'
+                                     '  *) cat "$BENCH_DIR/killswitch" 2>/dev/null || echo OFF;;\n'
+                                     'esac\n',
+}
+
+
+def write_shims(bin_dir: str):
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, body in SHIMS.items():
+        path = os.path.join(bin_dir, name)
+        with open(path, "w", encoding="ascii") as f:
+            f.write("#!/bin/sh\n" + body)
+        os.chmod(path, 0o755)
+
+
+def counted_ruleset(kind: str = "privacy", seed: int = 1) -> str:
+    """render_ruleset(kind) as `iptables-save -c` would print it, with counters on every rule."""
+    rng = random.Random(seed)
+    out = []
+    for line in firewall.render_ruleset(kind).splitlines():
+        if line.startswith("-A "):
+            pk = rng.randrange(10, 100000)
+            line = f"[{pk}:{pk * rng.randrange(60, 1400)}] {line}"
+        out.append(line)
+    return "\n".join(out) + "\n"
+
+
+# ──────────────────────────────────────────────
+# Fake /proc/net/dev (usb0 counting up)
+# ──────────────────────────────────────────────
+class FakeNetDev:
+    """Rewrites `path` every `interval` seconds with usb0 counters growing at rx_rate / tx_rate bytes/s."""
+
+    HEADER = ("Inter-|   Receive                                                |  Transmit\n"
+              " face |bytes    packets errs drop fifo frame compressed multicast|"
+              "bytes    packets errs drop fifo colls carrier compressed\n")
+
+    def __init__(self, path: str, iface: str = "usb0", rx_rate: float = 250e3, tx_rate: float = 40e3,
+                 interval: float = 0.5):
+        self.path, self.iface = path, iface
+        self.rx_rate, self.tx_rate, self.interval = float(rx_rate), float(tx_rate), float(interval)
+        self._t0 = time.monotonic()
+        self._stop = threading.Event()
+        self.write()
+
+    def write(self):
+        dt = time.monotonic() - self._t0
+        rx, tx = int(1e6 + self.rx_rate * dt), int(2e5 + self.tx_rate * dt)
+        lines = [f"    lo: {9000:>8} {90:>7} 0 0 0 0 0 0 {9000:>8} {90:>7} 0 0 0 0 0 0\n",
+                 f"{self.iface:>6}: {rx:>8} {rx // 900:>7} 0 0 0 0 0 0 {tx:>8} {tx // 300:>7} 0 0 0 0 0 0\n"]
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="ascii") as f:
+            f.write(self.HEADER + "".join(lines))
+        os.replace(tmp, self.path)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def start(self):
+        threading.Thread(target=self._loop, name="fake-net-dev", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+
+# ──────────────────────────────────────────────
+# The portal under test
+# ──────────────────────────────────────────────
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_stats(pid: int) -> dict:
+    """CPU seconds (own, and reaped children), RSS bytes and thread count of pid, from /proc."""
+    with open(f"/proc/{pid}/stat", encoding="ascii") as f:
+        fields = f.read().rpartition(")")[2].split()
+    tick = os.sysconf("SC_CLK_TCK")
+    page = os.sysconf("SC_PAGE_SIZE")
+    # fields[0] is field 3 (state): utime=14, stime=15, cutime=16, cstime=17, num_threads=20, rss=24
+    return {"cpu": (int(fields[11]) + int(fields[12])) / tick,
+            "child_cpu": (int(fields[13]) + int(fields[14])) / tick,
+            "threads": int(fields[17]),
+            "rss": int(fields[21]) * page}
+
+
+class Portal:
+    """
+    Starts `python3 app.py` against the stand-ins on a free port:
+      cm_latency / cm_jitter  fake circuit-manager response time (s)
+      shim_delay              sleep in every shim (s), e.g. 0.1 for nmcli on a Pi
+      conntrack_flows         size of the synthetic conntrack dump behind /api/flows
+    Use as a context manager; .url is the base URL, .pid the portal's pid.
+    """
+
+    def __init__(self, port: int | None = None, cm_latency: float = 0.02, cm_jitter: float = 0.25,
+                 shim_delay: float = 0.0, conntrack_flows: int = 500, env=None, quiet: bool = True):
+        self.port = port or free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.dir = tempfile.mkdtemp(prefix="anyone-stick-bench-")
+        self.cm = FakeCircuitManager(cm_latency, cm_jitter)
+        self.control = controlport.FakeControlPort(relays=RELAYS)
+        self.netdev = FakeNetDev(os.path.join(self.dir, "net_dev"))
+        self.shim_delay = float(shim_delay)
+        self.conntrack_flows = int(conntrack_flows)
+        self.extra_env = dict(env or {})
+        self.quiet = quiet
+        self.proc = None
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    def _prepare(self) -> dict:
+        d = self.dir
+        bin_dir = os.path.join(d, "bin")
+        write_shims(bin_dir)
+        with open(os.path.join(d, "ruleset.txt"), "w", encoding="ascii") as f:
+            f.write(counted_ruleset("privacy"))
+        shutil.copyfile(NMCLI_RECORDING, os.path.join(d, "nmcli_wifi_list.txt"))
+        with open(os.path.join(d, "leases"), "w", encoding="ascii") as f:
+            for i, ip in enumerate(CLIENTS):
+                f.write(f"{int(time.time()) + 3600} 02:00:00:00:00:{i + 2:02x} {ip} client{i} *\n")
+        with open(os.path.join(d, "nf_conntrack"), "w", encoding="ascii") as f:
+            f.writelines(conntrack_parse.synth(self.conntrack_flows))
+        env = dict(os.environ)
+        env.update({
+            "PATH": bin_dir + os.pathsep + env.get("PATH", ""),
+            "BENCH_DIR": d,
+            "BENCH_SHIM_DELAY": str(self.shim_delay) if self.shim_delay else "",
+            "PORTAL_PORT": str(self.port),
+            "CIRCUIT_MGR_BASE": self.cm.base,
+            "CONTROL_PORT_ADDR": f"{self.control.address[0]}:{self.control.address[1]}",
+            "KILLSWITCH_SCRIPT": os.path.join(bin_dir, "anyone_killswitch.sh"),
+            "BROKER_SOCKET": os.path.join(d, "no-broker.sock"),
+            "PROC_NET_DEV": self.netdev.path,
+            "PROC_CONNTRACK": os.path.join(d, "nf_conntrack"),
+            "DNSMASQ_LEASES_PATH": os.path.join(d, "leases"),
+            "MODE_STATE_PATH": os.path.join(d, "mode.json"),
+            "BOOT_REPORT_PATH": os.path.join(d, "boot.json"),
+            "CIRCUIT_POOL_PATH": os.path.join(d, "circuit_pool.json"),
+            "DNS_STATS_PATH": os.path.join(d, "dns.json"),
+            "BYPASS_PATH": os.path.join(d, "bypass.json"),
+            "BYPASS_STATE_PATH": os.path.join(d, "bypass-state.json"),
+            "ANONRC_PATH": os.path.join(d, "anonrc"),
+            "PYTHONDONTWRITEBYTECODE": "1",
+        })
+        env.update(self.extra_env)
+        return env
+
+    def start(self, timeout: float = 30.0):
+        self.cm.start()
+        self.control.start()
+        self.control.set_bootstrap(100, "done", "Done")
+        self.netdev.start()
+        env = self._prepare()
+        out = subprocess.DEVNULL if self.quiet else None
+        self.proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "app.py")], cwd=ROOT, env=env,
+                                     stdout=out, stderr=out)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"portal exited with {self.proc.returncode}")
+            try:
+                status, _ = request(self.url, "GET", "/api/mode", timeout=1.0)
+                if status == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.1)
+        self.stop()
+        raise RuntimeError(f"portal not answering on {self.url} after {timeout:.0f}s")
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(5)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self.netdev.stop()
+        self.control.stop()
+        self.cm.stop()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        return proc_stats(self.proc.pid)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ──────────────────────────────────────────────
+# Results
+# ──────────────────────────────────────────────
+RESULTS_DIR = os.path.join(HERE, "results")
+
+
+def git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "-C", ROOT, "rev-parse", "--short", "HEAD"],
+                                       text=True, stderr=subprocess.DEVNULL).strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_result(result: dict, path: str | None = None) -> str:
+    """Writes a bench result (default: bench/results/<bench>-<commit>-<time>.json); returns the path."""
+    path = path or os.path.join(
+        RESULTS_DIR, f"{result['bench']}-{result.get('commit') or 'nogit'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    return path
+
+
+def request(base: str, method: str, path: str, body=None, timeout: float = 10.0):
+    """(status, body bytes) over a fresh connection, like a browser fetch() to the dev server."""
+    u = urlsplit(base)
+    conn = http.client.HTTPConnection(u.hostname, u.port, timeout=timeout)
+    try:
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {"Content-Type": "application/json"} if data is not None else {}
+        conn.request(method, path, body=data, headers=headers)
+        r = conn.getresponse()
+        return r.status, r.read()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Run the portal against the stand-ins until Ctrl-C")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--cm-latency", type=float, default=0.02)
+    ap.add_argument("--shim-delay", type=float, default=0.0)
+    a = ap.parse_args()
+    with Portal(a.port, a.cm_latency, shim_delay=a.shim_delay, quiet=False) as p:
+        print(f"portal on {p.url} (circuit-manager {p.cm.base}, stand-ins in {p.dir})", file=sys.stderr)
+        try:
+            p.proc.wait()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Benchmark: wifi.parse_scan on recorded `nmcli -t -f IN-USE,BSSID,SSID,
+# CHAN,SIGNAL,SECURITY dev wifi list` output (bench/data/), against a plain
+# char-by-char unescaping splitter as the reference.
+# ============================================================================
+
+import argparse, json, os, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+import wifi
+
+DEFAULT_INPUT = os.path.join(HERE, "data", "nmcli_wifi_list.txt")
+
+
+def _split_charwise(line: str) -> list:
+    out, cur, i, n = [], [], 0, len(line)
+    while i < n:
+        c = line[i]
+        if c == "\\" and i + 1 < n:
+            cur.append(line[i + 1])
+            i += 2
+            continue
+        if c == ":":
+            out.append("".join(cur))
+            cur = []
+        else:
+            cur.append(c)
+        i += 1
+    out.append("".join(cur))
+    return out
+
+
+def _time(fn, arg, iterations: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn(arg)
+    return (time.perf_counter() - t0) / iterations
+
+
+def run(text: str, iterations: int, scale: int) -> dict:
+    text = text * scale
+    lines = text.splitlines()
+    assert [wifi.split_terse(l) for l in lines] == [_split_charwise(l) for l in lines]
+    parse_s = _time(wifi.parse_scan, text, iterations)
+    split_s = _time(lambda ls: [wifi.split_terse(l) for l in ls], lines, iterations)
+    ref_s = _time(lambda ls: [_split_charwise(l) for l in ls], lines, iterations)
+    return {
+        "lines": len(lines),
+        "networks": len(wifi.parse_scan(text)),
+        "iterations": iterations,
+        "parse_us": round(parse_s * 1e6, 1),
+        "lines_per_s": round(len(lines) / parse_s),
+        "split_us": round(split_s * 1e6, 1),
+        "split_charwise_us": round(ref_s * 1e6, 1),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark the nmcli Wi-Fi scan parser")
+    ap.add_argument("--input", default=DEFAULT_INPUT)
+    ap.add_argument("--iterations", type=int, default=2000)
+    ap.add_argument("--scale", type=int, nargs="+", default=[1, 10],
+                    help="repeat the recording N times (dense areas list hundreds of BSSIDs)")
+    args = ap.parse_args()
+    with open(args.input, encoding="utf-8") as f:
+        recorded = f.read()
+    results = [run(recorded, max(1, args.iterations // s), s) for s in args.scale]
+    json.dump({"bench": "wifi_parse", "results": results}, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — domain blocklist
+# Compact, read-only set of blocked domains for the DNS proxy's sinkhole: a
+# listed domain blocks itself and every name below it. The source list
+# (hosts format, plain domains or `||domain^` lines) is compiled once into
+# a sorted array of reversed names ("com.example.ads.") in one bytes blob
+# plus a uint32 offset array, and a Bloom filter over the same keys. A
+# lookup tries the name's parent domains against the Bloom filter and
+# binary-searches only those that pass. The compiled form is cached next to
+# the list (BLOCKLIST_CACHE_PATH) and reloaded with one read while the
+# source is unchanged: ~23 bytes per entry instead of ~80 for a set of
+# bytes.
+# ============================================================================
+
+import array, hashlib, os, re, struct, sys, time
+
+BLOCKLIST_PATH = os.environ.get("BLOCKLIST_PATH", "/var/lib/anyone-stick/blocklist.txt")
+BLOCKLIST_CACHE_PATH = os.environ.get("BLOCKLIST_CACHE_PATH", "/var/lib/anyone-stick/blocklist.bin")
+BLOOM_BITS_PER_ENTRY = 10       # with k = 7: ~1% false positives
+BLOOM_K = 7
+
+_MAGIC = b"ASBL1"
+# magic, entries, blob bytes, bloom bits, bloom k, source mtime_ns, source size
+_HEADER = struct.Struct("<5sIIIIqq")
+_VALID = re.compile(rb"^[a-z0-9_-]+(\.[a-z0-9_-]+)+$")
+_HOSTS_IGNORE = {b"localhost", b"localhost.localdomain", b"local", b"broadcasthost", b"ip6-localhost",
+                 b"ip6-loopback", b"0.0.0.0"}
+
+
+def _key(name: bytes) -> bytes:
+    """b"Ads.Example.com" -> b"com.example.ads." (the trailing dot keeps a domain's subtree contiguous)."""
+    return b".".join(reversed(name.strip(b".").lower().split(b"."))) + b"."
+
+
+def parse(lines):
+    """Domains (bytes) from hosts-format, plain or adblock-style (`||domain^`) lines; comments and junk skipped."""
+    for line in lines:
+        if isinstance(line, str):
+            line = line.encode("ascii", "ignore")
+        line = line.split(b"#", 1)[0].strip()
+        if not line or line.startswith(b"!"):
+            continue
+        if line.startswith(b"||"):
+            names = [line[2:].split(b"^", 1)[0]]
+        else:
+            names = line.split()
+            if len(names) > 1 and (b":" in names[0] or names[0].replace(b".", b"").isdigit()):
+                names = names[1:]       # hosts format: address first
+        for name in names:
+            name = name.strip(b".").lower()
+            if name not in _HOSTS_IGNORE and _VALID.match(name):
+                yield name
+
+
+_blake2b = hashlib.blake2b
+_HASH = struct.Struct("<II").unpack
+
+
+def _bloom_positions(key: bytes, bits: int, k: int):
+    h1, h2 = _HASH(_blake2b(key, digest_size=8).digest())
+    h2 |= 1
+    return [(h1 + i * h2) % bits for i in range(k)]
+
+
+class Blocklist:
+    """
+    Blocklist.compile(domains) / Blocklist.open(source, cache) build it,
+    match(name) -> the listed domain covering name (b"example.com") or None.
+    """
+
+    def __init__(self, offsets: array.array, blob: bytes, bloom: bytearray, bloom_bits: int, k: int,
+                 source_mtime_ns: int = 0, source_size: int = 0):
+        self.offsets, self.blob = offsets, blob
+        self.bloom, self.bloom_bits, self.k = bloom, bloom_bits, k
+        self.source_mtime_ns, self.source_size = source_mtime_ns, source_size
+        self.entries = len(offsets) - 1
+        self.source = None
+        self.load_ms = None
+        self.from_cache = False
+
+    # ---- build ----
+    @classmethod
+    def compile(cls, domains, bits_per_entry: int = BLOOM_BITS_PER_ENTRY, k: int = BLOOM_K):
+        keys = sorted({_key(d) for d in domains})
+        kept, last = [], None
+        for key in keys:
+            # Sorted with the trailing dot, a domain's subdomains follow it directly: drop the covered ones.
+            if last is not None and key.startswith(last):
+                continue
+            kept.append(key)
+            last = key
+        offsets = array.array("I", [0])
+        pos = 0
+        for key in kept:
+            pos += len(key)
+            offsets.append(pos)
+        bits = max(64, len(kept) * bits_per_entry)
+        bloom = bytearray((bits + 7) // 8)
+        for key in kept:
+            for p in _bloom_positions(key, bits, k):
+                bloom[p >> 3] |= 1 << (p & 7)
+        return cls(offsets, b"".join(kept), bloom, bits, k)
+
+    @classmethod
+    def open(cls, source: str = BLOCKLIST_PATH, cache: str | None = BLOCKLIST_CACHE_PATH):
+        """Loads the compiled cache when it matches source's mtime/size, else compiles source and rewrites the cache."""
+        t0 = time.perf_counter()
+        st = os.stat(source)
+        bl = None
+        if cache:
+            try:
+                bl = cls.load(cache)
+            except (OSError, ValueError):
+                bl = None
+            if bl is not None and (bl.source_mtime_ns, bl.source_size) != (st.st_mtime_ns, st.st_size):
+                bl = None
+        if bl is None:
+            with open(source, "rb") as f:
+                bl = cls.compile(parse(f))
+            bl.source_mtime_ns, bl.source_size = st.st_mtime_ns, st.st_size
+            if cache:
+                try:
+                    bl.save(cache)
+                except OSError:
+                    pass
+        else:
+            bl.from_cache = True
+        bl.source = source
+        bl.load_ms = round((time.perf_counter() - t0) * 1000.0, 1)
+        return bl
+
+    def stale(self) -> bool:
+        """True when the source list changed (or vanished) since this was built."""
+        try:
+            st = os.stat(self.source)
+        except (OSError, TypeError):
+            return True
+        return (st.st_mtime_ns, st.st_size) != (self.source_mtime_ns, self.source_size)
+
+    # ---- binary cache ----
+    def save(self, path: str):
+        offsets = self.offsets
+        if sys.byteorder == "big":
+            offsets = array.array("I", offsets)
+            offsets.byteswap()
+        tmp = f"{path}.tmp"
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.entries, len(self.blob), self.bloom_bits, self.k,
+                                 self.source_mtime_ns, self.source_size))
+            f.write(offsets.tobytes())
+            f.write(self.blob)
+            f.write(self.bloom)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise ValueError("short blocklist cache")
+        magic, n, blob_len, bits, k, mtime_ns, size = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("not a blocklist cache")
+        pos = _HEADER.size
+        offsets = array.array("I")
+        if offsets.itemsize != 4:
+            raise ValueError("unsupported platform: uint32 array")
+        offsets.frombytes(data[pos:pos + 4 * (n + 1)])
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        pos += 4 * (n + 1)
+        blob = data[pos:pos + blob_len]
+        pos += blob_len
+        bloom = bytearray(data[pos:pos + (bits + 7) // 8])
+        if len(offsets) != n + 1 or len(blob) != blob_len or len(bloom) != (bits + 7) // 8:
+            raise ValueError("truncated blocklist cache")
+        return cls(offsets, blob, bloom, bits, k, mtime_ns, size)
+
+    # ---- lookup ----
+    def _maybe(self, key: bytes) -> bool:
+        h1, h2 = _HASH(_blake2b(key, digest_size=8).digest())
+        h2 |= 1
+        bloom, bits = self.bloom, self.bloom_bits
+        for _ in range(self.k):
+            p = h1 % bits
+            if not bloom[p >> 3] & (1 << (p & 7)):
+                return False
+            h1 += h2
+        return True
+
+    def _has(self, key: bytes) -> bool:
+        offsets, blob = self.offsets, self.blob
+        lo, hi = 0, self.entries
+        while lo < hi:
+            mid = (lo + hi) >> 1
+            v = blob[offsets[mid]:offsets[mid + 1]]
+            if v < key:
+                lo = mid + 1
+            elif v > key:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def match(self, name: bytes):
+        """The listed domain that covers name (itself or a parent), or None."""
+        if isinstance(name, str):
+            name = name.encode("ascii", "ignore")
+        key = _key(name)
+        # Parents from the registrable level down: "com.example.", "com.example.ads.", ...
+        i = key.find(b".", key.find(b".") + 1)
+        while i != -1:
+            k = key[:i + 1]
+            if self._maybe(k) and self._has(k):
+                return b".".join(reversed(k[:-1].split(b".")))
+            i = key.find(b".", i + 1)
+        return None
+
+    def __contains__(self, name) -> bool:
+        return self.match(name) is not None
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def nbytes(self) -> int:
+        """Memory held by the three arrays (what a lookup touches)."""
+        return len(self.blob) + len(self.bloom) + self.offsets.itemsize * len(self.offsets)
+
+    def info(self) -> dict:
+        return {"source": self.source, "entries": self.entries, "memory_bytes": self.nbytes(),
+                "load_ms": self.load_ms, "from_cache": self.from_cache}
+
+
+if __name__ == "__main__":
+    import argparse, json
+    ap = argparse.ArgumentParser(description="Compile / query the DNS sinkhole blocklist")
+    ap.add_argument("--source", default=BLOCKLIST_PATH)
+    ap.add_argument("--cache", default=BLOCKLIST_CACHE_PATH, help="compiled cache ('' = none)")
+    ap.add_argument("names", nargs="*", help="names to look up")
+    args = ap.parse_args()
+    bl = Blocklist.open(args.source, args.cache or None)
+    out = bl.info()
+    if args.names:
+        out["lookups"] = {n: (m.decode() if (m := bl.match(n.encode())) else None) for n in args.names}
+    json.dump(out, sys.stdout, indent=2)
+    print()
@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — privileged command broker
+# Long-lived root helper on a Unix socket, so the portal never pays a sudo
+# (PAM + policy) and shell fork per privileged call. JSON lines:
+#   -> {"id": 1, "cmd": "killswitch.set", "args": {"enabled": true}}
+#   <- {"id": 1, "ok": true, "result": true}
+#   <- {"id": 1, "ok": false, "code": "bad_args", "error": "..."}
+# The vocabulary is fixed and typed (COMMANDS); nothing is passed to a shell.
+# BrokerClient is the portal side; FakeBroker is a stand-in for offline tests.
+# ============================================================================
+
+import itertools, json, os, socket, socketserver, subprocess, tempfile, threading, time
+
+import bypass, firewall, proctrace, wifi
+
+BROKER_SOCKET = os.environ.get("BROKER_SOCKET", "/run/anyone-stick/broker.sock")
+BROKER_GROUP = os.environ.get("BROKER_GROUP", "")    # optional: socket 0660 root:<group>
+KILLSWITCH_SCRIPT = os.environ.get("KILLSWITCH_SCRIPT", "/usr/local/bin/anyone_killswitch.sh")
+MODE_STATE_PATH = os.environ.get("MODE_STATE_PATH", "/run/anyone-stick-mode.json")
+IPTABLES_SAVE_CMD = ["iptables-save", "-c"]          # already root: no sudo
+IPSET_CMD = ["ipset"]
+
+MAX_LINE = 64 * 1024
+MAX_STR = 256
+_REQUIRED = object()
+
+
+class BrokerError(RuntimeError):
+    """The broker answered with an error; .code is bad_request/unknown_cmd/bad_args/busy/failed."""
+
+    def __init__(self, msg: str, code: str = "failed"):
+        super().__init__(msg)
+        self.code = code
+
+
+class BrokerUnavailable(BrokerError):
+    """No broker listening (socket missing / refused / died mid-call)."""
+
+    def __init__(self, msg: str):
+        super().__init__(msg, "unavailable")
+
+
+# ──────────────────────────────────────────────
+# Commands (run as root)
+# ──────────────────────────────────────────────
+def _killswitch(arg: str) -> bool:
+    out = proctrace.run([KILLSWITCH_SCRIPT, arg], capture_output=True, text=True, timeout=15)
+    text = ((out.stdout or "") + (out.stderr or "")).strip()
+    if arg != "status" and out.returncode != 0:
+        raise RuntimeError(text or f"{KILLSWITCH_SCRIPT} {arg} rc={out.returncode}")
+    return text.upper() == "ON"
+
+
+def cmd_ping() -> dict:
+    return {"pid": os.getpid(), "uid": os.geteuid(), "ts": time.time()}
+
+
+def cmd_fw_snapshot() -> dict:
+    return firewall.snapshot(cmd=IPTABLES_SAVE_CMD)
+
+
+def cmd_fw_accounting() -> dict:
+    return firewall.client_counters(cmd=IPTABLES_SAVE_CMD)
+
+
+def cmd_killswitch_get() -> bool:
+    return _killswitch("status")
+
+
+def cmd_killswitch_set(enabled: bool) -> bool:
+    return _killswitch("on" if enabled else "off")
+
+
+_mode_lock = threading.Lock()
+
+
+def cmd_mode_apply(kind: str) -> dict:
+    """
+    Runs the mode engine to completion (step timings land in MODE_STATE_PATH)
+    and returns its result; the caller records the final state.
+    """
+    if not _mode_lock.acquire(blocking=False):
+        raise BrokerError("a mode switch is already running", "busy")
+    try:
+        return firewall.apply_mode(kind, MODE_STATE_PATH)
+    finally:
+        _mode_lock.release()
+
+
+def cmd_bypass_apply() -> dict:
+    """Loads the stored bypass list (bypass.BYPASS_PATH, written by the portal) into the kernel sets."""
+    return bypass.apply(cmd=IPSET_CMD)
+
+
+def cmd_wifi_scan(rescan: bool = False) -> dict:
+    return wifi.scan(rescan=rescan)
+
+
+def cmd_wifi_connect(ssid: str, password: str = "") -> dict:
+    return wifi.connect(ssid, password)
+
+
+# name -> (handler, {arg: (type or tuple of allowed values, default)})
+COMMANDS = {
+    "ping":           (cmd_ping, {}),
+    "fw.snapshot":    (cmd_fw_snapshot, {}),
+    "fw.accounting":  (cmd_fw_accounting, {}),
+    "killswitch.get": (cmd_killswitch_get, {}),
+    "killswitch.set": (cmd_killswitch_set, {"enabled": (bool, _REQUIRED)}),
+    "mode.apply":     (cmd_mode_apply, {"kind": (("privacy", "normal"), _REQUIRED)}),
+    "bypass.apply":   (cmd_bypass_apply, {}),
+    "wifi.scan":      (cmd_wifi_scan, {"rescan": (bool, False)}),
+    "wifi.connect":   (cmd_wifi_connect, {"ssid": (str, _REQUIRED), "password": (str, "")}),
+}
+
+
+def _check_args(spec: dict, args) -> dict:
+    if not isinstance(args, dict):
+        raise BrokerError("args must be an object", "bad_args")
+    extra = set(args) - set(spec)
+    if extra:
+        raise BrokerError(f"unexpected args: {', '.join(sorted(extra))}", "bad_args")
+    out = {}
+    for name, (typ, default) in spec.items():
+        if name not in args:
+            if default is _REQUIRED:
+                raise BrokerError(f"missing arg: {name}", "bad_args")
+            out[name] = default
+            continue
+        v = args[name]
+        if isinstance(typ, tuple):
+            if v not in typ:
+                raise BrokerError(f"{name} must be one of {', '.join(typ)}", "bad_args")
+        elif type(v) is not typ:
+            raise BrokerError(f"{name} must be {typ.__name__}", "bad_args")
+        elif typ is str and (len(v) > MAX_STR or "\x00" in v):
+            raise BrokerError(f"{name} too long or contains NUL", "bad_args")
+        out[name] = v
+    return out
+
+
+def dispatch(commands: dict, line: bytes) -> dict:
+    rid = None
+    try:
+        try:
+            req = json.loads(line)
+        except ValueError:
+            raise BrokerError("invalid JSON", "bad_request")
+        if not isinstance(req, dict):
+            raise BrokerError("request must be an object", "bad_request")
+        rid = req.get("id")
+        entry = commands.get(req.get("cmd"))
+        if entry is None:
+            raise BrokerError(f"unknown command: {req.get('cmd')!r}", "unknown_cmd")
+        fn, spec = entry
+        return {"id": rid, "ok": True, "result": fn(**_check_args(spec, req.get("args") or {}))}
+    except BrokerError as e:
+        return {"id": rid, "ok": False, "code": e.code, "error": str(e)}
+    except Exception as e:
+        return {"id": rid, "ok": False, "code": "failed", "error": str(e) or e.__class__.__name__}
+
+
+# ──────────────────────────────────────────────
+# Server
+# ──────────────────────────────────────────────
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Broker:
+    """Serves `commands` on a Unix socket; one thread per connection, many requests per connection."""
+
+    def __init__(self, path: str = BROKER_SOCKET, commands=None, group: str = BROKER_GROUP):
+        self.path = path
+        self.commands = dict(COMMANDS if commands is None else commands)
+        self.group = group
+        self._server = None
+
+    def _bind(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        commands = self.commands
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                while True:
+                    line = self.rfile.readline(MAX_LINE + 1)
+                    if not line:
+                        return
+                    if len(line) > MAX_LINE:
+                        resp = {"id": None, "ok": False, "code": "bad_request", "error": "request too large"}
+                    else:
+                        resp = dispatch(commands, line)
+                    self.wfile.write(json.dumps(resp, separators=(",", ":")).encode("utf-8") + b"\n")
+                    self.wfile.flush()
+
+        old = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, Handler)
+        finally:
+            os.umask(old)
+        if self.group:
+            import grp
+            os.chown(self.path, 0, grp.getgrnam(self.group).gr_gid)
+            os.chmod(self.path, 0o660)
+
+    def serve_forever(self):
+        self._bind()
+        self._server.serve_forever()
+
+    def start(self):
+        self._bind()
+        threading.Thread(target=self._server.serve_forever, name="broker", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ──────────────────────────────────────────────
+# Client (portal side)
+# ──────────────────────────────────────────────
+class BrokerClient:
+    """
+    Persistent connections to the broker (small idle stack, one request in
+    flight per connection). call() returns the result or raises BrokerError;
+    BrokerUnavailable means "fall back to the direct path".
+    """
+
+    def __init__(self, path: str = BROKER_SOCKET, timeout: float = 10.0, max_idle: int = 4):
+        self.path = path
+        self.timeout = float(timeout)
+        self.max_idle = int(max_idle)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._ids = itertools.count(1)
+
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            s.connect(self.path)
+        except OSError as e:
+            s.close()
+            raise BrokerUnavailable(f"broker: {e}")
+        return s, s.makefile("rb")
+
+    def _roundtrip(self, conn, payload: bytes, timeout: float) -> bytes:
+        s, rf = conn
+        s.settimeout(timeout)
+        s.sendall(payload)
+        line = rf.readline(MAX_LINE * 64)
+        if not line:
+            raise ConnectionResetError("broker closed the connection")
+        return line
+
+    def _discard(self, conn):
+        for c in (conn[1], conn[0]):
+            try:
+                c.close()
+            except OSError:
+                pass
+
+    def call(self, cmd: str, timeout: float | None = None, **args):
+        timeout = self.timeout if timeout is None else float(timeout)
+        rid = next(self._ids)
+        payload = json.dumps({"id": rid, "cmd": cmd, "args": args}, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._connect()
+        try:
+            line = self._roundtrip(conn, payload, timeout)
+        except socket.timeout:
+            self._discard(conn)
+            raise BrokerError(f"broker: {cmd} timed out after {timeout}s", "timeout")
+        except OSError as e:
+            self._discard(conn)
+            if not reused:
+                raise BrokerUnavailable(f"broker: {e}")
+            # Idle connection went stale (broker restarted): one retry on a fresh one.
+            conn = self._connect()
+            try:
+                line = self._roundtrip(conn, payload, timeout)
+            except OSError as e2:
+                self._discard(conn)
+                raise BrokerUnavailable(f"broker: {e2}")
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                conn = None
+        if conn is not None:
+            self._discard(conn)
+        resp = json.loads(line)
+        if not resp.get("ok"):
+            raise BrokerError(resp.get("error") or "broker error", resp.get("code") or "failed")
+        return resp.get("result")
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            self._discard(conn)
+
+
+# ──────────────────────────────────────────────
+# Fake broker (offline tests): same protocol and argument checks,
+# in-memory state instead of iptables / kill switch / nmcli
+# ──────────────────────────────────────────────
+class FakeBroker(Broker):
+    """
+    Broker on a temp socket with canned state:
+      .ruleset    iptables-save text behind fw.snapshot / fw.accounting (mode.apply swaps it)
+      .killswitch bool behind killswitch.get/set
+      .networks   list returned by wifi.scan
+      .bypass     last list loaded by bypass.apply (read from bypass.BYPASS_PATH)
+    Every request is recorded in .calls as (cmd, args).
+    """
+
+    def __init__(self, ruleset: str | None = None, killswitch: bool = False, networks=None, delay: float = 0.0):
+        self.ruleset = firewall.render_ruleset("normal") if ruleset is None else ruleset
+        self.killswitch = bool(killswitch)
+        self.networks = list(networks or [])
+        self.bypass = bypass.empty()
+        self.delay = float(delay)
+        self.calls = []
+        self._dir = tempfile.mkdtemp(prefix="fake-broker-")
+        commands = {}
+        for name, (_fn, spec) in COMMANDS.items():
+            commands[name] = (self._recorder(name, getattr(self, "_" + name.replace(".", "_"))), spec)
+        super().__init__(os.path.join(self._dir, "broker.sock"), commands, group="")
+
+    def _recorder(self, name, fn):
+        def run(**args):
+            self.calls.append((name, args))
+            if self.delay:
+                time.sleep(self.delay)
+            return fn(**args)
+        return run
+
+    def _ping(self):
+        return {"pid": os.getpid(), "uid": os.geteuid(), "ts": time.time(), "fake": True}
+
+    def _fw_snapshot(self):
+        return firewall.snapshot(text=self.ruleset)
+
+    def _fw_accounting(self):
+        return firewall.client_counters(text=self.ruleset)
+
+    def _killswitch_get(self):
+        return self.killswitch
+
+    def _killswitch_set(self, enabled):
+        self.killswitch = enabled
+        return enabled
+
+    def _mode_apply(self, kind):
+        self.ruleset = firewall.render_ruleset(kind)
+        return {"ok": True, "steps": [{"step": "ruleset", "ok": True, "ms": 0.0}], "apply_ms": 0.0}
+
+    def _bypass_apply(self):
+        self.bypass = bypass.load()
+        return {"ok": True, "nets": len(self.bypass["nets"]), "ports": len(self.bypass["ports"]),
+                "domains": len(self.bypass["domains"]), "resolved": {d: [] for d in self.bypass["domains"]},
+                "apply_ms": 0.0, "ts": time.time()}
+
+    def _wifi_scan(self, rescan=False):
+        return {"ok": True, "networks": self.networks, "rescanned": rescan, "scan_ms": 0.0}
+
+    def _wifi_connect(self, ssid, password=""):
+        return {"ok": any(n.get("ssid") == ssid for n in self.networks)} if self.networks else {"ok": True}
+
+    def stop(self):
+        super().stop()
+        try:
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Anyone Stick privileged broker")
+    ap.add_argument("--socket", default=BROKER_SOCKET)
+    ap.add_argument("--call", metavar="CMD", help="client mode: send one command and print the result")
+    ap.add_argument("--args", default="{}", help="JSON args for --call")
+    a = ap.parse_args()
+    if a.call:
+        try:
+            res = BrokerClient(a.socket).call(a.call, **json.loads(a.args))
+        except BrokerError as e:
+            print(f"{e.code}: {e}", file=sys.stderr)
+            sys.exit(1)
+        json.dump(res, sys.stdout, indent=2)
+        print()
+    else:
+        Broker(a.socket).serve_forever()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — static asset build
+# Subsets the portal font, shrinks the logo, writes both under content-hashed
+# names (+ .gz/.br where it pays off) and a manifest the portal reads at start.
+# Run at install time; fontTools / Pillow / brotli are used when present.
+# No font ships with the repo: the font is only bundled if one was put in
+# static/fonts/ (pi/install_final.sh fetches it when MONA_SANS_URL is set).
+# ============================================================================
+
+import argparse, glob, gzip, hashlib, io, json, os, shutil, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(HERE, "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+MANIFEST_NAME = "manifest.json"
+
+# Logo is shown at max-width:180px; 2x covers high-DPI screens.
+LOGO_WIDTH = 360
+# Latin + Latin-1/Extended-A (country names, SSIDs), punctuation, arrows, minus.
+FONT_UNICODES = "U+0020-007E,U+00A0-017F,U+2010-2027,U+2030-203A,U+20AC,U+2190-2193,U+2212"
+FONT_SUFFIXES = (".woff2", ".woff", ".ttf", ".otf")
+FONT_TYPES = {".woff2": "font/woff2", ".woff": "font/woff", ".ttf": "font/ttf", ".otf": "font/otf"}
+IMAGE_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".webp": "image/webp", ".svg": "image/svg+xml"}
+# Precompressed variants are kept only if they save at least this fraction.
+MIN_SAVING = 0.10
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _hashed_name(stem: str, data: bytes, suffix: str) -> str:
+    return f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{suffix}"
+
+
+def optimize_logo(path: str):
+    """-> (bytes, suffix, extra manifest fields). Falls back to the source file without Pillow."""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        from PIL import Image
+    except ImportError:
+        return raw, os.path.splitext(path)[1].lower(), {}
+    src = Image.open(io.BytesIO(raw))
+    img = src
+    if img.width > LOGO_WIDTH:
+        img = img.resize((LOGO_WIDTH, round(img.height * LOGO_WIDTH / img.width)), Image.LANCZOS)
+    buf = io.BytesIO()
+    img.save(buf, "PNG", optimize=True)
+    out = buf.getvalue()
+    if len(out) >= len(raw):
+        return raw, os.path.splitext(path)[1].lower(), {"width": src.width, "height": src.height}
+    return out, ".png", {"width": img.width, "height": img.height}
+
+
+def subset_font(path: str):
+    """-> (bytes, suffix). Subsets to FONT_UNICODES with fontTools, else copies the file as-is."""
+    suffix = os.path.splitext(path)[1].lower()
+    try:
+        from fontTools import subset
+    except ImportError:
+        with open(path, "rb") as f:
+            return f.read(), suffix
+    opts = subset.Options()
+    # woff2 needs brotli; woff (zlib) is the fallback container.
+    opts.flavor = "woff2" if brotli else "woff"
+    opts.layout_features = ["*"]
+    font = subset.load_font(path, opts)
+    sub = subset.Subsetter(opts)
+    sub.populate(unicodes=subset.parse_unicodes(FONT_UNICODES))
+    sub.subset(font)
+    buf = io.BytesIO()
+    subset.save_font(font, buf, opts)
+    return buf.getvalue(), "." + opts.flavor
+
+
+def precompress(data: bytes) -> dict:
+    """{encoding: bytes} for the variants that are worth serving."""
+    out = {}
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) <= len(data) * (1 - MIN_SAVING):
+        out["gzip"] = gz
+    if brotli:
+        br = brotli.compress(data, quality=11)
+        if len(br) <= len(data) * (1 - MIN_SAVING):
+            out["br"] = br
+    return out
+
+
+_ENC_SUFFIX = {"gzip": ".gz", "br": ".br"}
+
+
+def _emit(out_dir: str, stem: str, data: bytes, suffix: str, mimetype: str, extra=None) -> dict:
+    name = _hashed_name(stem, data, suffix)
+    with open(os.path.join(out_dir, name), "wb") as f:
+        f.write(data)
+    variants = precompress(data)
+    for enc, blob in variants.items():
+        with open(os.path.join(out_dir, name + _ENC_SUFFIX[enc]), "wb") as f:
+            f.write(blob)
+    entry = {"file": name, "type": mimetype, "bytes": len(data),
+             "encodings": {enc: len(blob) for enc, blob in variants.items()}}
+    entry.update(extra or {})
+    return entry
+
+
+def find_font(static_dir: str):
+    for path in sorted(glob.glob(os.path.join(static_dir, "fonts", "*"))):
+        if path.lower().endswith(FONT_SUFFIXES):
+            return path
+    return None
+
+
+def build(logo: str | None, font: str | None, out_dir: str) -> dict:
+    t0 = time.monotonic()
+    tmp = out_dir + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    assets = {}
+    if logo and os.path.exists(logo):
+        data, suffix, extra = optimize_logo(logo)
+        assets["logo"] = _emit(tmp, "logo", data, suffix, IMAGE_TYPES.get(suffix, "application/octet-stream"), extra)
+    if font and os.path.exists(font):
+        data, suffix = subset_font(font)
+        assets["font"] = _emit(tmp, "mona-sans", data, suffix, FONT_TYPES.get(suffix, "application/octet-stream"))
+    manifest = {"version": 1, "built": int(time.time()), "assets": assets,
+                "build_ms": round((time.monotonic() - t0) * 1000.0, 1)}
+    with open(os.path.join(tmp, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    # Swap the whole directory so the portal never sees a half-written build.
+    old = out_dir + ".old"
+    shutil.rmtree(old, ignore_errors=True)
+    if os.path.isdir(out_dir):
+        os.rename(out_dir, old)
+    os.rename(tmp, out_dir)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build hashed, precompressed portal assets")
+    ap.add_argument("--logo", default=os.path.join(STATIC_DIR, "logo.png"))
+    ap.add_argument("--font", default=None, help="Mona Sans source (.ttf/.woff2); default: first file in static/fonts/")
+    ap.add_argument("--out", default=DIST_DIR)
+    args = ap.parse_args()
+    m = build(args.logo, args.font or find_font(STATIC_DIR), args.out)
+    json.dump(m, sys.stdout, indent=2)
+    print()
+    if "font" not in m["assets"]:
+        print("note: no font bundled; the portal falls back to the system font stack", file=sys.stderr)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — split tunnel bypass
+# Destinations that skip the tunnel in privacy mode: CIDRs, TCP destination
+# ports and domains. They live in kernel sets, so the check in nat
+# PREROUTING is one hash / bitmap lookup however long the list grows:
+#   anyone-bypass-net   hash:net     CIDRs + domain addresses resolved on apply
+#   anyone-bypass-dns   hash:ip      addresses the DNS proxy handed out for
+#                                    bypass domains (timeout: answer TTL + grace)
+#   anyone-bypass-port  bitmap:port  TCP destination ports
+# dnsproxy.py resolves bypass domains outside the tunnel (the system
+# resolver) and adds every A record it answers with to anyone-bypass-dns
+# before replying, so the set holds exactly the addresses the clients get.
+# firewall.py RETURNs matching flows before the TransPort REDIRECT and
+# counts their forwarded bytes in the filter chains bypass-tx / bypass-rx.
+# The list is kept in BYPASS_PATH; apply() loads it with one `ipset restore`
+# into scratch sets that are then swapped in, so the rules never see a
+# half-filled set. The last result (with the resolved addresses) goes to
+# BYPASS_STATE_PATH; a mode switch reloads the sets from those addresses
+# instead of resolving again.
+# ============================================================================
+
+import ipaddress, json, os, queue, re, socket, subprocess, threading, time
+
+import proctrace, statefile
+
+BYPASS_PATH = os.environ.get("BYPASS_PATH", "/var/lib/anyone-stick/bypass.json")
+BYPASS_STATE_PATH = os.environ.get("BYPASS_STATE_PATH", "/run/anyone-stick-bypass.json")
+IPSET_CMD = ["sudo", "ipset"]
+
+SET_NET = "anyone-bypass-net"
+SET_PORT = "anyone-bypass-port"
+SET_DNS = "anyone-bypass-dns"
+CHAIN_TX = "bypass-tx"      # filter: usb0 -> wlan0, bypassed
+CHAIN_RX = "bypass-rx"      # filter: wlan0 -> usb0, bypassed
+NET_MAXELEM = 65536
+DNS_SET_GRACE = 600         # entry outlives its answer's TTL by this (clients cache a little longer)
+DNS_SET_MAX_TIMEOUT = 86400
+MAX_ENTRIES = 4096          # per list
+MAX_DOMAINS = 64            # each one is a lookup on every resolving apply
+RESOLVE_DEADLINE = 5.0      # for all domains together (looked up concurrently)
+RESOLVE_WORKERS = 16
+
+KINDS = ("nets", "ports", "domains")
+_PORT_RE = re.compile(r"^(\d{1,5})(?:-(\d{1,5}))?$")
+_DOMAIN_RE = re.compile(r"^(?=.{1,253}$)([a-z0-9_]([a-z0-9_-]{0,61}[a-z0-9_])?\.)+[a-z0-9-]{2,63}$")
+
+
+def empty() -> dict:
+    return {k: [] for k in KINDS}
+
+
+def classify(entry) -> tuple:
+    """'10.0.0.0/8' / '1.2.3.4' -> ("nets", ...), '22' / '8000-8100' -> ("ports", ...), 'example.com' -> ("domains", ...)."""
+    s = str(entry).strip().lower().rstrip(".")
+    m = _PORT_RE.match(s)
+    if m:
+        lo, hi = int(m.group(1)), int(m.group(2) or m.group(1))
+        if not 1 <= lo <= hi <= 65535:
+            raise ValueError(f"bad port or range: {entry}")
+        return "ports", str(lo) if lo == hi else f"{lo}-{hi}"
+    try:
+        net = ipaddress.ip_network(s, strict=False)
+    except ValueError:
+        net = None
+    if net is not None:
+        if net.version != 4:
+            raise ValueError(f"IPv6 is disabled in privacy mode: {entry}")
+        if net.prefixlen == 0:
+            raise ValueError("0.0.0.0/0 would bypass the tunnel for everything")
+        return "nets", str(net.network_address) if net.prefixlen == 32 else str(net)
+    if _DOMAIN_RE.match(s):
+        return "domains", s
+    raise ValueError(f"not a CIDR, port or domain: {entry}")
+
+
+def normalize(cfg: dict) -> dict:
+    """Validated, de-duplicated copy of {"nets", "ports", "domains"}; ValueError on the first bad entry."""
+    out = empty()
+    for kind in KINDS:
+        items = cfg.get(kind) or []
+        if not isinstance(items, list):
+            raise ValueError(f"{kind} must be a list")
+        for item in items:
+            k, v = classify(item)
+            if k != kind:
+                raise ValueError(f"{item} is not in {kind}")
+            if v not in out[kind]:
+                out[kind].append(v)
+    limits = {"nets": MAX_ENTRIES, "ports": MAX_ENTRIES, "domains": MAX_DOMAINS}
+    for kind, n in limits.items():
+        if len(out[kind]) > n:
+            raise ValueError(f"at most {n} {kind}")
+    return out
+
+
+def load(path: str = BYPASS_PATH) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return normalize(json.load(f))
+    except (OSError, ValueError):
+        return empty()
+
+
+def save(cfg: dict, path: str = BYPASS_PATH) -> dict:
+    cfg = normalize(cfg)
+    statefile.write_json(path, cfg)
+    return cfg
+
+
+def covering(name: str, domains) -> str | None:
+    """The listed domain that name is or is below ("cdn.example.com" -> "example.com"), or None."""
+    labels = name.lower().rstrip(".").split(".")
+    for i in range(len(labels) - 1):
+        d = ".".join(labels[i:])
+        if d in domains:
+            return d
+    return None
+
+
+def render_dns_adds(answers) -> str:
+    """`ipset -exist restore` input adding (address, ttl) pairs to anyone-bypass-dns (an existing entry's timeout is reset)."""
+    return "".join(f"add {SET_DNS} {ip} timeout {min(DNS_SET_MAX_TIMEOUT, max(0, ttl) + DNS_SET_GRACE)}\n"
+                   for ip, ttl in answers)
+
+
+def read_state(path: str = BYPASS_STATE_PATH) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ──────────────────────────────────────────────
+# Kernel sets
+# ──────────────────────────────────────────────
+def _lookup(domain: str) -> list:
+    try:
+        infos = socket.getaddrinfo(domain, None, socket.AF_INET, socket.SOCK_STREAM)
+    except (OSError, UnicodeError):
+        infos = []
+    return sorted({i[4][0] for i in infos}, key=lambda a: tuple(int(x) for x in a.split(".")))
+
+
+def resolve(domains, deadline: float = RESOLVE_DEADLINE) -> dict:
+    """
+    {domain: [IPv4 addresses]} via the system resolver (the bypassed traffic
+    leaves outside the tunnel anyway). All names are looked up at once; a
+    name still unanswered after deadline seconds maps to None.
+    """
+    domains = list(domains)
+    out = dict.fromkeys(domains)
+    todo = queue.Queue()
+    for d in domains:
+        todo.put(d)
+    done = threading.Semaphore(0)
+
+    def worker():
+        while True:
+            try:
+                d = todo.get_nowait()
+            except queue.Empty:
+                return
+            out[d] = _lookup(d)
+            done.release()
+
+    # Daemon threads: lookups past the deadline finish (or hang) in the background, nobody waits for them.
+    for i in range(min(RESOLVE_WORKERS, len(domains))):
+        threading.Thread(target=worker, name=f"bypass-resolve-{i}", daemon=True).start()
+    end = time.monotonic() + deadline
+    for _ in domains:
+        if not done.acquire(timeout=max(0.0, end - time.monotonic())):
+            break
+    return dict(out)
+
+
+def set_nets(cfg: dict, resolved: dict) -> list:
+    """Contents of anyone-bypass-net: the CIDRs, then every resolved address not already listed."""
+    nets = list(cfg["nets"])
+    for addrs in resolved.values():
+        nets.extend(a for a in addrs or () if a not in nets)
+    return nets
+
+
+def render_restore(nets, ports, flush_dns: bool = False) -> str:
+    """
+    `ipset restore` input: fill scratch sets, swap them with the live ones,
+    drop the scratch copies. anyone-bypass-dns is only created (the DNS proxy
+    fills it), and emptied with flush_dns when a domain left the list.
+    """
+    sets = [(SET_NET, f"hash:net family inet hashsize 1024 maxelem {NET_MAXELEM}", nets),
+            (SET_PORT, "bitmap:port range 0-65535", ports)]
+    out = []
+    for name, kind, items in sets:
+        tmp = f"{name}-new"
+        out += [f"create {name} {kind}", f"create {tmp} {kind}", f"flush {tmp}"]
+        out += [f"add {tmp} {item}" for item in items]
+        out += [f"swap {tmp} {name}", f"destroy {tmp}"]
+    out.append(f"create {SET_DNS} hash:ip family inet hashsize 1024 maxelem {NET_MAXELEM} timeout {DNS_SET_GRACE}")
+    if flush_dns:
+        out.append(f"flush {SET_DNS}")
+    return "\n".join(out) + "\n"
+
+
+def apply(cfg: dict | None = None, path: str = BYPASS_PATH, cmd=None,
+          state_path: str | None = BYPASS_STATE_PATH, resolve_domains: bool = True) -> dict:
+    """
+    Resolves the domains (resolve_domains=False: reuses the addresses in
+    state_path, as a mode switch does) and loads both sets in one
+    `ipset -exist restore`. A domain the lookup did not answer in time keeps
+    its previous addresses.
+    Returns {"ok", "nets", "ports", "domains", "resolved": {domain: [ip]}, "resolved_ts", "apply_ms", "ts"}
+    (and "error" when ipset failed); the same is written to state_path.
+    """
+    t0 = time.monotonic()
+    cfg = load(path) if cfg is None else normalize(cfg)
+    prev = read_state(state_path) if state_path else {}
+    known = prev.get("resolved") or {}
+    fresh = resolve(cfg["domains"]) if resolve_domains and cfg["domains"] else {}
+    resolved = {d: fresh[d] if fresh.get(d) is not None else list(known.get(d) or []) for d in cfg["domains"]}
+    nets = set_nets(cfg, resolved)
+    dropped = sorted(set(known) - set(cfg["domains"]))
+    res = {"ok": True, "nets": len(cfg["nets"]), "ports": len(cfg["ports"]), "domains": len(cfg["domains"]),
+           "set_entries": {SET_NET: len(nets), SET_PORT: len(cfg["ports"])}, "resolved": resolved,
+           "resolved_ts": time.time() if fresh else prev.get("resolved_ts")}
+    try:
+        r = proctrace.run(list(cmd or IPSET_CMD) + ["-exist", "restore"], input=render_restore(nets, cfg["ports"], flush_dns=bool(dropped)),
+                          capture_output=True, text=True, timeout=15)
+        if r.returncode != 0:
+            res.update(ok=False, error=(r.stderr or "").strip() or f"ipset restore rc={r.returncode}")
+    except (OSError, subprocess.SubprocessError) as e:
+        res.update(ok=False, error=str(e) or e.__class__.__name__)
+    res.update(apply_ms=round((time.monotonic() - t0) * 1000.0, 2), ts=time.time())
+    if state_path:
+        try:
+            statefile.write_json(state_path, res)
+        except OSError:
+            pass
+    return res
+
+
+def counters(snap: dict) -> dict:
+    """Bypassed bytes / packets per direction from a firewall.snapshot() (filter chains bypass-tx / bypass-rx)."""
+    out = {"active": False, "tx_bytes": 0, "tx_packets": 0, "rx_bytes": 0, "rx_packets": 0,
+           "by_set": {SET_NET: 0, SET_DNS: 0, SET_PORT: 0}}
+    for r in ((snap.get("tables") or {}).get("filter") or {}).get("rules") or []:
+        d = {CHAIN_TX: "tx", CHAIN_RX: "rx"}.get(r.get("chain"))
+        if d is None:
+            continue
+        out["active"] = True
+        out[f"{d}_bytes"] += r.get("bytes") or 0
+        out[f"{d}_packets"] += r.get("packets") or 0
+        for name in (SET_NET, SET_DNS, SET_PORT):
+            if f" {name} " in f" {r.get('spec', '')} ":
+                out["by_set"][name] += r.get("bytes") or 0
+    return out
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Anyone Stick split tunnel bypass sets")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("show", help="print the stored list")
+    sub.add_parser("render", help="print the ipset restore input for the stored list (domains resolved)")
+    p_apply = sub.add_parser("apply", help="load the stored list into the kernel sets")
+    p_apply.add_argument("--no-sudo", action="store_true", help="already root: run ipset directly")
+    ap.add_argument("--path", default=BYPASS_PATH)
+    args = ap.parse_args()
+
+    cfg = load(args.path)
+    if args.cmd == "render":
+        sys.stdout.write(render_restore(set_nets(cfg, resolve(cfg["domains"])), cfg["ports"]))
+    elif args.cmd == "apply":
+        res = apply(cfg, cmd=["ipset"] if args.no_sudo else None)
+        json.dump(res, sys.stdout, indent=2)
+        print()
+        sys.exit(0 if res["ok"] else 1)
+    else:
+        json.dump(cfg, sys.stdout, indent=2)
+        print()
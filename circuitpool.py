@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — pre-built circuit pool
+# Keeps a few BUILT circuits per pinned exit country on the anon ControlPort
+# (EXTENDCIRCUIT over an explicit guard,middle,exit path), so an exit switch
+# takes a ready circuit instead of waiting for a build. Circuits older than
+# max_age are closed and rebuilt in the background. Pool circuits are built
+# with purpose=controller: anon never attaches streams to those by itself,
+# so an idle circuit pinned to one country cannot carry traffic meant for
+# another exit. Whoever takes one has to attach streams to it explicitly:
+#   attach=True   the pool does it (__LeaveStreamsUnattached + ATTACHSTREAM)
+#                 — only for setups where no circuit-manager attaches streams
+#   attach=False  the circuit is offered to the circuit-manager; it counts as
+#                 a hit once adopted (the manager echoes the id, or a stream
+#                 shows up on it) and is closed if nobody adopts it within
+#                 OFFER_TIMEOUT. Until the manager has adopted one offer the
+#                 pool keeps a single probe circuit; after PROBE_OFFERS
+#                 declines without an adoption it stops building (the
+#                 manager ignores circuitId: "unsupported" in stats()).
+# ============================================================================
+
+import collections, os, queue, random, threading, time
+
+import controlport
+
+POOL_PER_COUNTRY = 2
+POOL_MAX_TOTAL = 8
+POOL_MAX_AGE = 540.0          # below anon's MaxCircuitDirtiness (600s)
+BUILD_TIMEOUT = 60.0
+MAX_PENDING_BUILDS = 2
+DIRECTORY_TTL = 1800.0
+SWITCH_TIMEOUT = 60.0
+OFFER_TIMEOUT = 20.0          # offered circuit not adopted by then: closed
+PROBE_OFFERS = 2              # declined offers, none adopted: the manager ignores circuitId
+PROBE_CIRCUITS = 1            # pool size while that is not known yet
+MAINTAIN_INTERVAL = 15.0
+_COUNTRY_BATCH = 64
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, int(p / 100.0 * len(s)))], 1)
+
+
+def _subnet16(ip: str) -> str:
+    return ".".join(ip.split(".")[:2])
+
+
+class RelayDirectory:
+    """Relays from GETINFO ns/all plus their exit countries (ip-to-country), refreshed every DIRECTORY_TTL."""
+
+    def __init__(self, ttl: float = DIRECTORY_TTL):
+        self.ttl = float(ttl)
+        self.relays = []
+        self.by_fp = {}
+        self.loaded_at = 0.0
+
+    def stale(self) -> bool:
+        return not self.relays or time.monotonic() - self.loaded_at > self.ttl
+
+    def load(self, conn):
+        relays = controlport.parse_ns(conn.getinfo("ns/all").get("ns/all", ""))
+        ips = sorted({r["ip"] for r in relays if "Exit" in r["flags"]})
+        countries = {}
+        for i in range(0, len(ips), _COUNTRY_BATCH):
+            keys = [f"ip-to-country/{ip}" for ip in ips[i:i + _COUNTRY_BATCH]]
+            for k, v in conn.getinfo(*keys).items():
+                countries[k[14:]] = v.strip().upper()
+        for r in relays:
+            r["country"] = countries.get(r["ip"])
+        self.relays = relays
+        self.by_fp = {r["fingerprint"]: r for r in relays}
+        self.loaded_at = time.monotonic()
+
+    def country(self, fingerprint: str | None) -> str | None:
+        r = self.by_fp.get((fingerprint or "").upper())
+        return r.get("country") if r else None
+
+    def exit_countries(self) -> list:
+        return sorted({r["country"] for r in self.relays if r.get("country") and r["country"] != "??"
+                       and self._usable_exit(r)})
+
+    @staticmethod
+    def _usable(r) -> bool:
+        return {"Running", "Valid", "Fast"} <= r["flags"]
+
+    def _usable_exit(self, r) -> bool:
+        return self._usable(r) and "Exit" in r["flags"] and "BadExit" not in r["flags"]
+
+    def _pick(self, candidates):
+        if not candidates:
+            return None
+        return random.choices(candidates, weights=[max(1, r["bandwidth"]) for r in candidates])[0]
+
+    def path(self, cc: str, guard: str | None = None) -> list:
+        """[guard, middle, exit] fingerprints ending in cc (bandwidth-weighted), distinct /16s."""
+        exit_ = self._pick([r for r in self.relays if r.get("country") == cc and self._usable_exit(r)])
+        if exit_ is None:
+            raise LookupError(f"no usable exit relay in {cc}")
+        g = self.by_fp.get((guard or "").upper())
+        if g is None or _subnet16(g["ip"]) == _subnet16(exit_["ip"]):
+            g = self._pick([r for r in self.relays if self._usable(r) and "Guard" in r["flags"]
+                            and _subnet16(r["ip"]) != _subnet16(exit_["ip"])])
+        if g is None:
+            raise LookupError("no usable guard relay")
+        taken = {_subnet16(g["ip"]), _subnet16(exit_["ip"])}
+        middle = self._pick([r for r in self.relays if self._usable(r) and _subnet16(r["ip"]) not in taken])
+        if middle is None:
+            raise LookupError("no usable middle relay")
+        return [g["fingerprint"], middle["fingerprint"], exit_["fingerprint"]]
+
+
+class CircuitPool:
+    """
+    Pool of BUILT circuits per pinned country, fed by a controlport.Monitor.
+      take(cc)      -> {"id", "cc", "exit", "built_at"} or None (miss counted)
+      switched()    marks the switch started by take() as done (attach=True hits)
+      adopted(cid)  the circuit-manager confirmed it uses the offered circuit
+      stats()       hits, misses, offers, build and switch timings, pool contents
+    With attach=True a taken circuit is a hit at once; otherwise it is only
+    offered, and counted as a hit when adopted. enabled=False keeps the pins
+    but never builds or hands out a circuit. A miss (or an offer the
+    manager builds past) is timed until a BUILT circuit with an exit in cc
+    shows up.
+    """
+
+    def __init__(self, monitor, countries=(), per_country: int = POOL_PER_COUNTRY,
+                 max_total: int = POOL_MAX_TOTAL, max_age: float = POOL_MAX_AGE, attach: bool = False,
+                 enabled: bool = True):
+        self.monitor = monitor
+        self.per_country = int(per_country)
+        self.max_total = int(max_total)
+        self.max_age = float(max_age)
+        self.attach = bool(attach)
+        self.enabled = bool(enabled)
+        self.manager = None     # attach=False: whether the manager adopts offers, None until known
+        self.directory = RelayDirectory()
+        self.error = None
+        self.active = None
+        self._countries = [c.upper() for c in countries]
+        self._lock = threading.Lock()
+        self._pool = {}         # cc -> [entry], oldest first
+        self._pending = {}      # circuit id -> entry while building
+        self._switch = None     # {"cc", "t0", "hit", "offer"} until switched / built
+        self._offer = None      # circuit offered to the manager, until adopted / closed
+        self._close = []        # circuit ids for the next _maintain to close
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._attach_q = queue.Queue()
+        self._attach_conn = None
+        self._started = False
+        self.counts = {"hits": 0, "misses": 0, "offered": 0, "declined": 0, "builds": 0, "build_failures": 0,
+                       "expired": 0, "attached": 0, "attach_errors": 0}
+        self._build_ms = collections.deque(maxlen=200)
+        self._switches = collections.deque(maxlen=200)
+        monitor.add_listener(self._on_event)
+
+    # ---- configuration ----
+    @property
+    def countries(self) -> list:
+        with self._lock:
+            return list(self._countries)
+
+    def set_countries(self, countries):
+        """Pins the countries kept warm; circuits of unpinned countries are closed."""
+        with self._lock:
+            self._countries = list(dict.fromkeys(c.upper() for c in countries))
+        self._wake.set()
+
+    # ---- lifecycle ----
+    def start(self):
+        with self._lock:
+            if self._started or not self.enabled:
+                return self
+            self._started = True
+        threading.Thread(target=self._run, name="circuit-pool", daemon=True).start()
+        if self.attach:
+            threading.Thread(target=self._attach_loop, name="circuit-pool-attach", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._attach_q.put(None)
+        if self._attach_conn is not None:
+            # Hand stream attachment back to anon, or new streams would hang.
+            try:
+                self._attach_conn.setconf(**{"__LeaveStreamsUnattached": 0})
+            except controlport.ControlPortError:
+                pass
+
+    # ---- use ----
+    def take(self, cc: str):
+        cc = cc.upper()
+        now = time.monotonic()
+        if not self.enabled or (not self.attach and self.manager is False):
+            return None
+        with self._lock:
+            live = self.monitor.circuits
+            entries = [e for e in self._pool.get(cc, [])
+                       if now - e["built_at"] < self.max_age and live.get(e["id"], {}).get("status") == "BUILT"]
+            entry = entries.pop() if entries else None
+            self._pool[cc] = entries
+            if self._offer is not None:
+                # Superseded before the manager took it up.
+                self._decline()
+            if entry is None:
+                self.counts["misses"] += 1
+            elif self.attach:
+                self.counts["hits"] += 1
+                self.active = dict(entry, taken_at=now)
+            else:
+                self.counts["offered"] += 1
+                self._offer = dict(entry, offered_at=now)
+            self._switch = {"cc": cc, "t0": now, "hit": entry is not None and self.attach,
+                            "offer": entry["id"] if entry and not self.attach else None}
+        self._wake.set()
+        return entry
+
+    def switched(self):
+        with self._lock:
+            self._finish_switch(ok=True)
+
+    def adopted(self, cid) -> bool:
+        """The manager confirmed it switched to the offered circuit cid; False if cid was not on offer."""
+        with self._lock:
+            return self._adopt(str(cid))
+
+    def _adopt(self, cid: str) -> bool:
+        offer = self._offer
+        if offer is None or offer["id"] != cid:
+            return False
+        self._offer = None
+        self.manager = True
+        self.counts["hits"] += 1
+        self.active = dict(offer, taken_at=time.monotonic())
+        sw = self._switch
+        if sw is not None and sw["offer"] == cid:
+            sw["hit"] = True
+            self._finish_switch(ok=True)
+        return True
+
+    def _decline(self):
+        self.counts["declined"] += 1
+        self._close.append(self._offer["id"])
+        self._offer = None
+        if self.manager is None and self.counts["declined"] >= PROBE_OFFERS:
+            # Never adopted one: pool circuits would only be built to be closed again.
+            self.manager = False
+
+    def _finish_switch(self, ok: bool):
+        sw, self._switch = self._switch, None
+        if sw is not None:
+            self._switches.append({"cc": sw["cc"], "hit": sw["hit"], "ok": ok,
+                                   "ms": round((time.monotonic() - sw["t0"]) * 1000.0, 1), "at": time.time()})
+
+    # ---- events (reader thread: no commands here) ----
+    def _on_event(self, kind, data):
+        if kind == "connected":
+            self._wake.set()
+            return
+        if kind == "stream":
+            if (self.attach and data["status"] in ("NEW", "NEWRESOLVE") and data["circ_id"] == "0"
+                    and data.get("purpose") in (None, "USER")):
+                self._attach_q.put(data["id"])
+            elif (self._offer is not None and data["circ_id"] == self._offer["id"]
+                    and data["status"] in ("SENTCONNECT", "SENTRESOLVE", "SUCCEEDED")):
+                with self._lock:
+                    self._adopt(data["circ_id"])
+            return
+        if kind != "circ":
+            return
+        cid, status = data["id"], data["status"]
+        with self._lock:
+            entry = self._pending.pop(cid, None) if status in ("BUILT", "FAILED", "CLOSED") else None
+            if entry is not None:
+                if status == "BUILT":
+                    entry["built_at"] = time.monotonic()
+                    self._build_ms.append(round((entry["built_at"] - entry["requested_at"]) * 1000.0, 1))
+                    self._pool.setdefault(entry["cc"], []).append(entry)
+                    self.counts["builds"] += 1
+                else:
+                    self.counts["build_failures"] += 1
+            elif status in ("FAILED", "CLOSED"):
+                for cc, entries in self._pool.items():
+                    self._pool[cc] = [e for e in entries if e["id"] != cid]
+                if self.active and self.active["id"] == cid:
+                    self.active = None
+                if self._offer and self._offer["id"] == cid:
+                    self._offer = None
+            sw = self._switch
+            if (status == "BUILT" and sw is not None and not sw["hit"]
+                    and data["path"] and self.directory.country(data["path"][-1]["fingerprint"]) == sw["cc"]):
+                self._finish_switch(ok=True)
+        if status in ("BUILT", "FAILED", "CLOSED"):
+            self._wake.set()
+
+    # ---- maintenance ----
+    def _conn(self):
+        c = self.monitor.conn
+        if c is None or not self.monitor.connected:
+            raise controlport.ControlPortError("ControlPort not connected")
+        return c
+
+    def _guard(self) -> str | None:
+        """First hop of a BUILT general circuit, so pooled circuits stay on anon's own guard."""
+        for c in self.monitor.built_circuits():
+            if c["path"] and c["path"][0]["fingerprint"]:
+                return c["path"][0]["fingerprint"]
+        return None
+
+    def _maintain(self):
+        conn = self._conn()
+        if self.directory.stale():
+            self.directory.load(conn)
+        now = time.monotonic()
+        build = []
+        with self._lock:
+            if self._switch is not None and now - self._switch["t0"] > SWITCH_TIMEOUT:
+                self._finish_switch(ok=False)
+            if self._offer is not None and now - self._offer["offered_at"] > OFFER_TIMEOUT:
+                self._decline()
+            close, self._close = self._close, []
+            live = self.monitor.circuits
+            if self.attach or self.manager:
+                cap = self.max_total
+            elif self.manager is None:
+                cap = PROBE_CIRCUITS
+            else:
+                cap = 0
+                close.extend(self._pending)
+                close.extend(e["id"] for entries in self._pool.values() for e in entries)
+                self._pending, self._pool = {}, {}
+            for cid, e in list(self._pending.items()):
+                if now - e["requested_at"] > BUILD_TIMEOUT:
+                    self._pending.pop(cid)
+                    self.counts["build_failures"] += 1
+                    close.append(cid)
+            for cc in list(self._pool):
+                keep = []
+                for e in self._pool[cc]:
+                    if live.get(e["id"], {}).get("status") != "BUILT":
+                        continue
+                    if cc not in self._countries or now - e["built_at"] >= self.max_age:
+                        self.counts["expired"] += 1
+                        close.append(e["id"])
+                    else:
+                        keep.append(e)
+                self._pool[cc] = keep
+            total = sum(len(v) for v in self._pool.values()) + len(self._pending)
+            have = collections.Counter(e["cc"] for e in self._pending.values())
+            for cc, entries in self._pool.items():
+                have[cc] += len(entries)
+            slots = min(cap - total, MAX_PENDING_BUILDS - len(self._pending))
+            for cc in self._countries:
+                want = self.per_country - have[cc]
+                while want > 0 and slots > 0:
+                    build.append(cc)
+                    want -= 1
+                    slots -= 1
+            if self.attach and self.active and now - self.active["taken_at"] >= self.max_age:
+                # Rotate the attached circuit like anon would (MaxCircuitDirtiness).
+                if self._pool.get(self.active["cc"]):
+                    self.active = dict(self._pool[self.active["cc"]].pop(), taken_at=now)
+        for cid in close:
+            try:
+                conn.close_circuit(cid)
+            except controlport.ControlPortError:
+                pass
+        guard = self._guard()
+        for cc in build:
+            path = self.directory.path(cc, guard)
+            cid = conn.extend_circuit(path, purpose="controller")
+            with self._lock:
+                self._pending[cid] = {"id": cid, "cc": cc, "exit": path[-1],
+                                      "requested_at": time.monotonic(), "built_at": None}
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                if self.countries or self._pool or self._offer or self._close:
+                    self._maintain()
+                self.error = None
+            except (OSError, LookupError, controlport.ControlPortError) as e:
+                self.error = str(e) or e.__class__.__name__
+            self._wake.wait(MAINTAIN_INTERVAL)
+
+    # ---- stream attachment (attach=True) ----
+    def _attach_loop(self):
+        while not self._stop.is_set():
+            sid = self._attach_q.get()
+            if sid is None:
+                return
+            try:
+                conn = self._conn()
+                if conn is not self._attach_conn:
+                    conn.setconf(**{"__LeaveStreamsUnattached": 1})
+                    self._attach_conn = conn
+                active = self.active
+                try:
+                    conn.attach_stream(sid, active["id"] if active else 0)
+                except controlport.ControlPortError as e:
+                    if not active or e.code is None:
+                        raise
+                    conn.attach_stream(sid, 0)
+                self.counts["attached"] += 1
+            except controlport.ControlPortError:
+                self.counts["attach_errors"] += 1
+
+    # ---- report ----
+    def _support(self) -> str:
+        if not self.enabled:
+            return "off"
+        if self.attach:
+            return "attach"
+        return {None: "unknown", True: "adopted", False: "unsupported"}[self.manager]
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            switches = list(self._switches)
+            hits, misses = self.counts["hits"], self.counts["misses"] + self.counts["declined"]
+            return {
+                "countries": list(self._countries),
+                "per_country": self.per_country,
+                "max_total": self.max_total,
+                "max_age": self.max_age,
+                "attach": self.attach,
+                "support": self._support(),
+                "error": self.error,
+                **self.counts,
+                "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                "pool": {cc: [{"id": e["id"], "exit": e["exit"], "age": round(now - e["built_at"], 1)} for e in v]
+                         for cc, v in self._pool.items() if v},
+                "building": sorted(e["cc"] for e in self._pending.values()),
+                "active": {"id": self.active["id"], "cc": self.active["cc"]} if self.active else None,
+                "offer": {"id": self._offer["id"], "cc": self._offer["cc"],
+                          "age": round(now - self._offer["offered_at"], 1)} if self._offer else None,
+                "build_ms": {"p50": _pct(self._build_ms, 50), "p99": _pct(self._build_ms, 99), "n": len(self._build_ms)},
+                "switch_ms": {
+                    kind: {"p50": _pct(ms, 50), "p99": _pct(ms, 99), "n": len(ms)}
+                    for kind, ms in (("hit", [s["ms"] for s in switches if s["hit"] and s["ok"]]),
+                                     ("miss", [s["ms"] for s in switches if not s["hit"] and s["ok"]]))
+                },
+                "recent_switches": switches[-10:],
+                "directory": {"relays": len(self.directory.relays),
+                              "age": round(now - self.directory.loaded_at, 1) if self.directory.relays else None},
+            }
+
+
+if __name__ == "__main__":
+    import argparse, json, sys
+    ap = argparse.ArgumentParser(description="Keep pre-built anon circuits for exit countries")
+    ap.add_argument("--addr", default=f"{controlport.CONTROL_PORT[0]}:{controlport.CONTROL_PORT[1]}")
+    ap.add_argument("--password", default=os.environ.get("CONTROL_PORT_PASSWORD"))
+    ap.add_argument("--per-country", type=int, default=POOL_PER_COUNTRY)
+    ap.add_argument("--list", action="store_true", help="print exit countries in the consensus and exit")
+    ap.add_argument("countries", nargs="*", help="ISO-2 exit countries to keep warm")
+    a = ap.parse_args()
+    host, _, port = a.addr.rpartition(":")
+    mon = controlport.Monitor((host, int(port)), password=a.password).start()
+    if not mon.wait_until(lambda m: m.connected, 10.0):
+        sys.exit(f"ControlPort: {mon.error or 'not connected'}")
+    pool = CircuitPool(mon, a.countries, per_country=a.per_country)
+    if a.list:
+        pool.directory.load(mon.conn)
+        print(" ".join(pool.directory.exit_countries()))
+        sys.exit(0)
+    pool.start()
+    while True:
+        time.sleep(5)
+        json.dump(pool.stats(), sys.stdout, indent=2)
+        print(flush=True)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — connection table
+# Streams /proc/net/nf_conntrack into a table keyed by the original tuple.
+# Each pass only re-parses lines whose state or counters changed since the
+# last one (not the ticking timeout), drops flows that disappeared, keeps per-flow
+# first-seen times. summary() counts flows per client, destination port,
+# state and protocol, and lists the top talkers. Used by the portal.
+# ============================================================================
+
+import ipaddress, os, time
+
+PROC_CONNTRACK = os.environ.get("PROC_CONNTRACK", "/proc/net/nf_conntrack")
+CLIENT_NET = ipaddress.ip_network("192.168.7.0/24")
+TRANS_PORT = 9040
+DNS_PORT = 9053
+DNS_PROXY_PORT = 9054
+
+
+class Flow:
+    __slots__ = ("sig", "proto", "state", "src", "dst", "sport", "dport", "redirected",
+                 "packets", "bytes", "assured", "first_seen")
+
+    def __init__(self, sig: str, fields: list, first_seen: float):
+        self.sig = sig
+        self.first_seen = first_seen
+        self.update(fields)
+
+    def update(self, fields: list):
+        # ipv4 2 tcp 6 431999 ESTABLISHED src=.. dst=.. sport=.. dport=.. [packets=.. bytes=..] src=.. (reply) ...
+        self.proto = fields[2]
+        i = 5
+        if self.proto == "tcp":
+            self.state = fields[5]
+            i = 6
+        else:
+            self.state = None
+        orig, reply, packets, nbytes = {}, {}, 0, 0
+        cur = orig
+        self.assured = False
+        for f in fields[i:]:
+            k, eq, v = f.partition("=")
+            if not eq:
+                if f == "[ASSURED]":
+                    self.assured = True
+                continue
+            if k == "src" and "src" in cur:
+                cur = reply
+            if k == "packets":
+                packets += int(v)
+            elif k == "bytes":
+                nbytes += int(v)
+            elif k not in cur:
+                cur[k] = v
+        self.src, self.dst = orig.get("src"), orig.get("dst")
+        self.sport, self.dport = _port(orig.get("sport")), _port(orig.get("dport"))
+        # REDIRECT/DNAT to anon: the reply comes from the TransPort / DNSPort, not the destination.
+        self.redirected = _port(reply.get("sport")) in (TRANS_PORT, DNS_PORT, DNS_PROXY_PORT) and reply.get("src") != self.dst
+        self.packets, self.bytes = packets, nbytes
+
+    @property
+    def label(self) -> str:
+        return self.state or ("ASSURED" if self.assured else "UNREPLIED" if "[UNREPLIED]" in self.sig else "OPEN")
+
+    def to_dict(self, now: float) -> dict:
+        return {"proto": self.proto, "state": self.label, "src": self.src, "dst": self.dst,
+                "sport": self.sport, "dport": self.dport, "redirected": self.redirected,
+                "packets": self.packets, "bytes": self.bytes, "age": round(now - self.first_seen, 1)}
+
+
+def _port(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def _key(line: str):
+    """
+    (key, sig) for one line, or None. key is the protocol plus the original
+    tuple; sig is the TCP state plus everything from the first src=, i.e. the
+    line without its timeout column (which ticks down every second) — a flow
+    is only re-parsed when sig changes.
+    """
+    a = line.find(" src=")
+    if a < 0:
+        return None
+    b = line.find(" src=", a + 5)
+    seg = line[a:b] if b > 0 else line[a:]
+    # Counters and [UNREPLIED] change during a flow's life; the key must not.
+    for stop in (" packets=", " [UNREPLIED]"):
+        p = seg.find(stop)
+        if p > 0:
+            seg = seg[:p]
+    head = line[:a].split()       # ipv4 2 tcp 6 431999 [ESTABLISHED]
+    if len(head) < 5:
+        return None
+    return head[2] + seg, (head[5] if len(head) > 5 else "") + line[a:]
+
+
+class FlowTable:
+    """
+    Incrementally maintained conntrack table.
+      update(lines)  -> {"lines", "parsed", "added", "removed"} for one pass
+      summary(top)   -> counts per client / dport / state / proto and top talkers
+    """
+
+    def __init__(self, client_net=CLIENT_NET):
+        self.client_net = ipaddress.ip_network(client_net)
+        self.flows = {}
+        self.passes = 0
+        self._clients = {}      # ip -> in client_net (memo; the same few IPs recur)
+        self.last = {"lines": 0, "parsed": 0, "added": 0, "removed": 0, "ms": 0.0, "ts": None}
+
+    def _is_client(self, ip) -> bool:
+        hit = self._clients.get(ip)
+        if hit is None:
+            try:
+                hit = ip is not None and ipaddress.ip_address(ip) in self.client_net
+            except ValueError:
+                hit = False
+            if len(self._clients) > 4096:
+                self._clients.clear()
+            self._clients[ip] = hit
+        return hit
+
+    def update(self, lines) -> dict:
+        t0 = time.monotonic()
+        now = time.time()
+        old = self.flows
+        new = {}
+        n = parsed = added = 0
+        for line in lines:
+            n += 1
+            line = line.rstrip("\n")
+            ks = _key(line)
+            if ks is None:
+                continue
+            k, sig = ks
+            f = old.get(k)
+            if f is not None:
+                if f.sig != sig:
+                    try:
+                        f.update(line.split())
+                    except (IndexError, ValueError):
+                        continue
+                    f.sig = sig
+                    parsed += 1
+                new[k] = f
+                continue
+            try:
+                f = Flow(sig, line.split(), now)
+            except (IndexError, ValueError):
+                continue
+            parsed += 1
+            added += 1
+            new[k] = f
+        removed = sum(1 for k in old if k not in new)
+        self.flows = new
+        self.passes += 1
+        self.last = {"lines": n, "parsed": parsed, "added": added, "removed": removed,
+                     "ms": round((time.monotonic() - t0) * 1000.0, 2), "ts": now}
+        return dict(self.last)
+
+    def read(self, path: str = PROC_CONNTRACK) -> dict:
+        with open(path, encoding="ascii", errors="replace") as f:
+            return self.update(f)
+
+    def summary(self, top: int = 10) -> dict:
+        now = time.time()
+        by_client, by_port, by_state, by_proto = {}, {}, {}, {}
+        redirected = 0
+        client_flows = []
+        for f in self.flows.values():
+            by_state[f.label] = by_state.get(f.label, 0) + 1
+            by_proto[f.proto] = by_proto.get(f.proto, 0) + 1
+            if not self._is_client(f.src):
+                continue
+            client_flows.append(f)
+            c = by_client.get(f.src)
+            if c is None:
+                c = by_client[f.src] = {"flows": 0, "tcp": 0, "udp": 0, "bytes": 0, "packets": 0, "redirected": 0}
+            c["flows"] += 1
+            if f.proto in ("tcp", "udp"):
+                c[f.proto] += 1
+            c["bytes"] += f.bytes
+            c["packets"] += f.packets
+            if f.redirected:
+                c["redirected"] += 1
+                redirected += 1
+            if f.dport is not None:
+                key = f"{f.proto}/{f.dport}"
+                by_port[key] = by_port.get(key, 0) + 1
+        # Byte counters need nf_conntrack_acct=1; without them rank by flow count.
+        have_bytes = any(c["bytes"] for c in by_client.values())
+        rank = (lambda kv: kv[1]["bytes"]) if have_bytes else (lambda kv: kv[1]["flows"])
+        talkers = sorted(by_client.items(), key=rank, reverse=True)[:top]
+        flows = sorted(client_flows, key=(lambda f: f.bytes) if have_bytes else (lambda f: f.first_seen),
+                       reverse=have_bytes)[:top]
+        return {
+            "total": len(self.flows),
+            "client_flows": len(client_flows),
+            "redirected": redirected,
+            "accounting": have_bytes,
+            "by_client": by_client,
+            "by_port": [{"port": p, "flows": n}
+                        for p, n in sorted(by_port.items(), key=lambda kv: kv[1], reverse=True)[:top * 2]],
+            "by_state": by_state,
+            "by_proto": by_proto,
+            "top_talkers": [dict(ip=ip, **c) for ip, c in talkers],
+            "top_flows": [f.to_dict(now) for f in flows],
+            "parse": dict(self.last),
+        }
+
+
+if __name__ == "__main__":
+    import argparse, json, sys
+    ap = argparse.ArgumentParser(description="Anyone Stick connection table")
+    ap.add_argument("--path", default=PROC_CONNTRACK, help="conntrack table (or - for stdin)")
+    ap.add_argument("--top", type=int, default=10)
+    a = ap.parse_args()
+    t = FlowTable()
+    if a.path == "-":
+        t.update(sys.stdin)
+    else:
+        t.read(a.path)
+    json.dump(t.summary(a.top), sys.stdout, indent=2)
+    print()
@@ -0,0 +1,802 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — anon ControlPort client
+# stdlib only. Speaks the (Tor-compatible) control protocol on 9051:
+#  - PROTOCOLINFO + AUTHENTICATE: NULL, HASHEDPASSWORD, COOKIE, SAFECOOKIE
+#  - synchronous commands (GETINFO, SETEVENTS, ...) from any thread
+#  - a reader thread that hands async 650 events to listeners
+# Monitor keeps one connection up (reconnecting) and maintains bootstrap,
+# circuit, stream and bandwidth state from events — no polling.
+# FakeControlPort is a local stand-in for offline testing.
+# ============================================================================
+
+import binascii, hashlib, hmac, os, queue, re, socket, tempfile, threading, time
+
+CONTROL_PORT = ("127.0.0.1", 9051)
+
+SAFECOOKIE_SERVER_KEY = b"Tor safe cookie authentication server-to-controller hash"
+SAFECOOKIE_CLIENT_KEY = b"Tor safe cookie authentication controller-to-server hash"
+
+_HOP_RE = re.compile(r"\$([0-9A-Fa-f]{40})(?:[~=](\S+))?$")
+_KV_RE = re.compile(r'([A-Za-z0-9_]+)=("(?:\\.|[^"\\])*"|\S*)|(\S+)')
+
+
+class ControlPortError(OSError):
+    """Negative reply or protocol failure; .code is the 3-digit reply code (or None)."""
+
+    def __init__(self, msg: str, code: str | None = None):
+        super().__init__(msg)
+        self.code = code
+
+
+def _unquote(v: str) -> str:
+    if len(v) >= 2 and v[0] == v[-1] == '"':
+        return re.sub(r"\\(.)", r"\1", v[1:-1])
+    return v
+
+
+def _quote(v: str) -> str:
+    return '"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def parse_kv(text: str):
+    """'A B K=V K2="x y"' -> (["A", "B"], {"K": "V", "K2": "x y"})."""
+    pos, kw = [], {}
+    for m in _KV_RE.finditer(text):
+        if m.group(3) is not None:
+            pos.append(m.group(3))
+        else:
+            kw[m.group(1)] = _unquote(m.group(2))
+    return pos, kw
+
+
+def parse_path(path: str) -> list:
+    """'$FP~nick,$FP2=nick2,$FP3' -> [{"fingerprint", "nickname"}, ...]."""
+    hops = []
+    for hop in filter(None, path.split(",")):
+        m = _HOP_RE.match(hop)
+        if m:
+            hops.append({"fingerprint": m.group(1).upper(), "nickname": m.group(2) or None})
+        else:
+            hops.append({"fingerprint": None, "nickname": hop})
+    return hops
+
+
+def parse_circ(body: str) -> dict:
+    """'<id> <status> [path] KEY=VAL...' (CIRC event / circuit-status line)."""
+    pos, kw = parse_kv(body)
+    return {
+        "id": pos[0] if pos else "",
+        "status": pos[1] if len(pos) > 1 else "",
+        "path": parse_path(pos[2]) if len(pos) > 2 else [],
+        "purpose": kw.get("PURPOSE"),
+        "build_flags": kw.get("BUILD_FLAGS", "").split(",") if kw.get("BUILD_FLAGS") else [],
+        "reason": kw.get("REASON"),
+        "created": kw.get("TIME_CREATED"),
+    }
+
+
+def parse_ns(text: str) -> list:
+    """
+    GETINFO ns/all (router status entries) ->
+      [{"fingerprint", "nickname", "ip", "or_port", "flags", "bandwidth"}, ...]
+    """
+    relays, cur = [], None
+    for line in text.splitlines():
+        if line.startswith("r "):
+            f = line.split()
+            if len(f) < 8:
+                cur = None
+                continue
+            try:
+                fp = binascii.b2a_hex(binascii.a2b_base64(f[2] + "=" * (-len(f[2]) % 4))).decode().upper()
+            except (binascii.Error, ValueError):
+                cur = None
+                continue
+            cur = {"fingerprint": fp, "nickname": f[1], "ip": f[6], "or_port": int(f[7]) if f[7].isdigit() else 0,
+                   "flags": frozenset(), "bandwidth": 0}
+            relays.append(cur)
+        elif cur is not None and line.startswith("s "):
+            cur["flags"] = frozenset(line.split()[1:])
+        elif cur is not None and line.startswith("w "):
+            _, kw = parse_kv(line[2:])
+            try:
+                cur["bandwidth"] = int(kw.get("Bandwidth", 0))
+            except ValueError:
+                pass
+    return relays
+
+
+def parse_stream(body: str) -> dict:
+    """'<id> <status> <circ id> <target> KEY=VAL...' (STREAM event)."""
+    pos, kw = parse_kv(body)
+    return {
+        "id": pos[0] if pos else "",
+        "status": pos[1] if len(pos) > 1 else "",
+        "circ_id": pos[2] if len(pos) > 2 else "0",
+        "target": pos[3] if len(pos) > 3 else "",
+        "reason": kw.get("REASON"),
+        "purpose": kw.get("PURPOSE"),
+    }
+
+
+def parse_status(body: str) -> dict:
+    """'NOTICE BOOTSTRAP PROGRESS=85 TAG=ap_conn SUMMARY="..."' (STATUS_* / status/bootstrap-phase)."""
+    pos, kw = parse_kv(body)
+    return {"severity": pos[0] if pos else "", "action": pos[1] if len(pos) > 1 else "", "args": kw}
+
+
+# ──────────────────────────────────────────────
+# Connection
+# ──────────────────────────────────────────────
+class ControlPort:
+    """
+    One authenticated control connection. msg()/getinfo()/setevents() may be
+    called from any thread (one command in flight at a time); async events go
+    to listeners on the reader thread — listeners must not issue commands.
+    """
+
+    def __init__(self, addr=CONTROL_PORT, password: str | None = None, cookie_path: str | None = None,
+                 timeout: float = 5.0):
+        self.addr = tuple(addr)
+        self.password = password
+        self.cookie_path = cookie_path
+        self.timeout = float(timeout)
+        self.auth_method = None
+        self.version = None
+        self.closed = threading.Event()
+        self._sock = None
+        self._rfile = None
+        self._cmd_lock = threading.Lock()
+        self._replies = queue.Queue()
+        self._listeners = []
+
+    # ---- lifecycle ----
+    def connect(self):
+        self._sock = socket.create_connection(self.addr, timeout=self.timeout)
+        self._sock.settimeout(None)
+        self._rfile = self._sock.makefile("rb")
+        threading.Thread(target=self._reader, name="controlport-reader", daemon=True).start()
+        try:
+            self.authenticate()
+        except Exception:
+            self.close()
+            raise
+        return self
+
+    def close(self):
+        # shutdown() wakes the reader thread; it closes its own file object.
+        self.closed.set()
+        if self._sock is not None:
+            for fn in (lambda: self._sock.shutdown(socket.SHUT_RDWR), self._sock.close):
+                try:
+                    fn()
+                except OSError:
+                    pass
+
+    def __enter__(self):
+        return self.connect()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- wire ----
+    def _readline(self) -> str:
+        line = self._rfile.readline()
+        if not line:
+            raise EOFError("control connection closed")
+        return line.decode("utf-8", "replace").rstrip("\r\n")
+
+    def _read_reply(self) -> list:
+        """[(code, sep, text), ...]; a '+' line's data block is appended to its text after '\\n'."""
+        lines = []
+        while True:
+            line = self._readline()
+            code, sep, text = line[:3], line[3:4], line[4:]
+            if sep == "+":
+                data = []
+                while True:
+                    d = self._readline()
+                    if d == ".":
+                        break
+                    data.append(d[1:] if d.startswith("..") else d)
+                text = text + "\n" + "\n".join(data)
+            lines.append((code, sep, text))
+            if sep == " " or sep == "":
+                return lines
+
+    def _reader(self):
+        try:
+            while True:
+                reply = self._read_reply()
+                if reply[0][0] == "650":
+                    self._dispatch(reply)
+                else:
+                    self._replies.put(reply)
+        except (OSError, EOFError, ValueError) as e:
+            self._replies.put(e)
+        finally:
+            self.closed.set()
+            try:
+                self._rfile.close()
+            except OSError:
+                pass
+            for fn in list(self._listeners):
+                try:
+                    fn(None, None)
+                except Exception:
+                    pass
+
+    def _dispatch(self, reply):
+        code, sep, text = reply[0]
+        etype, _, body = text.partition(" ")
+        for fn in list(self._listeners):
+            try:
+                fn(etype, body if sep != "-" else "\n".join(t for _, _, t in reply))
+            except Exception:
+                pass
+
+    def add_listener(self, fn):
+        """fn(event_type, body) per async event; fn(None, None) once when the connection closes."""
+        self._listeners.append(fn)
+
+    def msg(self, command: str, timeout: float | None = None) -> list:
+        """Sends one command, returns its reply lines; raises ControlPortError on 4xx/5xx."""
+        if self.closed.is_set():
+            raise ControlPortError("control connection closed")
+        with self._cmd_lock:
+            self._sock.sendall(command.encode("utf-8") + b"\r\n")
+            try:
+                reply = self._replies.get(timeout=self.timeout if timeout is None else timeout)
+            except queue.Empty:
+                self.close()
+                raise ControlPortError(f"no reply to {command.split()[0]}")
+        if isinstance(reply, Exception):
+            raise ControlPortError(str(reply) or reply.__class__.__name__)
+        code = reply[-1][0]
+        if not code.startswith("2"):
+            raise ControlPortError(f"{command.split()[0]}: {code} {reply[-1][2]}", code)
+        return reply
+
+    # ---- auth ----
+    def protocolinfo(self) -> dict:
+        info = {"methods": [], "cookie_file": None, "version": None}
+        for _code, _sep, text in self.msg("PROTOCOLINFO 1"):
+            if text.startswith("AUTH "):
+                _, kw = parse_kv(text[5:])
+                info["methods"] = kw.get("METHODS", "").split(",") if kw.get("METHODS") else []
+                info["cookie_file"] = kw.get("COOKIEFILE")
+            elif text.startswith("VERSION "):
+                _, kw = parse_kv(text[8:])
+                info["version"] = kw.get("Tor") or next(iter(kw.values()), None)
+        return info
+
+    def authenticate(self):
+        info = self.protocolinfo()
+        self.version = info["version"]
+        methods = info["methods"]
+        cookie_path = self.cookie_path or info["cookie_file"]
+        if "NULL" in methods:
+            self.msg("AUTHENTICATE")
+            self.auth_method = "NULL"
+        elif "SAFECOOKIE" in methods and cookie_path:
+            cookie = _read_cookie(cookie_path)
+            client_nonce = os.urandom(32)
+            reply = self.msg(f"AUTHCHALLENGE SAFECOOKIE {client_nonce.hex()}")
+            _, kw = parse_kv(reply[0][2].partition(" ")[2])
+            server_hash = binascii.unhexlify(kw.get("SERVERHASH", ""))
+            server_nonce = binascii.unhexlify(kw.get("SERVERNONCE", ""))
+            material = cookie + client_nonce + server_nonce
+            expected = hmac.new(SAFECOOKIE_SERVER_KEY, material, hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, server_hash):
+                raise ControlPortError("SAFECOOKIE: server hash mismatch (wrong cookie?)")
+            client_hash = hmac.new(SAFECOOKIE_CLIENT_KEY, material, hashlib.sha256).hexdigest()
+            self.msg(f"AUTHENTICATE {client_hash}")
+            self.auth_method = "SAFECOOKIE"
+        elif "COOKIE" in methods and cookie_path:
+            self.msg(f"AUTHENTICATE {_read_cookie(cookie_path).hex()}")
+            self.auth_method = "COOKIE"
+        elif "HASHEDPASSWORD" in methods and self.password is not None:
+            self.msg(f"AUTHENTICATE {_quote(self.password)}")
+            self.auth_method = "HASHEDPASSWORD"
+        else:
+            raise ControlPortError(f"no usable auth method (offered: {','.join(methods) or 'none'})")
+
+    # ---- commands ----
+    def getinfo(self, *keys) -> dict:
+        out = {}
+        for code, sep, text in self.msg("GETINFO " + " ".join(keys)):
+            if sep in ("-", "+") and "=" in text:
+                k, _, v = text.partition("=")
+                out[k] = v[1:] if sep == "+" and v.startswith("\n") else v
+        return out
+
+    def setevents(self, *events):
+        self.msg("SETEVENTS " + " ".join(events))
+
+    def setconf(self, **options):
+        self.msg("SETCONF " + " ".join(f"{k}={_quote(str(v))}" for k, v in options.items()))
+
+    def extend_circuit(self, path, purpose: str = "general") -> str:
+        """EXTENDCIRCUIT 0 with an explicit path of fingerprints; returns the new circuit id."""
+        hops = ",".join("$" + fp.lstrip("$") for fp in path)
+        reply = self.msg(f"EXTENDCIRCUIT 0 {hops} purpose={purpose}")
+        pos, _ = parse_kv(reply[-1][2])
+        if len(pos) < 2 or pos[0] != "EXTENDED":
+            raise ControlPortError(f"EXTENDCIRCUIT: unexpected reply {reply[-1][2]!r}")
+        return pos[1]
+
+    def close_circuit(self, cid, if_unused: bool = False):
+        self.msg(f"CLOSECIRCUIT {cid}" + (" IfUnused" if if_unused else ""))
+
+    def attach_stream(self, sid, cid):
+        """ATTACHSTREAM; cid 0 lets anon pick the circuit."""
+        self.msg(f"ATTACHSTREAM {sid} {cid}")
+
+
+def _read_cookie(path: str) -> bytes:
+    with open(path, "rb") as f:
+        cookie = f.read()
+    if len(cookie) != 32:
+        raise ControlPortError(f"cookie file {path} is {len(cookie)} bytes, expected 32")
+    return cookie
+
+
+def bootstrap_phase(addr=CONTROL_PORT, password: str | None = None, timeout: float = 2.0):
+    """One-shot (percent, summary) from status/bootstrap-phase, or (None, error)."""
+    try:
+        with ControlPort(addr, password=password, timeout=timeout) as c:
+            st = parse_status(c.getinfo("status/bootstrap-phase").get("status/bootstrap-phase", ""))
+    except (OSError, ControlPortError) as e:
+        return None, str(e)
+    try:
+        return int(st["args"].get("PROGRESS")), st["args"].get("SUMMARY", "")
+    except (TypeError, ValueError):
+        return None, "no bootstrap progress in reply"
+
+
+# ──────────────────────────────────────────────
+# Monitor: event-driven state
+# ──────────────────────────────────────────────
+class Monitor:
+    """
+    Keeps one ControlPort connection (reconnecting with backoff), subscribes to
+    CIRC STREAM BW STATUS_CLIENT and keeps the resulting state. Listeners get
+    fn(kind, data) with kind in connected / bootstrap / circ / stream / bw.
+    wait_until(pred, timeout) blocks on state changes instead of polling.
+    """
+
+    EVENTS = ("CIRC", "STREAM", "BW", "STATUS_CLIENT")
+    RECONNECT_BACKOFF = (0.5, 1.0, 2.0, 5.0, 10.0)
+    MAX_STREAMS = 4096
+
+    def __init__(self, addr=CONTROL_PORT, password: str | None = None, cookie_path: str | None = None):
+        self.addr = tuple(addr)
+        self.password = password
+        self.cookie_path = cookie_path
+        self.cond = threading.Condition()
+        self.conn = None
+        self.connected = False
+        self.auth_method = None
+        self.version = None
+        self.error = None
+        self.connects = 0
+        self.bootstrap = {"progress": None, "tag": None, "summary": None, "ts": None}
+        self.circuits = {}      # id -> parse_circ() + "ts"
+        self.streams = {}       # id -> parse_stream()
+        self.bw = {"read": 0, "written": 0, "ts": None}
+        self._listeners = []
+        self._started = False
+        self._stop = threading.Event()
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _notify(self, kind, data):
+        with self.cond:
+            self.cond.notify_all()
+        for fn in list(self._listeners):
+            try:
+                fn(kind, data)
+            except Exception:
+                pass
+
+    def start(self):
+        with self.cond:
+            if self._started:
+                return self
+            self._started = True
+        threading.Thread(target=self._run, name="controlport-monitor", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self.conn is not None:
+            self.conn.close()
+
+    def _run(self):
+        failures = 0
+        while not self._stop.is_set():
+            c = ControlPort(self.addr, password=self.password, cookie_path=self.cookie_path)
+            try:
+                c.add_listener(self._on_event)
+                c.connect()
+                seed = c.getinfo("status/bootstrap-phase", "circuit-status")
+                with self.cond:
+                    self.conn = c
+                    self.auth_method, self.version, self.error = c.auth_method, c.version, None
+                    self.circuits = {}
+                    self.streams = {}
+                    for line in (seed.get("circuit-status") or "").splitlines():
+                        if line.strip():
+                            circ = parse_circ(line)
+                            circ["ts"] = time.time()
+                            self.circuits[circ["id"]] = circ
+                self._apply_bootstrap(parse_status(seed.get("status/bootstrap-phase", "")))
+                c.setevents(*self.EVENTS)
+                with self.cond:
+                    self.connected = True
+                    self.connects += 1
+                failures = 0
+                self._notify("connected", True)
+                c.closed.wait()
+            except (OSError, EOFError, ControlPortError) as e:
+                with self.cond:
+                    self.error = str(e) or e.__class__.__name__
+                c.close()
+            with self.cond:
+                was = self.connected
+                self.connected = False
+                self.conn = None
+            if was:
+                self._notify("connected", False)
+            delay = self.RECONNECT_BACKOFF[min(failures, len(self.RECONNECT_BACKOFF) - 1)]
+            failures += 1
+            self._stop.wait(delay)
+
+    def _apply_bootstrap(self, st: dict):
+        a = st.get("args") or {}
+        if "PROGRESS" not in a:
+            return
+        try:
+            progress = int(a["PROGRESS"])
+        except ValueError:
+            return
+        with self.cond:
+            self.bootstrap = {"progress": progress, "tag": a.get("TAG"), "summary": a.get("SUMMARY"), "ts": time.time()}
+            b = dict(self.bootstrap)
+        self._notify("bootstrap", b)
+
+    def _on_event(self, etype, body):
+        if etype is None:
+            return
+        if etype == "CIRC":
+            circ = parse_circ(body)
+            circ["ts"] = time.time()
+            with self.cond:
+                if circ["status"] in ("CLOSED", "FAILED"):
+                    self.circuits.pop(circ["id"], None)
+                else:
+                    self.circuits[circ["id"]] = circ
+            self._notify("circ", circ)
+        elif etype == "STREAM":
+            st = parse_stream(body)
+            with self.cond:
+                if st["status"] in ("CLOSED", "FAILED"):
+                    self.streams.pop(st["id"], None)
+                elif st["id"] in self.streams or len(self.streams) < self.MAX_STREAMS:
+                    self.streams[st["id"]] = st
+            self._notify("stream", st)
+        elif etype == "BW":
+            pos, _ = parse_kv(body)
+            try:
+                r, w = int(pos[0]), int(pos[1])
+            except (IndexError, ValueError):
+                return
+            with self.cond:
+                self.bw = {"read": r, "written": w, "ts": time.time()}
+            self._notify("bw", self.bw)
+        elif etype == "STATUS_CLIENT":
+            st = parse_status(body)
+            if st["action"] == "BOOTSTRAP":
+                self._apply_bootstrap(st)
+
+    # ---- queries ----
+    def built_circuits(self, purpose: str | None = "GENERAL") -> list:
+        with self.cond:
+            return [c for c in self.circuits.values()
+                    if c["status"] == "BUILT" and (purpose is None or c.get("purpose") in (None, purpose))]
+
+    def wait_until(self, pred, timeout: float) -> bool:
+        """Blocks until pred(self) is true (re-checked on every state change) or timeout."""
+        with self.cond:
+            return self.cond.wait_for(lambda: pred(self), timeout=timeout)
+
+    def snapshot(self) -> dict:
+        with self.cond:
+            by_status = {}
+            for s in self.streams.values():
+                by_status[s["status"]] = by_status.get(s["status"], 0) + 1
+            return {
+                "connected": self.connected,
+                "auth_method": self.auth_method,
+                "version": self.version,
+                "error": self.error,
+                "connects": self.connects,
+                "bootstrap": dict(self.bootstrap),
+                "circuits": sorted(({k: v for k, v in c.items()} for c in self.circuits.values()),
+                                   key=lambda c: int(c["id"]) if c["id"].isdigit() else 0),
+                "streams": {"open": len(self.streams), "by_status": by_status},
+                "bw": dict(self.bw),
+            }
+
+
+# ──────────────────────────────────────────────
+# Fake ControlPort (offline tests)
+# ──────────────────────────────────────────────
+class FakeControlPort:
+    """
+    Threaded control-protocol server on 127.0.0.1.
+      methods:   offered auth methods (NULL, HASHEDPASSWORD, COOKIE, SAFECOOKIE)
+      password:  accepted password for HASHEDPASSWORD
+      info:      GETINFO key -> value (multi-line values are sent as data blocks)
+      relays:    [(fingerprint, nickname, ip, flags, country), ...] served as
+                 ns/all and ip-to-country/<ip>; EXTENDCIRCUIT builds over
+                 them after build_delay seconds
+    Drive it with set_bootstrap(), circuit(), stream(), bw() or emit(); every
+    command received is recorded in .commands, ATTACHSTREAM in .attached.
+    """
+
+    def __init__(self, methods=("NULL",), password: str | None = None, info=None, relays=(),
+                 build_delay: float = 0.05):
+        self.methods = tuple(methods)
+        self.password = password
+        self.cookie = os.urandom(32)
+        self._dir = tempfile.mkdtemp(prefix="fake-controlport-")
+        self.cookie_file = os.path.join(self._dir, "control_auth_cookie")
+        with open(self.cookie_file, "wb") as f:
+            f.write(self.cookie)
+        self.info = {"version": "0.4.9.11", "status/bootstrap-phase": 'NOTICE BOOTSTRAP PROGRESS=0 TAG=starting SUMMARY="Starting"',
+                     "circuit-status": ""}
+        if relays:
+            self.info["ns/all"] = "\n".join(
+                f"r {nick} {binascii.b2a_base64(binascii.a2b_hex(fp), newline=False).decode().rstrip('=')} "
+                f"AAAA 2026-01-01 00:00:00 {ip} 9001 0\ns {' '.join(flags)}\nw Bandwidth=1000"
+                for fp, nick, ip, flags, _cc in relays)
+        self.info.update(info or {})
+        self.commands = []
+        self.attached = []
+        self.conf = {}
+        self.build_delay = float(build_delay)
+        self.fail_builds = False
+        self._relays = {fp.upper(): (nick, ip, flags, cc) for fp, nick, ip, flags, cc in relays}
+        self._countries = {ip: cc for _fp, _nick, ip, _flags, cc in relays}
+        self._next_circ = 1000
+        self._circuits = {}
+        self._lock = threading.Lock()
+        self._clients = {}      # socket -> set of subscribed events
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(16)
+        self.address = self._sock.getsockname()
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="fake-controlport", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.drop_clients()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+        try:
+            os.unlink(self.cookie_file)
+            os.rmdir(self._dir)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def drop_clients(self):
+        """Closes every client connection (simulates anon restarting)."""
+        with self._lock:
+            clients = list(self._clients)
+        for s in clients:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    # ---- driving ----
+    def emit(self, line: str):
+        etype = line.split(" ", 1)[0]
+        with self._lock:
+            targets = [s for s, ev in self._clients.items() if etype in ev]
+        for s in targets:
+            try:
+                s.sendall(f"650 {line}\r\n".encode("utf-8"))
+            except OSError:
+                pass
+
+    def set_bootstrap(self, progress: int, tag: str = "", summary: str = ""):
+        body = f'NOTICE BOOTSTRAP PROGRESS={progress} TAG={tag or "x"} SUMMARY={_quote(summary or str(progress))}'
+        self.info["status/bootstrap-phase"] = body
+        self.emit("STATUS_CLIENT " + body)
+
+    def circuit(self, cid, status: str, path=(), purpose: str = "GENERAL"):
+        hops = ",".join(f"${fp}~{nick}" for fp, nick in path)
+        body = f"{cid} {status}" + (f" {hops}" if hops else "") + f" PURPOSE={purpose}"
+        with self._lock:
+            if status in ("CLOSED", "FAILED"):
+                self._circuits.pop(str(cid), None)
+            else:
+                self._circuits[str(cid)] = body
+            self.info["circuit-status"] = "\n".join(self._circuits.values())
+        self.emit("CIRC " + body)
+
+    def stream(self, sid, status: str, circ_id=0, target: str = "example.com:443"):
+        self.emit(f"STREAM {sid} {status} {circ_id} {target}")
+
+    def bw(self, read: int, written: int):
+        self.emit(f"BW {read} {written}")
+
+    # ---- server ----
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                c, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(c,), daemon=True).start()
+
+    def _send(self, c, *lines):
+        c.sendall("".join(l + "\r\n" for l in lines).encode("utf-8"))
+
+    def _handle(self, c):
+        f = c.makefile("rb")
+        authed = False
+        client_nonce = server_nonce = None
+        try:
+            for raw in f:
+                line = raw.decode("utf-8", "replace").rstrip("\r\n")
+                self.commands.append(line)
+                cmd, _, arg = line.partition(" ")
+                cmd = cmd.upper()
+                if cmd == "PROTOCOLINFO":
+                    auth = "250-AUTH METHODS=" + ",".join(self.methods)
+                    if "COOKIE" in self.methods or "SAFECOOKIE" in self.methods:
+                        auth += f" COOKIEFILE={_quote(self.cookie_file)}"
+                    self._send(c, "250-PROTOCOLINFO 1", auth, f'250-VERSION Tor="{self.info["version"]}"', "250 OK")
+                elif cmd == "AUTHCHALLENGE":
+                    parts = arg.split()
+                    if len(parts) != 2 or parts[0] != "SAFECOOKIE" or "SAFECOOKIE" not in self.methods:
+                        self._send(c, "513 Invalid AUTHCHALLENGE")
+                        continue
+                    client_nonce, server_nonce = binascii.unhexlify(parts[1]), os.urandom(32)
+                    sh = hmac.new(SAFECOOKIE_SERVER_KEY, self.cookie + client_nonce + server_nonce, hashlib.sha256).hexdigest()
+                    self._send(c, f"250 AUTHCHALLENGE SERVERHASH={sh.upper()} SERVERNONCE={server_nonce.hex().upper()}")
+                elif cmd == "AUTHENTICATE":
+                    if self._auth_ok(arg.strip(), client_nonce, server_nonce):
+                        authed = True
+                        with self._lock:
+                            self._clients[c] = set()
+                        self._send(c, "250 OK")
+                    else:
+                        self._send(c, "515 Authentication failed")
+                        return
+                elif cmd == "QUIT":
+                    self._send(c, "250 closing connection")
+                    return
+                elif not authed:
+                    self._send(c, "514 Authentication required.")
+                    return
+                elif cmd == "GETINFO":
+                    out = []
+                    for key in arg.split():
+                        if key.startswith("ip-to-country/") and key not in self.info:
+                            out.append(f"250-{key}={self._countries.get(key[14:], '??')}")
+                            continue
+                        if key not in self.info:
+                            out = [f'552 Unrecognized key "{key}"']
+                            break
+                        v = self.info[key]
+                        if "\n" in v or key == "circuit-status":
+                            out += [f"250+{key}="] + [("." + l if l.startswith(".") else l) for l in v.splitlines()] + ["."]
+                        else:
+                            out.append(f"250-{key}={v}")
+                    else:
+                        out.append("250 OK")
+                    self._send(c, *out)
+                elif cmd == "SETEVENTS":
+                    with self._lock:
+                        self._clients[c] = set(arg.split())
+                    self._send(c, "250 OK")
+                else:
+                    self._handle_extra(c, cmd, arg)
+        except OSError:
+            pass
+        finally:
+            with self._lock:
+                self._clients.pop(c, None)
+            try:
+                c.close()
+            except OSError:
+                pass
+
+    def _handle_extra(self, c, cmd, arg):
+        parts = arg.split()
+        if cmd == "SETCONF":
+            _, kw = parse_kv(arg)
+            self.conf.update(kw)
+            self._send(c, "250 OK")
+        elif cmd == "EXTENDCIRCUIT" and len(parts) >= 2 and parts[0] == "0":
+            hops = [h.lstrip("$").upper() for h in parts[1].split(",")]
+            if any(h not in self._relays for h in hops):
+                self._send(c, "552 No such router")
+                return
+            with self._lock:
+                self._next_circ += 1
+                cid = str(self._next_circ)
+            self._send(c, f"250 EXTENDED {cid}")
+            path = [(h, self._relays[h][0]) for h in hops]
+            purpose = parse_kv(arg)[1].get("purpose", "general").upper()
+            self.circuit(cid, "LAUNCHED", purpose=purpose)
+            threading.Timer(self.build_delay, lambda: self.circuit(
+                cid, "FAILED" if self.fail_builds else "BUILT", path, purpose)).start()
+        elif cmd == "CLOSECIRCUIT" and parts:
+            with self._lock:
+                known = parts[0] in self._circuits
+            if not known:
+                self._send(c, f"552 Unknown circuit \"{parts[0]}\"")
+                return
+            self._send(c, "250 OK")
+            self.circuit(parts[0], "CLOSED")
+        elif cmd == "ATTACHSTREAM" and len(parts) == 2:
+            with self._lock:
+                known = parts[1] == "0" or parts[1] in self._circuits
+            if not known:
+                self._send(c, f"552 Unknown circuit \"{parts[1]}\"")
+                return
+            self.attached.append((parts[0], parts[1]))
+            self._send(c, "250 OK")
+            self.stream(parts[0], "SENTCONNECT", parts[1])
+        else:
+            self._send(c, f'510 Unrecognized command "{cmd}"')
+
+    def _auth_ok(self, arg: str, client_nonce, server_nonce) -> bool:
+        if "NULL" in self.methods:
+            return True
+        if "HASHEDPASSWORD" in self.methods and arg.startswith('"'):
+            return self.password is not None and _unquote(arg) == self.password
+        if client_nonce is not None and "SAFECOOKIE" in self.methods:
+            want = hmac.new(SAFECOOKIE_CLIENT_KEY, self.cookie + client_nonce + server_nonce, hashlib.sha256).hexdigest()
+            return hmac.compare_digest(arg.lower(), want)
+        if "COOKIE" in self.methods:
+            return hmac.compare_digest(arg.lower(), self.cookie.hex())
+        return False
+
+
+if __name__ == "__main__":
+    import argparse, json, sys
+    ap = argparse.ArgumentParser(description="anon ControlPort client")
+    ap.add_argument("--addr", default=f"{CONTROL_PORT[0]}:{CONTROL_PORT[1]}")
+    ap.add_argument("--password", default=os.environ.get("CONTROL_PORT_PASSWORD"))
+    ap.add_argument("--watch", action="store_true", help="print events as they arrive")
+    ap.add_argument("keys", nargs="*", default=["status/bootstrap-phase"], help="GETINFO keys")
+    a = ap.parse_args()
+    host, _, port = a.addr.rpartition(":")
+    with ControlPort((host, int(port)), password=a.password) as c:
+        json.dump({"auth": c.auth_method, "version": c.version, **c.getinfo(*a.keys)}, sys.stdout, indent=2)
+        print()
+        if a.watch:
+            c.add_listener(lambda t, b: print(t, b, flush=True) if t else None)
+            c.setevents(*Monitor.EVENTS)
+            c.closed.wait()
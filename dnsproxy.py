@@ -0,0 +1,700 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — DNS proxy
+# Answers the clients' port-53 traffic (privacy mode REDIRECTs it here, UDP
+# and TCP) in front of anon's DNSPort, so only the first lookup of a name
+# pays the circuit round trip:
+#   - bounded LRU cache keyed by (name, type, class, EDNS), entries live for
+#     the answer's smallest TTL; served TTLs count down
+#   - negative caching (NXDOMAIN / NODATA) for the SOA minimum (RFC 2308)
+#   - concurrent misses for one key share a single upstream query
+#   - optional prefetch: a hot entry is refreshed in the background when
+#     little of its TTL is left, so it never expires while in use
+#   - sinkhole: names on the blocklist (blocklist.py) are answered locally
+#     with 0.0.0.0 / :: and never reach the tunnel
+#   - split tunnel: names under a bypass domain (bypass.py) are resolved by
+#     the host's own resolver, outside the tunnel, and every A record in the
+#     answer is added to the anyone-bypass-dns set before the client gets it
+#     — the client connects to an address the firewall already bypasses
+# Counters and latencies (hit rate, upstream p50/p99, estimated time saved,
+# blocked queries) are written to DNS_STATS_PATH every few seconds; the
+# portal serves them at /api/dns and /api/blocklist. stdlib only.
+# ============================================================================
+
+import asyncio, collections, os, random, socket, struct, subprocess, threading, time
+
+import blocklist, bypass, firewall, statefile
+
+LISTEN_ADDR = os.environ.get("DNS_PROXY_LISTEN", "0.0.0.0")
+LISTEN_PORT = firewall.DNS_PROXY_PORT
+UPSTREAM = ("127.0.0.1", firewall.DNS_PORT)          # anon DNSPort
+DNS_STATS_PATH = os.environ.get("DNS_STATS_PATH", "/run/anyone-stick-dns.json")
+BYPASS_ENABLED = os.environ.get("DNS_BYPASS", "1").strip() != "0"
+BYPASS_UPSTREAM = os.environ.get("DNS_BYPASS_UPSTREAM", "")     # host:port; default: resolv.conf
+IPSET_CMD = ["ipset"]       # started as root by supervisor.py
+IPSET_TIMEOUT = 2.0
+
+CACHE_SIZE = 4096
+MAX_TTL = 3600
+NEG_TTL = 300               # cap for negative answers
+NEG_TTL_NO_SOA = 30         # negative answer without an SOA to take the TTL from
+MAX_CACHED_BYTES = 4096
+UPSTREAM_RETRY_AFTER = 2.0  # resend once (UDP loss on the way into the circuit)
+UPSTREAM_TIMEOUT = 8.0
+TCP_IDLE_TIMEOUT = 10.0
+PREFETCH_FRACTION = 0.1     # refresh once less than this share of the TTL is left...
+PREFETCH_MIN_HITS = 3       # ...on entries hit at least this often
+STATS_INTERVAL = 5.0
+BLOCKLIST_ENABLED = os.environ.get("BLOCKLIST", "1").strip() != "0"
+BLOCKED_TTL = 300
+# Rough payload of one tracker / ad request that a blocked lookup avoids (script, pixel, beacon).
+BLOCKED_BYTES_ESTIMATE = int(os.environ.get("BLOCKED_BYTES_ESTIMATE", "20000"))
+BLOCKED_TOP_NAMES = 1000        # distinct blocked names counted for the top list
+LATENCY_SAMPLES = 1024
+
+TYPE_A, TYPE_SOA, TYPE_OPT = 1, 6, 41
+RCODE_SERVFAIL, RCODE_NXDOMAIN = 2, 3
+_QR, _TC, _RD, _RA = 0x8000, 0x0200, 0x0100, 0x0080
+
+
+# ──────────────────────────────────────────────
+# Wire format (RFC 1035) — only as much as caching needs
+# ──────────────────────────────────────────────
+class FormatError(ValueError):
+    pass
+
+
+def _skip_name(msg: bytes, off: int) -> int:
+    """Offset just past the (possibly compressed) name at off."""
+    while True:
+        if off >= len(msg):
+            raise FormatError("truncated name")
+        n = msg[off]
+        if n == 0:
+            return off + 1
+        if n & 0xC0 == 0xC0:
+            return off + 2
+        if n & 0xC0:
+            raise FormatError("bad label type")
+        off += 1 + n
+
+
+def _rrs(msg: bytes, off: int, count: int):
+    """Yields (type, class, ttl_offset, rdata_offset, rdlength) for count RRs from off; the end offset last."""
+    for _ in range(count):
+        off = _skip_name(msg, off)
+        if off + 10 > len(msg):
+            raise FormatError("truncated RR")
+        rtype, rclass, _ttl, rdlen = struct.unpack_from("!HHIH", msg, off)
+        yield rtype, rclass, off + 4, off + 10, rdlen
+        off += 10 + rdlen
+    yield off
+
+
+class Query:
+    __slots__ = ("qname", "qtype", "qclass", "qend", "edns", "udp_size")
+
+    def key(self):
+        return self.qname, self.qtype, self.qclass, self.edns
+
+
+def parse_query(msg: bytes):
+    """Query for a standard one-question query, or None for anything else (forwarded uncached)."""
+    if len(msg) < 12:
+        raise FormatError("short message")
+    _id, flags, qd, an, ns, ar = struct.unpack_from("!6H", msg)
+    if flags & _QR or (flags >> 11) & 0xF or qd != 1:
+        return None
+    q = Query()
+    off, labels = 12, []
+    while True:
+        if off >= len(msg):
+            raise FormatError("truncated question")
+        n = msg[off]
+        if n == 0:
+            off += 1
+            break
+        if n & 0xC0:
+            return None
+        labels.append(msg[off + 1:off + 1 + n])
+        off += 1 + n
+    if off + 4 > len(msg):
+        raise FormatError("truncated question")
+    q.qname = b".".join(labels).lower()
+    q.qtype, q.qclass = struct.unpack_from("!HH", msg, off)
+    q.qend = off + 4
+    q.edns, q.udp_size = False, 512
+    it = _rrs(msg, q.qend, an + ns + ar)
+    for rr in it:
+        if isinstance(rr, int):
+            break
+        if rr[0] == TYPE_OPT:
+            q.edns, q.udp_size = True, max(512, rr[1])
+    return q
+
+
+def parse_response(msg: bytes, qend: int):
+    """(rcode, truncated, ttl offsets, cache ttl or None when not cacheable)."""
+    if len(msg) < 12:
+        raise FormatError("short message")
+    _id, flags, _qd, an, ns, ar = struct.unpack_from("!6H", msg)
+    rcode = flags & 0xF
+    offsets, answer_ttl, soa_ttl = [], None, None
+    i = 0
+    it = _rrs(msg, qend, an + ns + ar)
+    for rr in it:
+        if isinstance(rr, int):
+            break
+        rtype, _rclass, toff, doff, rdlen = rr
+        if rtype != TYPE_OPT:
+            offsets.append(toff)
+            ttl = struct.unpack_from("!I", msg, toff)[0]
+            if i < an:
+                answer_ttl = ttl if answer_ttl is None else min(answer_ttl, ttl)
+            elif i < an + ns and rtype == TYPE_SOA and rdlen >= 20:
+                # Negative TTL = min(SOA TTL, SOA MINIMUM) — the last field of the rdata.
+                soa_ttl = min(ttl, struct.unpack_from("!I", msg, doff + rdlen - 4)[0])
+        i += 1
+    if flags & _TC or rcode not in (0, RCODE_NXDOMAIN):
+        return rcode, bool(flags & _TC), offsets, None
+    if an and rcode == 0:
+        return rcode, False, offsets, min(answer_ttl, MAX_TTL)
+    return rcode, False, offsets, min(soa_ttl, NEG_TTL) if soa_ttl is not None else NEG_TTL_NO_SOA
+
+
+def answer_addrs(msg: bytes, qend: int) -> list:
+    """(IPv4 address, ttl) of every A record in the answer section (CNAME targets included)."""
+    an = struct.unpack_from("!H", msg, 6)[0]
+    out = []
+    for rr in _rrs(msg, qend, an):
+        if isinstance(rr, int):
+            break
+        rtype, rclass, toff, doff, rdlen = rr
+        if rtype == TYPE_A and rclass == 1 and rdlen == 4:
+            out.append((socket.inet_ntoa(msg[doff:doff + 4]), struct.unpack_from("!I", msg, toff)[0]))
+    return out
+
+
+def system_resolver(path: str = "/etc/resolv.conf"):
+    """(address, 53) of the host's first IPv4 nameserver — reached over wlan0, not the tunnel."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver" and ":" not in parts[1]:
+                    return parts[1], 53
+    except OSError:
+        pass
+    return "8.8.8.8", 53        # what dnsmasq forwards to (pi/install_final.sh)
+
+
+def _for_client(wire: bytes, query: bytes, q, offsets=(), age: int = 0) -> bytearray:
+    """wire answered to this query: its ID, its question bytes (0x20 case), its RD bit, TTLs aged."""
+    out = bytearray(wire)
+    out[0:2] = query[0:2]
+    out[2] = (out[2] & 0xFE) | (query[2] & 0x01)
+    if q is not None:
+        out[12:q.qend] = query[12:q.qend]
+    if age > 0:
+        for off in offsets:
+            ttl = struct.unpack_from("!I", out, off)[0]
+            struct.pack_into("!I", out, off, max(0, ttl - age))
+    return out
+
+
+def _sinkhole(query: bytes, q) -> bytes:
+    """Blocked name: 0.0.0.0 / :: for A / AAAA (clients give up at once), NODATA for other types."""
+    flags = _QR | _RA | (struct.unpack_from("!H", query, 2)[0] & _RD)
+    rdata = {1: bytes(4), 28: bytes(16)}.get(q.qtype) if q.qclass == 1 else None
+    an = b"" if rdata is None else b"\xc0\x0c" + struct.pack("!HHIH", q.qtype, 1, BLOCKED_TTL, len(rdata)) + rdata
+    return (struct.pack("!6H", struct.unpack_from("!H", query)[0], flags, 1, 1 if an else 0, 0, 0)
+            + query[12:q.qend] + an)
+
+
+def _header_only(query: bytes, q, rcode: int = 0, tc: bool = False) -> bytes:
+    """Reply with just the question: SERVFAIL, or TC=1 to send the client to TCP."""
+    flags = _QR | _RA | (struct.unpack_from("!H", query, 2)[0] & _RD) | (_TC if tc else 0) | rcode
+    qd = 1 if q is not None else 0
+    return struct.pack("!6H", struct.unpack_from("!H", query)[0], flags, qd, 0, 0, 0) + (query[12:q.qend] if q else b"")
+
+
+def _pct(values, p):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p / 100.0 * len(values)))]
+
+
+# ──────────────────────────────────────────────
+# Upstream (anon DNSPort, UDP)
+# ──────────────────────────────────────────────
+class _Upstream(asyncio.DatagramProtocol):
+    """One UDP socket to the resolver; queries multiplexed by a fresh 16-bit ID each."""
+
+    def __init__(self):
+        self.transport = None
+        self.pending = {}       # upstream id -> (future, question bytes)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        p = self.pending.get(struct.unpack_from("!H", data)[0])
+        # The question must come back unchanged (ignoring case) or the datagram is not ours.
+        if p is None or p[0].done() or data[12:12 + len(p[1])].lower() != p[1]:
+            return
+        p[0].set_result(data)
+
+    def error_received(self, exc):
+        pass
+
+    async def query(self, msg: bytes, qend: int) -> bytes:
+        uid = random.getrandbits(16)
+        while uid in self.pending:
+            uid = random.getrandbits(16)
+        out = bytearray(msg)
+        struct.pack_into("!H", out, 0, uid)
+        fut = asyncio.get_running_loop().create_future()
+        self.pending[uid] = (fut, bytes(msg[12:qend]).lower())
+        try:
+            self.transport.sendto(out)
+            try:
+                return await asyncio.wait_for(asyncio.shield(fut), UPSTREAM_RETRY_AFTER)
+            except asyncio.TimeoutError:
+                self.transport.sendto(out)
+            return await asyncio.wait_for(fut, UPSTREAM_TIMEOUT - UPSTREAM_RETRY_AFTER)
+        finally:
+            self.pending.pop(uid, None)
+
+
+# ──────────────────────────────────────────────
+# Proxy
+# ──────────────────────────────────────────────
+class _Entry:
+    __slots__ = ("wire", "offsets", "stored", "ttl", "negative", "hits")
+
+    def __init__(self, wire, offsets, stored, ttl, negative):
+        self.wire, self.offsets, self.stored, self.ttl, self.negative = wire, offsets, stored, ttl, negative
+        self.hits = 0
+
+
+class DNSProxy:
+    """
+    Caching, coalescing forwarder.
+      await start(host, port)  binds UDP + TCP and the upstream socket
+      await resolve(msg)       wire answer for one query (what the servers send)
+      stats()                  counters, hit rate, latencies, estimated time saved
+    """
+
+    COUNTERS = ("queries", "hits", "negative_hits", "misses", "coalesced", "expired", "prefetches",
+                "evictions", "passthrough", "servfail", "truncated", "upstream_queries", "upstream_timeouts",
+                "upstream_errors", "tcp_queries", "format_errors", "blocked", "bypass_queries",
+                "bypass_set_adds", "bypass_set_errors")
+
+    def __init__(self, upstream=UPSTREAM, cache_size: int = CACHE_SIZE, prefetch: bool = False, blocklist=None,
+                 bypass_upstream=None, ipset_cmd=IPSET_CMD):
+        self.upstream_addr = tuple(upstream)
+        self.bypass_upstream_addr = tuple(bypass_upstream) if bypass_upstream else None
+        self.bypass_domains = frozenset()
+        self.ipset_cmd = list(ipset_cmd)
+        self.cache_size = int(cache_size)
+        self.prefetch = bool(prefetch)
+        self.blocklist = blocklist
+        self.blocked_names = collections.Counter()
+        self.cache = collections.OrderedDict()
+        self.inflight = {}
+        self.counts = dict.fromkeys(self.COUNTERS, 0)
+        self.upstream_ms = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.hit_ms = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.started = time.time()
+        self.listen = None
+        self._upstream = None
+        self._direct = None
+        self._servers = []
+
+    async def start(self, host: str = LISTEN_ADDR, port: int = LISTEN_PORT):
+        loop = asyncio.get_running_loop()
+        _t, self._upstream = await loop.create_datagram_endpoint(_Upstream, remote_addr=self.upstream_addr)
+        udp, _p = await loop.create_datagram_endpoint(lambda: _UDPServer(self), local_addr=(host, port))
+        tcp = await asyncio.start_server(self._tcp_client, host, udp.get_extra_info("sockname")[1])
+        self._servers = [udp, tcp, self._upstream.transport]
+        if self.bypass_upstream_addr:
+            _t, self._direct = await loop.create_datagram_endpoint(_Upstream, remote_addr=self.bypass_upstream_addr)
+            self._servers.append(self._direct.transport)
+        self.listen = udp.get_extra_info("sockname")[:2]
+        return self
+
+    def close(self):
+        for s in self._servers:
+            s.close()
+
+    # ---- resolution ----
+    async def resolve(self, msg: bytes) -> bytes:
+        self.counts["queries"] += 1
+        try:
+            q = parse_query(msg)
+        except FormatError:
+            self.counts["format_errors"] += 1
+            return _header_only(msg[:12].ljust(12, b"\0"), None, rcode=1)
+        if q is None:
+            self.counts["passthrough"] += 1
+            wire = await self._forward(msg, 12)
+            return _for_client(wire, msg, None) if wire else _header_only(msg, None, RCODE_SERVFAIL)
+        if self.blocklist is not None and self.blocklist.match(q.qname) is not None:
+            self.counts["blocked"] += 1
+            if q.qname in self.blocked_names or len(self.blocked_names) < BLOCKED_TOP_NAMES:
+                self.blocked_names[q.qname] += 1
+            return _sinkhole(msg, q)
+        direct = (self._direct is not None and bool(self.bypass_domains)
+                  and bypass.covering(q.qname.decode("ascii", "replace"), self.bypass_domains) is not None)
+        if direct:
+            self.counts["bypass_queries"] += 1
+        t0 = time.monotonic()
+        key = q.key() + (direct,)
+        e = self.cache.get(key)
+        if e is not None:
+            left = e.stored + e.ttl - t0
+            if left > 0:
+                self.cache.move_to_end(key)
+                e.hits += 1
+                self.counts["negative_hits" if e.negative else "hits"] += 1
+                if (self.prefetch and e.hits >= PREFETCH_MIN_HITS and left < e.ttl * PREFETCH_FRACTION
+                        and key not in self.inflight):
+                    self.counts["prefetches"] += 1
+                    self._fetch(key, msg, q, direct)
+                out = _for_client(e.wire, msg, q, e.offsets, int(t0 - e.stored))
+                self.hit_ms.append((time.monotonic() - t0) * 1000.0)
+                return out
+            del self.cache[key]
+            self.counts["expired"] += 1
+        fut = self.inflight.get(key)
+        if fut is not None:
+            self.counts["coalesced"] += 1
+        else:
+            self.counts["misses"] += 1
+            fut = self._fetch(key, msg, q, direct)
+        wire = await asyncio.shield(fut)
+        if wire is None:
+            self.counts["servfail"] += 1
+            return _header_only(msg, q, RCODE_SERVFAIL)
+        return _for_client(wire, msg, q)
+
+    def _fetch(self, key, msg, q, direct: bool = False):
+        fut = asyncio.get_running_loop().create_future()
+        self.inflight[key] = fut
+        asyncio.ensure_future(self._load(key, bytes(msg), q, fut, direct))
+        return fut
+
+    async def _load(self, key, msg, q, fut, direct: bool = False):
+        wire = None
+        try:
+            wire = await self._forward(msg, q.qend, direct)
+            if wire is not None:
+                if direct:
+                    await self._bypass_add(wire, q)
+                self._store(key, wire, q)
+        finally:
+            if self.inflight.get(key) is fut:
+                del self.inflight[key]
+            if not fut.done():
+                fut.set_result(wire)
+
+    async def _forward(self, msg, qend, direct: bool = False):
+        self.counts["upstream_queries"] += 1
+        t0 = time.monotonic()
+        try:
+            wire = await (self._direct if direct else self._upstream).query(msg, qend)
+        except asyncio.TimeoutError:
+            self.counts["upstream_timeouts"] += 1
+            return None
+        except OSError:
+            self.counts["upstream_errors"] += 1
+            return None
+        if not direct:
+            self.upstream_ms.append((time.monotonic() - t0) * 1000.0)
+        return wire
+
+    async def _bypass_add(self, wire, q):
+        """The answer's A records into anyone-bypass-dns (timeout from their TTL) before the client sees them."""
+        try:
+            answers = answer_addrs(wire, q.qend)
+        except FormatError:
+            return
+        if not answers:
+            return
+        p = None
+        try:
+            p = await asyncio.create_subprocess_exec(*self.ipset_cmd, "-exist", "restore", stdin=subprocess.PIPE,
+                                                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            await asyncio.wait_for(p.communicate(bypass.render_dns_adds(answers).encode("ascii")), IPSET_TIMEOUT)
+            ok = p.returncode == 0
+        except (OSError, asyncio.TimeoutError):
+            if p is not None and p.returncode is None:
+                p.kill()
+            ok = False
+        if ok:
+            self.counts["bypass_set_adds"] += len(answers)
+        else:
+            self.counts["bypass_set_errors"] += 1
+
+    def _store(self, key, wire, q):
+        try:
+            rcode, _tc, offsets, ttl = parse_response(wire, q.qend)
+        except FormatError:
+            return
+        if not ttl or len(wire) > MAX_CACHED_BYTES:
+            return
+        self.cache[key] = _Entry(wire, offsets, time.monotonic(), ttl, rcode == RCODE_NXDOMAIN or not
+                                 struct.unpack_from("!H", wire, 6)[0])
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.counts["evictions"] += 1
+
+    # ---- transports ----
+    async def answer_udp(self, transport, msg, addr):
+        out = await self.resolve(msg)
+        if len(out) > 512:
+            try:
+                q = parse_query(msg)
+            except FormatError:
+                q = None
+            if len(out) > (q.udp_size if q is not None else 512):
+                # Too big for the client's buffer: TC=1 and it retries over TCP.
+                self.counts["truncated"] += 1
+                out = _header_only(msg, q, tc=True)
+        transport.sendto(out, addr)
+
+    async def _tcp_client(self, reader, writer):
+        try:
+            while True:
+                n = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), TCP_IDLE_TIMEOUT))[0]
+                msg = await asyncio.wait_for(reader.readexactly(n), TCP_IDLE_TIMEOUT)
+                self.counts["tcp_queries"] += 1
+                out = await self.resolve(msg)
+                writer.write(struct.pack("!H", len(out)) + out)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # ---- report ----
+    def stats(self) -> dict:
+        c = dict(self.counts)
+        up = sorted(self.upstream_ms)
+        hit = sorted(self.hit_ms)
+        served = c["hits"] + c["negative_hits"]
+        lookups = served + c["misses"] + c["coalesced"]
+        up50 = _pct(up, 50)
+        return {
+            "ts": time.time(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "listen": list(self.listen) if self.listen else None,
+            "upstream": list(self.upstream_addr),
+            "bypass_upstream": list(self.bypass_upstream_addr) if self.bypass_upstream_addr else None,
+            "bypass_domains": len(self.bypass_domains),
+            "prefetch": self.prefetch,
+            **c,
+            "hit_rate": round(served / lookups, 4) if lookups else None,
+            "cache_entries": len(self.cache),
+            "cache_size": self.cache_size,
+            "inflight": len(self.inflight),
+            "upstream_ms": {"p50": _round(up50), "p90": _round(_pct(up, 90)), "p99": _round(_pct(up, 99))},
+            "hit_ms": {"p50": _round(_pct(hit, 50), 3), "p99": _round(_pct(hit, 99), 3)},
+            # Every cache hit (and coalesced wait, partly) skipped one upstream round trip.
+            "saved_ms_estimate": round(served * up50) if up50 is not None else None,
+            "blocklist": self._blocklist_stats(),
+        }
+
+    def _blocklist_stats(self) -> dict:
+        c = self.counts
+        out = {"enabled": self.blocklist is not None, **(self.blocklist.info() if self.blocklist else {})}
+        out.update({
+            "blocked": c["blocked"],
+            "block_rate": round(c["blocked"] / c["queries"], 4) if c["queries"] else None,
+            # Estimate: the tracker / ad payload each blocked lookup kept out of the tunnel.
+            "bytes_saved_estimate": c["blocked"] * BLOCKED_BYTES_ESTIMATE,
+            "bytes_per_block_estimate": BLOCKED_BYTES_ESTIMATE,
+            "top": [[n.decode(), k] for n, k in self.blocked_names.most_common(20)],
+        })
+        return out
+
+    async def blocklist_loop(self, source: str = blocklist.BLOCKLIST_PATH, cache: str = blocklist.BLOCKLIST_CACHE_PATH,
+                             interval: float = STATS_INTERVAL):
+        """(Re)loads the blocklist off the event loop whenever the source list appears or changes."""
+        loop = asyncio.get_running_loop()
+        while True:
+            if (self.blocklist is None and os.path.exists(source)) or (self.blocklist and self.blocklist.stale()):
+                try:
+                    self.blocklist = await loop.run_in_executor(None, blocklist.Blocklist.open, source, cache)
+                except (OSError, ValueError):
+                    self.blocklist = None
+            await asyncio.sleep(interval)
+
+    async def bypass_loop(self, path: str = bypass.BYPASS_PATH, interval: float = STATS_INTERVAL):
+        """Follows the bypass list: its domains are from then on resolved outside the tunnel."""
+        seen = None
+        while True:
+            try:
+                st = os.stat(path)
+                sig = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                sig = None
+            if sig != seen:
+                seen = sig
+                self.bypass_domains = frozenset(bypass.load(path)["domains"]) if sig else frozenset()
+            await asyncio.sleep(interval)
+
+    async def write_stats_loop(self, path: str = DNS_STATS_PATH, interval: float = STATS_INTERVAL):
+        while True:
+            try:
+                statefile.write_json(path, self.stats())
+            except OSError:
+                pass
+            await asyncio.sleep(interval)
+
+
+def _round(v, nd: int = 1):
+    return round(v, nd) if v is not None else None
+
+
+class _UDPServer(asyncio.DatagramProtocol):
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        asyncio.ensure_future(self.proxy.answer_udp(self.transport, data, addr))
+
+    def error_received(self, exc):
+        pass
+
+
+# ──────────────────────────────────────────────
+# Fake resolver (for benchmarks / offline testing)
+# ──────────────────────────────────────────────
+class FakeResolver:
+    """
+    Threaded UDP resolver on 127.0.0.1 standing in for anon's DNSPort.
+      delay:  seconds before each answer (a circuit round trip)
+      ttl:    TTL of the A / AAAA answers
+    Names starting with "nx" get NXDOMAIN with an SOA (negative TTL
+    neg_ttl); every other A/AAAA query gets one address. Queries seen are
+    counted in .queries.
+    """
+
+    def __init__(self, delay: float = 0.0, ttl: int = 300, neg_ttl: int = 60):
+        self.delay, self.ttl, self.neg_ttl = float(delay), int(ttl), int(neg_ttl)
+        self.queries = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self.address = self._sock.getsockname()
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._loop, name="fake-resolver", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def answer(self, msg: bytes) -> bytes:
+        q = parse_query(msg)
+        qid, flags = struct.unpack_from("!HH", msg)
+        question = msg[12:q.qend]
+        if q.qname.startswith(b"nx"):
+            soa = (b"\xc0\x0c" + struct.pack("!HHI", TYPE_SOA, 1, 3600)
+                   + struct.pack("!H", 22) + b"\x00\x00" + struct.pack("!5I", 1, 7200, 900, 86400, self.neg_ttl))
+            return struct.pack("!6H", qid, _QR | _RA | (flags & _RD) | RCODE_NXDOMAIN, 1, 0, 1, 0) + question + soa
+        if q.qtype == 1:
+            rdata = bytes((10, 66, len(q.qname) % 250, 1))
+        elif q.qtype == 28:
+            rdata = b"\xfd\x00" + bytes(13) + bytes((len(q.qname) % 250,))
+        else:
+            return struct.pack("!6H", qid, _QR | _RA | (flags & _RD), 1, 0, 0, 0) + question
+        rr = b"\xc0\x0c" + struct.pack("!HHIH", q.qtype, 1, self.ttl, len(rdata)) + rdata
+        return struct.pack("!6H", qid, _QR | _RA | (flags & _RD), 1, 1, 0, 0) + question + rr
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                msg, addr = self._sock.recvfrom(4096)
+            except OSError:
+                return
+            self.queries += 1
+            try:
+                out = self.answer(msg)
+            except (FormatError, AttributeError):
+                continue
+            if self.delay:
+                threading.Timer(self.delay, self._send, (out, addr)).start()
+            else:
+                self._send(out, addr)
+
+    def _send(self, out, addr):
+        try:
+            self._sock.sendto(out, addr)
+        except OSError:
+            pass
+
+
+def build_query(name: str, qtype: int = 1, qid: int | None = None, edns: int | None = None) -> bytes:
+    """A recursive query for name (with an OPT record advertising `edns` bytes if given)."""
+    qid = random.getrandbits(16) if qid is None else qid
+    qname = b"".join(bytes((len(l),)) + l for l in name.strip(".").encode().split(b".")) + b"\0"
+    opt = b"\0" + struct.pack("!HHIH", TYPE_OPT, edns, 0, 0) if edns else b""
+    return struct.pack("!6H", qid, _RD, 1, 0, 0, 1 if edns else 0) + qname + struct.pack("!HH", qtype, 1) + opt
+
+
+async def _main(args):
+    host, _, port = args.upstream.rpartition(":")
+    direct = None
+    if args.bypass:
+        if args.bypass_upstream:
+            dhost, _, dport = args.bypass_upstream.rpartition(":")
+            direct = (dhost, int(dport))
+        else:
+            direct = system_resolver()
+    proxy = DNSProxy((host, int(port)), args.cache_size, args.prefetch, bypass_upstream=direct)
+    await proxy.start(args.listen, args.port)
+    if args.stats:
+        asyncio.ensure_future(proxy.write_stats_loop(args.stats))
+    if args.blocklist:
+        asyncio.ensure_future(proxy.blocklist_loop(args.blocklist))
+    if args.bypass:
+        asyncio.ensure_future(proxy.bypass_loop(args.bypass))
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Anyone Stick caching DNS proxy in front of anon's DNSPort")
+    ap.add_argument("--listen", default=LISTEN_ADDR)
+    ap.add_argument("--port", type=int, default=LISTEN_PORT)
+    ap.add_argument("--upstream", default=f"{UPSTREAM[0]}:{UPSTREAM[1]}", help="resolver, host:port")
+    ap.add_argument("--cache-size", type=int, default=CACHE_SIZE, help="cached answers (LRU)")
+    ap.add_argument("--prefetch", action="store_true", default=os.environ.get("DNS_PREFETCH", "").strip() == "1",
+                    help="refresh hot names before they expire (or DNS_PREFETCH=1)")
+    ap.add_argument("--blocklist", default=blocklist.BLOCKLIST_PATH if BLOCKLIST_ENABLED else "",
+                    help="sinkhole list, reloaded when it changes ('' or BLOCKLIST=0 = off)")
+    ap.add_argument("--bypass", default=bypass.BYPASS_PATH if BYPASS_ENABLED else "",
+                    help="split tunnel list whose domains are resolved outside the tunnel ('' or DNS_BYPASS=0 = off)")
+    ap.add_argument("--bypass-upstream", default=BYPASS_UPSTREAM,
+                    help="resolver for bypass domains, host:port (default: first nameserver in /etc/resolv.conf)")
+    ap.add_argument("--stats", default=DNS_STATS_PATH, help="stats JSON written every few seconds ('' = off)")
+    try:
+        asyncio.run(_main(ap.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — firewall state
+# One `iptables-save -c` dump -> structured snapshot (privacy redirect,
+# kill switch, per-rule packet/byte counters). Used by the portal.
+# ============================================================================
+
+import json, os, re, shlex, subprocess, time
+
+import bypass, proctrace, statefile
+
+IPTABLES_SAVE_CMD = ["sudo", "iptables-save", "-c"]
+
+# Privacy mode sends every new TCP flow from usb0 to anon's TransPort.
+TRANS_PORT = 9040
+# Chains/comments installed by the kill switch script (matched case-insensitively).
+KILLSWITCH_MARKER = re.compile(os.environ.get("KILLSWITCH_MARKER", r"kill[-_]?switch"), re.I)
+
+_COUNTER_RE = re.compile(r"^\[(\d+):(\d+)\]\s+")
+
+
+def parse_save(text: str) -> dict:
+    """
+    Parses iptables-save output (with or without -c) into
+      {table: {"chains": {name: {"policy", "packets", "bytes"}}, "rules": [rule, ...]}}
+    where rule = {"chain", "spec", "target", "args", "packets", "bytes"}.
+    """
+    tables = {}
+    cur = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line[0] == "#":
+            continue
+        if line[0] == "*":
+            cur = tables.setdefault(line[1:], {"chains": {}, "rules": []})
+            continue
+        if cur is None or line == "COMMIT":
+            continue
+        if line[0] == ":":
+            # :PREROUTING ACCEPT [12:3456]
+            parts = line[1:].split()
+            pk = by = 0
+            if len(parts) > 2:
+                m = re.match(r"\[(\d+):(\d+)\]", parts[2])
+                if m:
+                    pk, by = int(m.group(1)), int(m.group(2))
+            cur["chains"][parts[0]] = {
+                "policy": parts[1] if len(parts) > 1 and parts[1] != "-" else None,
+                "packets": pk,
+                "bytes": by,
+            }
+            continue
+        pk = by = 0
+        m = _COUNTER_RE.match(line)
+        if m:
+            pk, by = int(m.group(1)), int(m.group(2))
+            line = line[m.end():]
+        if not line.startswith("-A "):
+            continue
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            args = line.split()
+        target = ""
+        for i, a in enumerate(args):
+            if a in ("-j", "-g", "--jump", "--goto") and i + 1 < len(args):
+                target = args[i + 1]
+        cur["rules"].append({
+            "chain": args[1] if len(args) > 1 else "",
+            "spec": " ".join(args[2:]),
+            "target": target,
+            "args": args[2:],
+            "packets": pk,
+            "bytes": by,
+        })
+    return tables
+
+
+def _opt(args: list, name: str):
+    try:
+        return args[args.index(name) + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def privacy_redirect_rule(tables: dict):
+    """The nat PREROUTING rule sending TCP to the TransPort (REDIRECT or DNAT form), or None."""
+    for r in tables.get("nat", {}).get("rules", []):
+        if r["chain"] != "PREROUTING":
+            continue
+        if r["target"] == "REDIRECT" and _opt(r["args"], "--to-ports") == str(TRANS_PORT):
+            return r
+        if r["target"] == "DNAT" and _opt(r["args"], "--to-destination") == f"127.0.0.1:{TRANS_PORT}":
+            return r
+    return None
+
+
+def killswitch_state(tables: dict):
+    """
+    True/False if the kill switch's marker chain is present in the filter table,
+    None if the ruleset carries no marker at all (caller should ask the script).
+    """
+    filt = tables.get("filter")
+    if not filt:
+        return None
+    marked = {c for c in filt["chains"] if KILLSWITCH_MARKER.search(c)}
+    commented = [r for r in filt["rules"] if KILLSWITCH_MARKER.search(_opt(r["args"], "--comment") or "")]
+    if not marked and not commented:
+        return None
+    if commented:
+        return True
+    # A marker chain only counts when something jumps into it and it drops traffic.
+    jumped = any(r["target"] in marked for r in filt["rules"])
+    drops = any(r["chain"] in marked and r["target"] in ("DROP", "REJECT") for r in filt["rules"])
+    return bool(jumped and drops)
+
+
+def derive(tables: dict) -> dict:
+    redirect = privacy_redirect_rule(tables)
+    return {
+        "privacy_redirect": redirect is not None,
+        "privacy_redirect_counters": {"packets": redirect["packets"], "bytes": redirect["bytes"]} if redirect else None,
+        "killswitch": killswitch_state(tables),
+    }
+
+
+def dump_ruleset(cmd=None, timeout: float = 5.0) -> str:
+    r = proctrace.run(cmd or IPTABLES_SAVE_CMD, capture_output=True, text=True, timeout=timeout)
+    if r.returncode != 0:
+        raise RuntimeError((r.stderr or "").strip() or f"iptables-save rc={r.returncode}")
+    return r.stdout
+
+
+def snapshot(text: str | None = None, cmd=None) -> dict:
+    """One ruleset dump -> structured snapshot. Never raises; check snapshot['ok']."""
+    t0 = time.monotonic()
+    try:
+        if text is None:
+            text = dump_ruleset(cmd)
+        tables = parse_save(text)
+    except Exception as e:
+        return {"ok": False, "error": str(e), "ts": time.time(), "tables": {},
+                "privacy_redirect": False, "privacy_redirect_counters": None, "killswitch": None}
+    snap = {"ok": True, "error": None, "ts": time.time(), "tables": tables}
+    snap.update(derive(tables))
+    snap["read_ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+    return snap
+
+
+def client_counters(text: str | None = None, cmd=None) -> dict:
+    """
+    Per-client counters from the mangle accounting chains (one
+    `iptables-save -c -t mangle`): {ip: {"rx_bytes", "rx_packets", "tx_bytes", "tx_packets"}}.
+    """
+    if text is None:
+        text = dump_ruleset((cmd or IPTABLES_SAVE_CMD) + ["-t", "mangle"])
+    out = {}
+    for r in parse_save(text).get("mangle", {}).get("rules", []):
+        if r["chain"] == ACCT_CHAIN_RX:
+            ip, d = _opt(r["args"], "-s"), "rx"
+        elif r["chain"] == ACCT_CHAIN_TX:
+            ip, d = _opt(r["args"], "-d"), "tx"
+        else:
+            continue
+        if not ip:
+            continue
+        c = out.setdefault(ip.split("/")[0], {"rx_bytes": 0, "rx_packets": 0, "tx_bytes": 0, "tx_packets": 0})
+        c[f"{d}_bytes"] += r["bytes"]
+        c[f"{d}_packets"] += r["packets"]
+    return out
+
+
+# ──────────────────────────────────────────────
+# Mode rulesets — rendered in full, applied in one iptables-restore
+# (replaces mode_privacy.sh / mode_normal.sh: no per-rule forks, no
+# window where the tables are flushed but not yet repopulated).
+# The restore runs with --noflush and flushes only the chains it manages:
+# chain policies and chains it does not declare (the kill switch's) stay,
+# and kill switch rules in the built-in chains are carried over.
+# ──────────────────────────────────────────────
+IPTABLES_RESTORE_CMD = ["iptables-restore", "--noflush"]
+IPTABLES_DUMP_CMD = ["iptables-save"]       # apply_mode runs as root
+IPSET_CMD = ["ipset"]
+USB_IFACE = "usb0"
+WAN_IFACE = "wlan0"
+PORTAL_ADDR = "192.168.7.1"
+DNS_PORT = 9053           # anon DNSPort
+DNS_PROXY_PORT = 9054     # dnsproxy.py (caching) in front of it
+LED_TRIGGER_PATH = "/sys/class/leds/default-on/trigger"
+
+# Per-client accounting: counting-only rules (no target) in mangle, which
+# sees traffic REDIRECTed to anon as well as forwarded traffic, in both modes.
+ACCT_CLIENTS = tuple(f"192.168.7.{i}" for i in range(2, 11))   # dnsmasq dhcp-range
+ACCT_CHAIN_RX = "acct-usb-rx"     # from clients (usb0 rx)
+ACCT_CHAIN_TX = "acct-usb-tx"     # to clients (usb0 tx)
+
+_BUILTIN_CHAINS = {
+    "mangle": ("PREROUTING", "INPUT", "FORWARD", "OUTPUT", "POSTROUTING"),
+    "nat": ("PREROUTING", "INPUT", "OUTPUT", "POSTROUTING"),
+    "filter": ("INPUT", "FORWARD", "OUTPUT"),
+}
+
+
+_USER_CHAINS = {"mangle": (ACCT_CHAIN_RX, ACCT_CHAIN_TX)}
+_BYPASS_CHAINS = {"filter": (bypass.CHAIN_TX, bypass.CHAIN_RX)}
+
+
+def _accounting_rules() -> list:
+    return ([f"-A PREROUTING -i {USB_IFACE} -j {ACCT_CHAIN_RX}",
+             f"-A POSTROUTING -o {USB_IFACE} -j {ACCT_CHAIN_TX}"]
+            + [f"-A {ACCT_CHAIN_RX} -s {ip}/32" for ip in ACCT_CLIENTS]
+            + [f"-A {ACCT_CHAIN_TX} -d {ip}/32" for ip in ACCT_CLIENTS])
+
+
+def _bypass_rules() -> dict:
+    """Split tunnel (bypass.py): set lookups ahead of the TransPort REDIRECT, byte counters in FORWARD."""
+    net, dns, port = bypass.SET_NET, bypass.SET_DNS, bypass.SET_PORT
+    return {
+        "nat": [f"-A PREROUTING -i {USB_IFACE} -m set --match-set {net} dst -j RETURN",
+                f"-A PREROUTING -i {USB_IFACE} -m set --match-set {dns} dst -j RETURN",
+                f"-A PREROUTING -i {USB_IFACE} -p tcp -m set --match-set {port} dst -j RETURN"],
+        "filter": [f"-A FORWARD -i {USB_IFACE} -o {WAN_IFACE} -j {bypass.CHAIN_TX}",
+                   f"-A FORWARD -i {WAN_IFACE} -o {USB_IFACE} -j {bypass.CHAIN_RX}",
+                   f"-A {bypass.CHAIN_TX} -m set --match-set {net} dst -j RETURN",
+                   f"-A {bypass.CHAIN_TX} -m set --match-set {dns} dst -j RETURN",
+                   f"-A {bypass.CHAIN_TX} -p tcp -m set --match-set {port} dst -j RETURN",
+                   f"-A {bypass.CHAIN_RX} -m set --match-set {net} src -j RETURN",
+                   f"-A {bypass.CHAIN_RX} -m set --match-set {dns} src -j RETURN",
+                   f"-A {bypass.CHAIN_RX} -p tcp -m set --match-set {port} src -j RETURN"],
+    }
+
+
+def _mode_rules(kind: str, with_bypass: bool = True) -> dict:
+    """{table: [rule args, ...]} for 'privacy' or 'normal' (privacy without the bypass sets if with_bypass is False)."""
+    mss = "-p tcp --tcp-flags SYN,RST SYN -j TCPMSS --clamp-mss-to-pmtu"
+    if kind == "privacy":
+        split = _bypass_rules() if with_bypass else {"nat": [], "filter": []}
+        return {
+            "mangle": [f"-A FORWARD {mss}"] + _accounting_rules(),
+            "nat": [
+                # Local exceptions (portal must always work)
+                f"-A PREROUTING -i {USB_IFACE} -p tcp --dport 80 -j RETURN",
+                f"-A PREROUTING -i {USB_IFACE} -d {PORTAL_ADDR} -j RETURN",
+                # DNS -> caching proxy -> anon DNSPort (UDP and TCP)
+                f"-A PREROUTING -i {USB_IFACE} -p udp --dport 53 -j REDIRECT --to-ports {DNS_PROXY_PORT}",
+                f"-A PREROUTING -i {USB_IFACE} -p tcp --dport 53 -j REDIRECT --to-ports {DNS_PROXY_PORT}",
+                # Split tunnel: bypassed destinations leave via NAT like in normal mode
+                *split["nat"],
+                # Transparent proxy: every other new TCP flow into the tunnel
+                f"-A PREROUTING -i {USB_IFACE} -p tcp --syn -j REDIRECT --to-ports {TRANS_PORT}",
+                f"-A POSTROUTING -o {WAN_IFACE} -j MASQUERADE",
+            ],
+            "filter": split["filter"],
+        }
+    if kind == "normal":
+        return {
+            "mangle": [f"-A FORWARD {mss}"] + _accounting_rules(),
+            "nat": [f"-A POSTROUTING -o {WAN_IFACE} -j MASQUERADE"],
+            "filter": [
+                f"-A FORWARD -i {USB_IFACE} -o {WAN_IFACE} -j ACCEPT",
+                f"-A FORWARD -i {WAN_IFACE} -o {USB_IFACE} -m state --state RELATED,ESTABLISHED -j ACCEPT",
+            ],
+        }
+    raise ValueError(f"unknown mode: {kind}")
+
+
+def render_ruleset(kind: str, with_bypass: bool = True) -> str:
+    """A mode's tables as iptables-save would print them on an otherwise empty firewall (preview, stand-ins)."""
+    out = [f"# anyone-stick {kind} ruleset"]
+    with_bypass = with_bypass and kind == "privacy"
+    for table, rules in _mode_rules(kind, with_bypass).items():
+        out.append(f"*{table}")
+        out.extend(f":{c} ACCEPT [0:0]" for c in _BUILTIN_CHAINS[table])
+        out.extend(f":{c} - [0:0]" for c in _USER_CHAINS.get(table, ()))
+        if with_bypass:
+            out.extend(f":{c} - [0:0]" for c in _BYPASS_CHAINS.get(table, ()))
+        out.extend(rules)
+        out.append("COMMIT")
+    return "\n".join(out) + "\n"
+
+
+def _restore_arg(a: str) -> str:
+    return f'"{a}"' if not a or any(ch in a for ch in ' \t"\'') else a
+
+
+def _carried_rules(table: str, current: dict) -> list:
+    """Kill switch rules in built-in chains (marker comment, or a jump into a marker chain) as -A lines."""
+    marked = {c for c in current["chains"] if KILLSWITCH_MARKER.search(c)}
+    out = []
+    for r in current["rules"]:
+        if r["chain"] not in _BUILTIN_CHAINS[table]:
+            continue
+        if r["target"] in marked or KILLSWITCH_MARKER.search(_opt(r["args"], "--comment") or ""):
+            out.append(f"-A {r['chain']} " + " ".join(_restore_arg(a) for a in r["args"]))
+    return out
+
+
+def render_restore(kind: str, with_bypass: bool = True, current: dict | None = None) -> str:
+    """
+    iptables-restore --noflush input for a mode. current is parse_save() of
+    the live ruleset: the built-in chains and this module's own chains are
+    flushed and refilled, the kill switch rules found in the built-in chains
+    are put back first, and the bypass chains are removed when unused.
+    Policies and every other chain are left as they are.
+    """
+    current = current or {}
+    out = [f"# anyone-stick {kind} ruleset (iptables-restore --noflush)"]
+    with_bypass = with_bypass and kind == "privacy"
+    for table, rules in _mode_rules(kind, with_bypass).items():
+        have = current.get(table) or {"chains": {}, "rules": []}
+        managed = list(_USER_CHAINS.get(table, ())) + list(_BYPASS_CHAINS.get(table, ()) if with_bypass else ())
+        unused = [c for c in _BYPASS_CHAINS.get(table, ()) if not with_bypass and c in have["chains"]]
+        out.append(f"*{table}")
+        out.extend(f":{c} - [0:0]" for c in managed if c not in have["chains"])
+        out.extend(f"-F {c}" for c in _BUILTIN_CHAINS[table])
+        out.extend(f"-F {c}" for c in managed + unused if c in have["chains"])
+        out.extend(f"-X {c}" for c in unused)
+        out.extend(_carried_rules(table, have))
+        out.extend(rules)
+        out.append("COMMIT")
+    return "\n".join(out) + "\n"
+
+
+def apply_mode(kind: str, state_path: str | None = None) -> dict:
+    """
+    Applies a mode: sysctls, the bypass sets (privacy only, from the last
+    resolved addresses: the ruleset references them, so it is rendered
+    without them if ipset fails), the
+    full ruleset (single iptables-restore), LED.
+    Per-step timings are merged into the mode state file as they complete.
+    Returns {"ok", "steps": [{"step", "ms", "ok", "error"?}], "apply_ms"}.
+    """
+    state = {}
+    if state_path:
+        try:
+            with open(state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except Exception:
+            state = {}
+    steps = []
+    t_all = time.monotonic()
+
+    def record(name, fn, required=True):
+        t0 = time.monotonic()
+        step = {"step": name, "ok": True}
+        try:
+            fn()
+        except Exception as e:
+            step.update(ok=False, error=str(e) or e.__class__.__name__)
+        step["ms"] = round((time.monotonic() - t0) * 1000.0, 2)
+        steps.append(step)
+        if state_path:
+            state.update(steps=steps, apply_ms=round((time.monotonic() - t_all) * 1000.0, 2))
+            try:
+                statefile.write_json(state_path, state)
+            except Exception:
+                pass
+        return step["ok"] or not required
+
+    def sysctls():
+        statefile.write_value("/proc/sys/net/ipv4/ip_forward", "1")
+        if kind == "privacy":
+            statefile.write_value("/proc/sys/net/ipv6/conf/all/disable_ipv6", "1")
+
+    def bypass_sets():
+        # The last resolved addresses: a slow or dead upstream DNS must not hold up the switch.
+        res = bypass.apply(cmd=IPSET_CMD, resolve_domains=False)
+        if not res["ok"]:
+            raise RuntimeError(res.get("error") or "ipset restore failed")
+
+    def restore():
+        current = parse_save(dump_ruleset(IPTABLES_DUMP_CMD))
+        r = proctrace.run(IPTABLES_RESTORE_CMD, input=render_restore(kind, with_bypass, current),
+                          capture_output=True, text=True, timeout=15)
+        if r.returncode != 0:
+            raise RuntimeError((r.stderr or "").strip() or f"iptables-restore rc={r.returncode}")
+
+    def led():
+        statefile.write_value(LED_TRIGGER_PATH, "heartbeat" if kind == "privacy" else "default-on")
+
+    with_bypass = False
+    ok = record("sysctl", sysctls)
+    if ok and kind == "privacy":
+        record("bypass", bypass_sets, required=False)
+        with_bypass = steps[-1]["ok"]
+    ok = ok and record("ruleset", restore)
+    record("led", led, required=False)
+    return {"ok": ok, "steps": steps, "apply_ms": round((time.monotonic() - t_all) * 1000.0, 2)}
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Anyone Stick firewall state / mode apply")
+    sub = ap.add_subparsers(dest="cmd")
+    sub.add_parser("snapshot", help="print the structured snapshot (reads iptables-save, or stdin if piped)")
+    sub.add_parser("clients", help="print per-client accounting counters")
+    p_render = sub.add_parser("render", help="print the iptables-restore input for a mode")
+    p_render.add_argument("kind", choices=("privacy", "normal"))
+    p_render.add_argument("--full", action="store_true", help="the mode's tables in full (iptables-save form) instead")
+    p_apply = sub.add_parser("apply", help="apply a mode atomically")
+    p_apply.add_argument("kind", choices=("privacy", "normal"))
+    p_apply.add_argument("--state", help="mode state JSON to record step timings into")
+    args = ap.parse_args()
+
+    if args.cmd == "render":
+        if args.full:
+            sys.stdout.write(render_ruleset(args.kind))
+        else:
+            sys.stdout.write(render_restore(args.kind, current=parse_save(dump_ruleset())))
+    elif args.cmd == "apply":
+        res = apply_mode(args.kind, args.state)
+        json.dump(res, sys.stdout)
+        print()
+        sys.exit(0 if res["ok"] else 1)
+    elif args.cmd == "clients":
+        json.dump(client_counters(sys.stdin.read() if not sys.stdin.isatty() else None), sys.stdout, indent=2)
+        print()
+    else:
+        s = snapshot(sys.stdin.read() if not sys.stdin.isatty() else None)
+        json.dump(s, sys.stdout, indent=2)
+        print()
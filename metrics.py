@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — metrics
+# Counters, gauges and histograms in the Prometheus text format (0.0.4),
+# stdlib only. Every metric has its own lock held for a couple of dict
+# operations, so request threads barely contend; bucket lookup (bisect)
+# happens outside it. Func gauges are read from the owner at scrape time.
+# ============================================================================
+
+import bisect, math, threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds: portal routes and upstream calls sit between ~1ms and a few seconds on the Pi.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v) -> str:
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self._values = {}
+
+    def inc(self, labels=(), amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels=(), amount: float = 1):
+        self.inc(labels, -amount)
+
+    def set(self, labels=(), value: float = 0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class FuncGauge(_Metric):
+    """Gauge (or counter, kind="counter") whose samples come from fn() -> {label values tuple: value} at scrape time."""
+
+    def __init__(self, name: str, help: str, fn, labelnames=(), kind: str = "gauge", registry=None):
+        self.fn = fn
+        self.kind = kind
+        super().__init__(name, help, labelnames, registry)
+
+    def render(self) -> list:
+        try:
+            items = sorted(self.fn().items())
+        except Exception:
+            return []
+        return self._header() + [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS, registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # labels -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value: float, labels=()):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                s = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def snapshot(self, labels=()):
+        """(cumulative bucket counts incl. +Inf, count, sum) for one series."""
+        with self._lock:
+            s = list(self._series.get(labels) or [0] * (len(self.buckets) + 1) + [0.0])
+        cum, acc = [], 0
+        for c in s[:-1]:
+            acc += c
+            cum.append(acc)
+        return cum, acc, s[-1]
+
+    def quantile(self, q: float, labels=()):
+        """Upper bucket bound holding the q-quantile (None without observations)."""
+        cum, n, _ = self.snapshot(labels)
+        if not n:
+            return None
+        for bound, c in zip(self.buckets + (math.inf,), cum):
+            if c >= q * n:
+                return bound
+        return math.inf
+
+    def render(self) -> list:
+        with self._lock:
+            keys = sorted(self._series)
+        out = self._header()
+        for k in keys:
+            cum, n, total = self.snapshot(k)
+            for bound, c in zip(self.buckets + (math.inf,), cum):
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, k, [('le', _fmt(float(bound)))])} {c}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, k)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, k)} {n}")
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+if __name__ == "__main__":
+    import argparse, sys, time
+    ap = argparse.ArgumentParser(description="Time Histogram.observe / Counter.inc")
+    ap.add_argument("--n", type=int, default=200000)
+    a = ap.parse_args()
+    reg = Registry()
+    h = Histogram("bench_seconds", "bench", ("route",), registry=reg)
+    c = Counter("bench_total", "bench", ("route",), registry=reg)
+    t0 = time.perf_counter()
+    for i in range(a.n):
+        h.observe((i % 1000) / 1000.0, ("/api/x",))
+    t1 = time.perf_counter()
+    for i in range(a.n):
+        c.inc(("/api/x",))
+    t2 = time.perf_counter()
+    print(f"observe {((t1 - t0) / a.n) * 1e6:.2f}us  inc {((t2 - t1) / a.n) * 1e6:.2f}us", file=sys.stderr)
+    sys.stdout.write(reg.render())
@@ -1,12 +1,5 @@
 #!/bin/bash
-iptables -F
-iptables -t nat -F
-iptables -t mangle -F
-
-# Einfaches NAT ohne Tunnel
-iptables -t nat -A POSTROUTING -o wlan0 -j MASQUERADE
-iptables -A FORWARD -i usb0 -o wlan0 -j ACCEPT
-iptables -A FORWARD -i wlan0 -o usb0 -m state --state RELATED,ESTABLISHED -j ACCEPT
-iptables -t mangle -A FORWARD -p tcp --tcp-flags SYN,RST SYN -j TCPMSS --clamp-mss-to-pmtu
-
-echo default-on | sudo tee /sys/class/leds/default-on/trigger
+# Normal mode: plain NAT from usb0 to wlan0, no tunnel.
+# Applied atomically by the portal's firewall engine (see firewall.py).
+# Preview the rules with: python3 /home/pi/portal/firewall.py render normal
+exec python3 /home/pi/portal/firewall.py apply normal "$@"
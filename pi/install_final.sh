@@ -7,7 +7,7 @@ NC='\033[0m'
 
 echo -e "${GREEN}--- 1. Installation der Pakete (Einzeln für Stabilität) ---${NC}"
 sudo apt update
-for pkg in python3-flask dnsmasq network-manager iptables-persistent curl unzip jq; do
+for pkg in python3-flask python3-pil python3-fonttools python3-brotli dnsmasq network-manager iptables-persistent ipset curl unzip jq; do
     echo "Installiere $pkg..."
     sudo apt install -y $pkg || echo "Warnung: $pkg konnte nicht direkt installiert werden."
 done
@@ -91,24 +91,46 @@ echo -e "${GREEN}--- 5. Web Portal & Routing ---${NC}"
 mkdir -p /home/pi/portal/static
 # [Portal-Code bleibt identisch zur V4]
 # ... [app.py, mode_privacy.sh, mode_normal.sh] ...
+# Lokale Assets bauen (Font-Subset + Logo, gehashte Namen, .gz/.br):
+# das Portal lädt nichts mehr von extern. Font-Quelle: /home/pi/portal/static/fonts/
+# Es wird KEINE Schrift mitgeliefert. Ohne Datei dort nutzt das Portal die
+# System-Schriften. Mona Sans (SIL OFL) optional per MONA_SANS_URL=<.ttf/.woff2-URL> laden:
+if [ -n "${MONA_SANS_URL:-}" ]; then
+    mkdir -p /home/pi/portal/static/fonts
+    curl -fL -o "/home/pi/portal/static/fonts/$(basename "${MONA_SANS_URL%%\?*}")" "$MONA_SANS_URL" \
+        || echo "Warnung: Mona Sans konnte nicht geladen werden, Portal nutzt System-Schriften."
+fi
+python3 /home/pi/portal/build_assets.py || echo "Warnung: Asset-Build fehlgeschlagen, Portal nutzt Fallbacks."
 
 echo -e "${GREEN}--- 6. Autostart Service ---${NC}"
+# Boot-Supervisor statt fester sleeps: jede Stufe startet, sobald ihre
+# Voraussetzungen bereit sind; Timings in /run/anyone-stick-boot.json
 cat << 'SOEOF' | sudo tee /usr/local/bin/start_anyone_stack.sh
 #!/bin/bash
-/usr/local/bin/usb_gadget_setup.sh
-sleep 5
-nmcli con up "Stick-Gateway" || true
-systemctl restart dnsmasq
-python3 /home/pi/portal/app.py &
-sleep 25
-/usr/local/bin/anon -f /etc/anonrc
+exec python3 /home/pi/portal/supervisor.py
 SOEOF
 sudo chmod +x /usr/local/bin/start_anyone_stack.sh
 
+# Root-Broker: Portal spricht per Unix-Socket statt sudo/Shell pro Aufruf
+cat << 'BEOF' | sudo tee /etc/systemd/system/anyone-stick-broker.service
+[Unit]
+Description=Anyone Stick privileged broker (firewall, kill switch, mode, Wi-Fi)
+Before=anyone-stick.service
+[Service]
+ExecStart=/usr/bin/python3 /home/pi/portal/broker.py
+Restart=always
+User=root
+RuntimeDirectory=anyone-stick
+RuntimeDirectoryPreserve=yes
+[Install]
+WantedBy=multi-user.target
+BEOF
+
 cat << 'SEOF' | sudo tee /etc/systemd/system/anyone-stick.service
 [Unit]
 Description=Anyone Stick Master
-After=network.target
+After=network.target anyone-stick-broker.service
+Wants=anyone-stick-broker.service
 [Service]
 ExecStart=/usr/local/bin/start_anyone_stack.sh
 Restart=always
@@ -118,7 +140,7 @@ WantedBy=multi-user.target
 SEOF
 
 sudo systemctl daemon-reload
-sudo systemctl enable anyone-stick
+sudo systemctl enable anyone-stick-broker anyone-stick
 sudo chown -R pi:pi /home/pi/portal
 echo -e "${GREEN}SETUP BEENDET! Stick schaltet sich aus.${NC}"
 sudo poweroff
@@ -51,7 +51,7 @@ HTML = """
 </head>
 <body>
 <div class="container">
-    <img src="/static/logo.jpg" onerror="this.src='/static/logo.png'" class="logo-img">
+    <img src="/static/logo.png" class="logo-img">
     <div class="card">
         <h3>System Status</h3>
         <div class="status-indicator {{ 'active' if privacy else '' }}"><div class="dot"></div>{{ 'PRIVACY ACTIVE' if privacy else 'NORMAL MODE' }}</div>
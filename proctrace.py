@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — external commands
+# Drop-in run() / check_output() / Popen for every command the stick forks
+# (iptables, nmcli, systemd-run, pgrep, the kill switch script, ...). Each
+# spawn is counted and timed per command class for /metrics and appended to
+# a bounded log with exit code, call site and trigger (the request route or
+# background job that caused it, see context()); summary() turns the log
+# into spawns/min and p50/p99 per command. Arguments are never logged (nmcli
+# carries Wi-Fi passwords).
+# ============================================================================
+
+import collections, contextlib, os, subprocess, sys, threading, time
+
+import metrics
+
+try:
+    import resource
+except ImportError:     # not on POSIX: no child CPU figures
+    resource = None
+
+LOG_SIZE = 2000
+SUMMARY_WINDOW = 600.0
+
+SPAWNS = metrics.Counter("portal_subprocess_spawns_total", "External commands started", ("cmd",))
+FAILURES = metrics.Counter("portal_subprocess_failures_total",
+                           "External commands that exited non-zero, timed out or failed to start", ("cmd",))
+DURATION = metrics.Histogram("portal_subprocess_duration_seconds", "External command wall time", ("cmd",))
+
+_WRAPPERS = {"sudo", "env", "nice", "ionice", "timeout"}
+_HERE = os.path.abspath(__file__).rstrip("co")
+_SKIP_FILES = {_HERE, os.path.abspath(subprocess.__file__).rstrip("co")}
+
+# (ts, cls, wall s, exit code or "timeout"/"spawn-failed", site, trigger, child cpu s or None)
+_log = collections.deque(maxlen=LOG_SIZE)     # append/iterate are atomic: no lock
+_started = time.time()
+_ctx = threading.local()
+
+
+@contextlib.contextmanager
+def context(label: str | None):
+    """Attributes spawns in this thread to label (a route, SSE topic, job) for the duration."""
+    prev = getattr(_ctx, "label", None)
+    _ctx.label = label
+    try:
+        yield
+    finally:
+        _ctx.label = prev
+
+
+def set_context(label: str | None):
+    _ctx.label = label
+
+
+def current() -> str:
+    """The active trigger label, or the thread's name."""
+    return getattr(_ctx, "label", None) or threading.current_thread().name
+
+
+def _call_site() -> str:
+    f = sys._getframe(2)
+    while f is not None and os.path.abspath(f.f_code.co_filename) in _SKIP_FILES:
+        f = f.f_back
+    if f is None:
+        return "?"
+    return f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}"
+
+
+def _children_cpu():
+    if resource is None:
+        return None
+    r = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return r.ru_utime + r.ru_stime
+
+
+def command_class(args) -> str:
+    """argv -> short class: the executable's basename, skipping sudo/env/... and their flags."""
+    argv = [args] if isinstance(args, (str, bytes)) else list(args)
+    argv = [a.decode() if isinstance(a, bytes) else str(a) for a in argv]
+    if len(argv) == 1 and " " in argv[0]:
+        argv = argv[0].split()
+    i = 0
+    while i < len(argv):
+        name = os.path.basename(argv[i])
+        if name not in _WRAPPERS:
+            return name
+        i += 1
+        while i < len(argv) and (argv[i].startswith("-") or "=" in argv[i] or argv[i].isdigit()):
+            i += 1
+    return os.path.basename(argv[-1]) if argv else "?"
+
+
+def _record(cls: str, seconds: float, rc, site: str, trigger: str, cpu0=None):
+    SPAWNS.inc((cls,))
+    DURATION.observe(seconds, (cls,))
+    if rc != 0:
+        FAILURES.inc((cls,))
+    cpu = None
+    if cpu0 is not None:
+        # Children's rusage is process-wide: exact for serial calls, an upper bound when they overlap.
+        cpu = max(0.0, _children_cpu() - cpu0)
+    _log.append((time.time(), cls, seconds, rc, site, trigger, cpu))
+
+
+def _exit_code(e: BaseException):
+    if isinstance(e, subprocess.TimeoutExpired):
+        return "timeout"
+    if isinstance(e, subprocess.CalledProcessError):
+        return e.returncode
+    return "spawn-failed"
+
+
+def run(args, **kw) -> subprocess.CompletedProcess:
+    cls, site, trigger, cpu0 = command_class(args), _call_site(), current(), _children_cpu()
+    t0 = time.monotonic()
+    rc = None
+    try:
+        r = subprocess.run(args, **kw)
+        rc = r.returncode
+        return r
+    except BaseException as e:
+        rc = _exit_code(e)
+        raise
+    finally:
+        _record(cls, time.monotonic() - t0, rc, site, trigger, cpu0)
+
+
+def check_output(args, **kw):
+    cls, site, trigger, cpu0 = command_class(args), _call_site(), current(), _children_cpu()
+    t0 = time.monotonic()
+    rc = None
+    try:
+        out = subprocess.check_output(args, **kw)
+        rc = 0
+        return out
+    except BaseException as e:
+        rc = _exit_code(e)
+        raise
+    finally:
+        _record(cls, time.monotonic() - t0, rc, site, trigger, cpu0)
+
+
+class Popen(subprocess.Popen):
+    """subprocess.Popen, recorded once the exit status is collected (wait/poll/communicate)."""
+
+    def __init__(self, args, **kw):
+        # Long-lived children (supervisor) overlap everything else: no CPU attribution.
+        self._trace = (command_class(args), _call_site(), current())
+        self._trace_t0 = time.monotonic()
+        self._trace_done = False
+        try:
+            super().__init__(args, **kw)
+        except OSError:
+            self._trace_done = True
+            cls, site, trigger = self._trace
+            _record(cls, time.monotonic() - self._trace_t0, "spawn-failed", site, trigger)
+            raise
+
+    def _trace_finish(self):
+        if not self._trace_done and self.returncode is not None:
+            self._trace_done = True
+            cls, site, trigger = self._trace
+            _record(cls, time.monotonic() - self._trace_t0, self.returncode, site, trigger)
+
+    def wait(self, timeout=None):
+        try:
+            return super().wait(timeout)
+        finally:
+            self._trace_finish()
+
+    def poll(self):
+        rc = super().poll()
+        self._trace_finish()
+        return rc
+
+
+# ──────────────────────────────────────────────
+# Report
+# ──────────────────────────────────────────────
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100.0 * len(sorted_values)))]
+
+
+def entries(limit: int = 50) -> list:
+    """Newest log entries first."""
+    out = []
+    if limit <= 0:
+        return out
+    for ts, cls, secs, rc, site, trigger, cpu in reversed(list(_log)[-int(limit):]):
+        out.append({"ts": round(ts, 3), "cmd": cls, "ms": round(secs * 1000.0, 1), "exit": rc,
+                    "site": site, "trigger": trigger, "cpu_ms": round(cpu * 1000.0, 1) if cpu is not None else None})
+    return out
+
+
+def summary(window: float = SUMMARY_WINDOW) -> dict:
+    """
+    Spawns in the last `window` seconds, per command class:
+      {"count", "per_min", "p50_ms", "p99_ms", "max_ms", "wall_ms", "cpu_ms", "failures",
+       "sites": {site: n}, "triggers": {trigger: n}}
+    plus "triggers": the same totals per trigger, busiest first.
+    """
+    now = time.time()
+    rows = [e for e in list(_log) if now - e[0] <= window]
+    span = max(1.0, min(float(window), now - _started))
+    cmds, triggers = {}, {}
+    for ts, cls, secs, rc, site, trigger, cpu in rows:
+        c = cmds.setdefault(cls, {"count": 0, "ms": [], "cpu": 0.0, "failures": 0, "sites": {}, "triggers": {}})
+        c["count"] += 1
+        c["ms"].append(secs * 1000.0)
+        c["cpu"] += cpu or 0.0
+        if rc != 0:
+            c["failures"] += 1
+        c["sites"][site] = c["sites"].get(site, 0) + 1
+        c["triggers"][trigger] = c["triggers"].get(trigger, 0) + 1
+        t = triggers.setdefault(trigger, {"count": 0, "wall_ms": 0.0, "cpu_ms": 0.0, "cmds": {}})
+        t["count"] += 1
+        t["wall_ms"] += secs * 1000.0
+        t["cpu_ms"] += (cpu or 0.0) * 1000.0
+        t["cmds"][cls] = t["cmds"].get(cls, 0) + 1
+    out = {}
+    for cls, c in sorted(cmds.items(), key=lambda kv: kv[1]["count"], reverse=True):
+        ms = sorted(c["ms"])
+        out[cls] = {
+            "count": c["count"],
+            "per_min": round(c["count"] * 60.0 / span, 2),
+            "p50_ms": round(_pct(ms, 50), 1),
+            "p99_ms": round(_pct(ms, 99), 1),
+            "max_ms": round(ms[-1], 1),
+            "wall_ms": round(sum(ms), 1),
+            "cpu_ms": round(c["cpu"] * 1000.0, 1) if resource is not None else None,
+            "failures": c["failures"],
+            "sites": dict(sorted(c["sites"].items(), key=lambda kv: kv[1], reverse=True)),
+            "triggers": dict(sorted(c["triggers"].items(), key=lambda kv: kv[1], reverse=True)),
+        }
+    return {
+        "window": span,
+        "spawns": len(rows),
+        "per_min": round(len(rows) * 60.0 / span, 2),
+        "logged": len(_log),
+        "log_size": LOG_SIZE,
+        "commands": out,
+        "triggers": [dict(trigger=k, per_min=round(v["count"] * 60.0 / span, 2), wall_ms=round(v["wall_ms"], 1),
+                          cpu_ms=round(v["cpu_ms"], 1), count=v["count"], cmds=v["cmds"])
+                     for k, v in sorted(triggers.items(), key=lambda kv: kv[1]["count"], reverse=True)],
+    }
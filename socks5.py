@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — in-process SOCKS5 client for tunnel probes
+# stdlib only (socket/ssl/http.client). Replaces forking curl for every probe:
+#  - RFC 1928 CONNECT with remote (hostname) resolution, like --socks5-hostname
+#  - RFC 1929 username/password used as stream isolation credentials
+#    (anon isolates streams with different SOCKS auth: IsolateSOCKSAuth)
+#  - HTTP/1.1 keep-alive reuse per (scheme, host, port, isolation)
+#  - per-phase timings: socks_connect, circuit_attach, tls, first_byte
+# FakeSocks5Server is a local stand-in for offline testing.
+# ============================================================================
+
+import http.client, socket, ssl, struct, threading, time, urllib.parse
+
+SOCKS_PROXY = ("127.0.0.1", 9050)
+
+REPLY_MESSAGES = {
+    0x01: "general failure",
+    0x02: "connection not allowed by ruleset",
+    0x03: "network unreachable",
+    0x04: "host unreachable",
+    0x05: "connection refused",
+    0x06: "TTL expired",
+    0x07: "command not supported",
+    0x08: "address type not supported",
+}
+
+
+class Socks5Error(OSError):
+    """SOCKS negotiation failed; .reply is the SOCKS reply code (or None)."""
+
+    def __init__(self, msg: str, reply: int | None = None):
+        super().__init__(msg)
+        self.reply = reply
+
+
+def _recv_exact(sock, n: int) -> bytes:
+    buf = b""
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise Socks5Error("proxy closed the connection")
+        buf += chunk
+    return buf
+
+
+def socks5_connect(host: str, port: int, proxy=SOCKS_PROXY, timeout: float = 10.0,
+                   isolation: tuple | None = None, timings: dict | None = None):
+    """
+    Opens a TCP stream to host:port through the SOCKS5 proxy and returns the socket.
+    `isolation` = (username, password) selects an isolated circuit on anon.
+    Fills timings["socks_connect"] (TCP + greeting/auth) and
+    timings["circuit_attach"] (CONNECT until the proxy reports success), in ms.
+    """
+    timings = timings if timings is not None else {}
+    t0 = time.monotonic()
+    sock = socket.create_connection(proxy, timeout=timeout)
+    try:
+        sock.settimeout(timeout)
+        method = 0x02 if isolation else 0x00
+        sock.sendall(bytes((5, 1, method)))
+        ver, chosen = _recv_exact(sock, 2)
+        if ver != 5 or chosen != method:
+            raise Socks5Error(f"proxy refused auth method {method:#x}")
+        if isolation:
+            user, pw = (str(x).encode("utf-8")[:255] for x in isolation)
+            sock.sendall(bytes((1, len(user))) + user + bytes((len(pw),)) + pw)
+            _ver, status = _recv_exact(sock, 2)
+            if status != 0:
+                raise Socks5Error("proxy rejected isolation credentials")
+        timings["socks_connect"] = round((time.monotonic() - t0) * 1000.0, 2)
+
+        t1 = time.monotonic()
+        name = host.encode("idna")
+        sock.sendall(bytes((5, 1, 0, 3, len(name))) + name + struct.pack("!H", int(port)))
+        ver, rep, _rsv, atyp = _recv_exact(sock, 4)
+        if rep != 0:
+            raise Socks5Error(f"SOCKS connect failed: {REPLY_MESSAGES.get(rep, hex(rep))}", rep)
+        if atyp == 1:
+            _recv_exact(sock, 4 + 2)
+        elif atyp == 4:
+            _recv_exact(sock, 16 + 2)
+        elif atyp == 3:
+            _recv_exact(sock, _recv_exact(sock, 1)[0] + 2)
+        else:
+            raise Socks5Error(f"bad address type in reply: {atyp}")
+        timings["circuit_attach"] = round((time.monotonic() - t1) * 1000.0, 2)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+class _TunnelConnection(http.client.HTTPConnection):
+    """http.client connection whose transport is a SOCKS5 stream (optionally TLS-wrapped)."""
+
+    def __init__(self, host, port, tls: bool, proxy, isolation, timeout, ssl_context=None):
+        super().__init__(host, port, timeout=timeout)
+        self.tls = tls
+        self.proxy = proxy
+        self.isolation = isolation
+        self.ssl_context = ssl_context
+        self.timings = {}
+
+    def connect(self):
+        self.timings = {}
+        sock = socks5_connect(self.host, self.port, self.proxy, self.timeout, self.isolation, self.timings)
+        if self.tls:
+            t0 = time.monotonic()
+            ctx = self.ssl_context or ssl.create_default_context()
+            try:
+                sock = ctx.wrap_socket(sock, server_hostname=self.host)
+            except BaseException:
+                sock.close()
+                raise
+            self.timings["tls"] = round((time.monotonic() - t0) * 1000.0, 2)
+        self.sock = sock
+
+    def abort(self):
+        """Unblocks a request running in another thread (shutdown wakes a blocked recv)."""
+        s = self.sock
+        if s is not None:
+            try:
+                s.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.close()
+
+
+class TunnelRequest:
+    """One HTTP request over the tunnel; run() blocks, cancel() may be called from any thread."""
+
+    def __init__(self, client, method, url, timeout, isolation, headers, max_body):
+        self.client = client
+        self.method = method
+        self.url = url
+        self.timeout = timeout
+        self.isolation = isolation
+        self.headers = headers or {}
+        self.max_body = max_body
+        self._conn = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+        c = self._conn
+        if c is not None:
+            c.abort()
+
+    def run(self) -> dict:
+        """{"status", "body", "timings", "reused"}; raises OSError/Socks5Error/ssl errors."""
+        u = urllib.parse.urlsplit(self.url)
+        tls = (u.scheme == "https")
+        port = u.port or (443 if tls else 80)
+        path = (u.path or "/") + (f"?{u.query}" if u.query else "")
+        key = (u.scheme, u.hostname, port, self.isolation)
+
+        for attempt in (0, 1):
+            if self._cancelled.is_set():
+                raise Socks5Error("cancelled")
+            conn, reused = self.client._checkout(key, tls, u.hostname, port, self.isolation, self.timeout)
+            self._conn = conn
+            if self._cancelled.is_set():
+                conn.abort()
+                raise Socks5Error("cancelled")
+            try:
+                if conn.sock is not None:
+                    conn.sock.settimeout(self.timeout)
+                    conn.timings = {}
+                hdrs = {"User-Agent": "anyone-stick-portal", "Accept": "*/*"}
+                hdrs.update(self.headers)
+                conn.request(self.method, path, headers=hdrs)
+                t_req = time.monotonic()
+                resp = conn.getresponse()
+                first_byte = round((time.monotonic() - t_req) * 1000.0, 2)
+                body = resp.read(self.max_body)
+                complete = resp.isclosed()
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine,
+                    ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if reused and attempt == 0 and not self._cancelled.is_set():
+                    continue  # idle keep-alive stream went away; retry on a fresh circuit stream
+                raise
+            except BaseException:
+                conn.close()
+                raise
+            finally:
+                self._conn = None
+            timings = dict(conn.timings)
+            timings["first_byte"] = first_byte
+            if complete and not resp.will_close and not self._cancelled.is_set():
+                self.client._checkin(key, conn)
+            else:
+                conn.close()
+            return {"status": resp.status, "body": body, "timings": timings, "reused": reused}
+
+
+class TunnelHTTP:
+    """
+    Minimal HTTP(S)-over-SOCKS5 client with keep-alive reuse.
+    Thread-safe; idle streams are kept per (scheme, host, port, isolation).
+    """
+
+    def __init__(self, proxy=SOCKS_PROXY, max_idle_per_key: int = 2, idle_seconds: float = 30.0,
+                 ssl_context=None):
+        self.proxy = tuple(proxy)
+        self.max_idle_per_key = int(max_idle_per_key)
+        self.idle_seconds = float(idle_seconds)
+        self.ssl_context = ssl_context
+        self._lock = threading.Lock()
+        self._idle = {}  # key -> [(conn, released_at)]
+
+    def _checkout(self, key, tls, host, port, isolation, timeout):
+        now = time.monotonic()
+        with self._lock:
+            pool = self._idle.get(key) or []
+            while pool:
+                conn, released = pool.pop()
+                if now - released < self.idle_seconds and conn.sock is not None:
+                    return conn, True
+                conn.close()
+        return _TunnelConnection(host, port, tls, self.proxy, isolation, timeout, self.ssl_context), False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            pool = self._idle.setdefault(key, [])
+            pool.append((conn, time.monotonic()))
+            while len(pool) > self.max_idle_per_key:
+                pool.pop(0)[0].close()
+
+    def request(self, method: str, url: str, timeout: float = 10.0, isolation: tuple | None = None,
+                headers: dict | None = None, max_body: int = 256 * 1024) -> TunnelRequest:
+        return TunnelRequest(self, method.upper(), url, timeout, isolation, headers, max_body)
+
+    def get(self, url: str, **kw) -> dict:
+        return self.request("GET", url, **kw).run()
+
+    def close(self):
+        with self._lock:
+            pools, self._idle = self._idle, {}
+        for pool in pools.values():
+            for conn, _ in pool:
+                conn.close()
+
+
+# ──────────────────────────────────────────────
+# Local stand-in (offline tests / benchmarks)
+# ──────────────────────────────────────────────
+class FakeSocks5Server:
+    """
+    Threaded SOCKS5 server on 127.0.0.1 that relays CONNECTs.
+      routes:        {(host, port): (real_host, real_port)} — rewrite targets (e.g. to a local HTTP server)
+      attach_delay:  seconds to sleep before answering CONNECT (simulated circuit build)
+      fail:          {(host, port): reply_code} — answer CONNECT with an error
+    Seen isolation credentials are recorded in .auth_seen; CONNECT targets in .connects.
+    """
+
+    def __init__(self, routes=None, attach_delay: float = 0.0, fail=None):
+        self.routes = dict(routes or {})
+        self.attach_delay = float(attach_delay)
+        self.fail = dict(fail or {})
+        self.auth_seen = []
+        self.connects = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.listen(64)
+        self.address = self._sock.getsockname()
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="fake-socks5", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                c, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(c,), daemon=True).start()
+
+    def _handle(self, c):
+        try:
+            ver, n = _recv_exact(c, 2)
+            methods = _recv_exact(c, n)
+            if 0x02 in methods:
+                c.sendall(b"\x05\x02")
+                _v, ulen = _recv_exact(c, 2)
+                user = _recv_exact(c, ulen)
+                plen = _recv_exact(c, 1)[0]
+                pw = _recv_exact(c, plen)
+                self.auth_seen.append((user.decode(), pw.decode()))
+                c.sendall(b"\x01\x00")
+            else:
+                c.sendall(b"\x05\x00")
+            _v, cmd, _r, atyp = _recv_exact(c, 4)
+            if atyp == 3:
+                host = _recv_exact(c, _recv_exact(c, 1)[0]).decode("idna")
+            elif atyp == 1:
+                host = socket.inet_ntoa(_recv_exact(c, 4))
+            else:
+                host = socket.inet_ntop(socket.AF_INET6, _recv_exact(c, 16))
+            port = struct.unpack("!H", _recv_exact(c, 2))[0]
+            self.connects.append((host, port))
+            if self.attach_delay:
+                time.sleep(self.attach_delay)
+            code = self.fail.get((host, port), 0)
+            upstream = None
+            if not code:
+                try:
+                    upstream = socket.create_connection(self.routes.get((host, port), (host, port)), timeout=10)
+                except OSError:
+                    code = 0x05
+            c.sendall(bytes((5, code, 0, 1)) + socket.inet_aton("0.0.0.0") + b"\x00\x00")
+            if upstream is None:
+                c.close()
+                return
+            self._relay(c, upstream)
+        except Exception:
+            try:
+                c.close()
+            except OSError:
+                pass
+
+    @staticmethod
+    def _relay(a, b):
+        def pump(src, dst):
+            try:
+                while True:
+                    data = src.recv(65536)
+                    if not data:
+                        break
+                    dst.sendall(data)
+            except OSError:
+                pass
+            finally:
+                for s in (src, dst):
+                    try:
+                        s.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        threading.Thread(target=pump, args=(b, a), daemon=True).start()
+        pump(a, b)
+        a.close()
+        b.close()
@@ -1,9 +1,4 @@
 #!/bin/bash
-echo timer | sudo tee /sys/class/leds/default-on/trigger
-/usr/local/bin/usb_gadget_setup.sh
-sleep 5
-nmcli con up "Stick-Gateway" || true
-systemctl restart dnsmasq
-python3 /home/pi/portal/app.py &
-sleep 25
-/usr/local/bin/anon -f /etc/anonrc
+# Readiness-driven boot (gadget -> carrier -> gateway -> dnsmasq; portal and anon
+# in parallel); children are restarted on crash, timings in /run/anyone-stick-boot.json
+exec python3 /home/pi/portal/supervisor.py
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — state files
+# The small files the stick's processes hand to each other: JSON state and
+# reports under /run and /var/lib (mode switch steps, boot report, DNS
+# stats, bypass list, pinned pool countries), replaced atomically so a
+# reader never sees half a file, and single values written to /proc or
+# /sys (ip_forward, LED trigger).
+# ============================================================================
+
+import json, os, threading
+
+
+def write_json(path: str, data) -> None:
+    """Writes data as JSON next to path and renames it over path (creates the directory)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def write_value(path: str, value: str) -> None:
+    """One value into a /proc or /sys file."""
+    with open(path, "w") as f:
+        f.write(value)
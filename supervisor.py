@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — boot supervisor
+# Replaces the fixed sleeps in start_anyone_stack.sh: every stage starts as
+# soon as its dependencies report ready (UDC bound, usb0 carrier, gateway
+# address, dnsmasq listening, portal accepting, DNS proxy listening, anon
+# bootstrapped), stages without dependencies start at once, long-running
+# children are restarted when they die, and a per-stage timing report is
+# kept in BOOT_REPORT_PATH. A stage that misses its timeout lets its
+# dependents go on degraded but is still polled; once it is ready, the
+# one-shot commands of the stages it degraded are run again.
+# ============================================================================
+
+import os, signal, socket, subprocess, sys, threading, time
+
+import controlport, firewall, proctrace, statefile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BOOT_REPORT_PATH = os.environ.get("BOOT_REPORT_PATH", "/run/anyone-stick-boot.json")
+GADGET_SETUP = os.environ.get("GADGET_SETUP", "/usr/local/bin/usb_gadget_setup.sh")
+GADGET_UDC_PATH = "/sys/kernel/config/usb_gadget/g1/UDC"
+USB_IFACE = firewall.USB_IFACE
+GATEWAY_CONNECTION = "Stick-Gateway"
+GATEWAY_ADDR = firewall.PORTAL_ADDR
+PORTAL_CMD = [sys.executable, os.path.join(HERE, "app.py")]
+PORTAL_PORT = 80
+DNSPROXY_CMD = [sys.executable, os.path.join(HERE, "dnsproxy.py")]
+DNSPROXY_PORT = firewall.DNS_PROXY_PORT
+ANON_CMD = ["/usr/local/bin/anon", "-f", "/etc/anonrc"]
+CONTROL_PORT = controlport.CONTROL_PORT
+LED_TRIGGER_PATH = firewall.LED_TRIGGER_PATH
+
+POLL_INTERVAL = 0.1
+LATE_POLL_INTERVAL = 1.0    # readiness polling after a stage timed out
+RESTART_BACKOFF = (1.0, 2.0, 4.0, 8.0, 15.0, 30.0)
+
+
+# ──────────────────────────────────────────────
+# Readiness probes (sysfs / procfs / sockets — no forks)
+# ──────────────────────────────────────────────
+def _read(path: str) -> str:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def udc_bound() -> bool:
+    return bool(_read(GADGET_UDC_PATH))
+
+
+def usb_carrier() -> bool:
+    return _read(f"/sys/class/net/{USB_IFACE}/carrier") == "1"
+
+
+def address_assigned(addr: str = GATEWAY_ADDR) -> bool:
+    """True once addr is configured locally (binding to it only works then)."""
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        s.bind((addr, 0))
+        return True
+    except OSError:
+        return False
+    finally:
+        s.close()
+
+
+def udp_listening(port: int, addr: str | None = None, proc_path: str = "/proc/net/udp") -> bool:
+    """True if a UDP socket is bound to port (on addr or the wildcard address)."""
+    want = {f"00000000:{port:04X}"}
+    if addr:
+        want.add(f"{socket.inet_aton(addr)[::-1].hex().upper()}:{port:04X}")
+    try:
+        with open(proc_path, encoding="ascii") as f:
+            next(f, None)
+            return any(line.split()[1] in want for line in f if line.strip())
+    except OSError:
+        return False
+
+
+def tcp_accepting(port: int, host: str = "127.0.0.1") -> bool:
+    try:
+        socket.create_connection((host, port), timeout=0.5).close()
+        return True
+    except OSError:
+        return False
+
+
+# ──────────────────────────────────────────────
+# Stages
+# ──────────────────────────────────────────────
+class Stage:
+    """
+    One boot step. `run` is a one-shot command, `child` a long-running
+    process (restarted when it exits); `ready` is polled until it returns
+    True (or a (done, detail) tuple). `done` is set once it is ready, failed
+    or past `timeout`; `up` only once it is ready.
+    """
+
+    def __init__(self, name, deps=(), run=None, child=None, ready=None, timeout=60.0):
+        self.name = name
+        self.deps = tuple(deps)
+        self.run = run
+        self.child = child
+        self.ready = ready
+        self.timeout = float(timeout)
+        self.done = threading.Event()
+        self.up = threading.Event()
+        self.report = {"status": "waiting", "deps": list(self.deps)}
+
+
+def default_stages() -> list:
+    # Bootstrap progress arrives as STATUS_CLIENT events; the check only reads state.
+    mon = controlport.Monitor(CONTROL_PORT, password=os.environ.get("CONTROL_PORT_PASSWORD")).start()
+
+    def anon_ready():
+        b = mon.bootstrap
+        if b["progress"] is None:
+            return False, mon.error or "waiting for ControlPort"
+        return b["progress"] == 100, f"{b['progress']}% {b['summary'] or ''}".strip()
+
+    return [
+        Stage("gadget", run=[GADGET_SETUP], ready=udc_bound, timeout=20),
+        Stage("carrier", deps=["gadget"], ready=usb_carrier, timeout=60),
+        Stage("gateway", deps=["carrier"], run=["nmcli", "con", "up", GATEWAY_CONNECTION],
+              ready=address_assigned, timeout=30),
+        Stage("dnsmasq", deps=["gateway"], run=["systemctl", "restart", "dnsmasq"],
+              ready=lambda: udp_listening(53, GATEWAY_ADDR), timeout=15),
+        Stage("portal", child=PORTAL_CMD, ready=lambda: tcp_accepting(PORTAL_PORT), timeout=30),
+        Stage("dnsproxy", child=DNSPROXY_CMD, ready=lambda: udp_listening(DNSPROXY_PORT), timeout=15),
+        Stage("anon", child=ANON_CMD, ready=anon_ready, timeout=300),
+    ]
+
+
+class Supervisor:
+    def __init__(self, stages, report_path: str = BOOT_REPORT_PATH):
+        self.stages = {s.name: s for s in stages}
+        self.report_path = report_path
+        self.t0 = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._procs = {}
+
+    def _now(self) -> float:
+        return round(time.monotonic() - self.t0, 3)
+
+    def _update(self, stage, **fields):
+        with self._lock:
+            stage.report.update(fields)
+            report = {
+                "started": time.time() - (time.monotonic() - self.t0),
+                "elapsed_s": self._now(),
+                "ready": all(s.report.get("status") == "ready" for s in self.stages.values()),
+                "stages": {n: dict(s.report) for n, s in self.stages.items()},
+            }
+        try:
+            statefile.write_json(self.report_path, report)
+        except OSError:
+            pass
+
+    def _spawn(self, stage):
+        p = proctrace.Popen(stage.child, stdin=subprocess.DEVNULL)
+        self._procs[stage.name] = p
+        return p
+
+    def _watch_child(self, stage):
+        """Restarts the stage's child whenever it exits (backoff grows while it keeps crashing)."""
+        restarts = 0
+        while not self._stop.is_set():
+            p = self._procs[stage.name]
+            started = time.monotonic()
+            rc = p.wait()
+            if self._stop.is_set():
+                return
+            if time.monotonic() - started > 60:
+                restarts = 0
+            delay = RESTART_BACKOFF[min(restarts, len(RESTART_BACKOFF) - 1)]
+            restarts += 1
+            self._update(stage, restarts=stage.report.get("restarts", 0) + 1, last_exit=rc, last_exit_at=self._now())
+            if self._stop.wait(delay):
+                return
+            try:
+                self._spawn(stage)
+            except OSError as e:
+                self._update(stage, error=str(e))
+
+    def _start(self, stage, rerun: bool = False) -> bool:
+        """Runs the one-shot command and (first time only) spawns the child; False if that failed."""
+        try:
+            if stage.run:
+                t0 = self._now()
+                r = proctrace.run(stage.run, capture_output=True, text=True, timeout=stage.timeout)
+                self._update(stage, run_rc=r.returncode, run_ms=round((self._now() - t0) * 1000.0))
+                if r.returncode != 0:
+                    self._update(stage, error=(r.stderr or r.stdout or "").strip()[-300:] or f"rc={r.returncode}")
+            if stage.child and not rerun:
+                self._spawn(stage)
+                threading.Thread(target=self._watch_child, args=(stage,), name=f"watch-{stage.name}", daemon=True).start()
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self._update(stage, status="failed", error=str(e), end_s=self._now())
+            stage.done.set()
+            return False
+        return True
+
+    def _poll(self, stage, degraded) -> bool:
+        """Polls readiness, past the timeout too; True when a late dependency is up and the run is due again."""
+        deadline = time.monotonic() + stage.timeout
+        detail = None
+        while not self._stop.is_set():
+            res = stage.ready() if stage.ready else True
+            ok, new_detail = res if isinstance(res, tuple) else (bool(res), None)
+            if new_detail is not None and new_detail != detail:
+                detail = new_detail
+                self._update(stage, detail=detail)
+            if ok:
+                late = stage.report.get("status") == "timeout"
+                self._update(stage, status="ready", end_s=self._now(),
+                             took_s=round(self._now() - stage.report["start_s"], 3), **({"late": True} if late else {}))
+                stage.up.set()
+                stage.done.set()
+                return False
+            timed_out = stage.report.get("status") == "timeout"
+            if not timed_out and time.monotonic() > deadline:
+                # Dependents go on degraded; this stage stays polled and may still turn ready.
+                self._update(stage, status="timeout", end_s=self._now())
+                stage.done.set()
+                timed_out = True
+            if stage.run and degraded and all(self.stages[d].up.is_set() for d in degraded):
+                return True
+            time.sleep(LATE_POLL_INTERVAL if timed_out else POLL_INTERVAL if not stage.child else max(POLL_INTERVAL, 0.5))
+        return False
+
+    def _run_stage(self, stage):
+        for dep in stage.deps:
+            self.stages[dep].done.wait()
+        degraded = [d for d in stage.deps if not self.stages[d].up.is_set()]
+        if degraded:
+            # Still try: a late dependency (e.g. no USB host yet) should not keep the rest down.
+            self._update(stage, degraded_by=degraded)
+        self._update(stage, status="starting", start_s=self._now())
+        rerun = False
+        while not self._stop.is_set():
+            if not self._start(stage, rerun):
+                if not (stage.run and degraded):
+                    return
+                # The command may have failed for want of the dependency: wait for it, then retry.
+                while not all(self.stages[d].up.is_set() for d in degraded):
+                    if self._stop.wait(LATE_POLL_INTERVAL):
+                        return
+            elif not self._poll(stage, degraded):
+                return
+            # The one-shot ran without a dependency that is ready now: run it again.
+            self._update(stage, status="starting", degraded_by=[], reruns=stage.report.get("reruns", 0) + 1,
+                         start_s=self._now())
+            degraded, rerun = [], True
+
+    def run(self):
+        for stage in self.stages.values():
+            self._update(stage)
+            threading.Thread(target=self._run_stage, args=(stage,), name=f"stage-{stage.name}", daemon=True).start()
+        while not self._stop.wait(1.0):
+            pass
+
+    def stop(self, *_):
+        self._stop.set()
+        for p in list(self._procs.values()):
+            if p.poll() is None:
+                p.terminate()
+        for p in list(self._procs.values()):
+            try:
+                p.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                p.kill()
+
+
+if __name__ == "__main__":
+    try:
+        statefile.write_value(LED_TRIGGER_PATH, "timer")
+    except OSError:
+        pass
+    sup = Supervisor(default_stages())
+    signal.signal(signal.SIGTERM, lambda *_: (sup.stop(), sys.exit(0)))
+    signal.signal(signal.SIGINT, lambda *_: (sup.stop(), sys.exit(0)))
+    sup.run()
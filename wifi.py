@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# ============================================================================
+# Anyone Privacy Stick — Wi-Fi scan
+# One terse `nmcli dev wifi list` -> networks grouped by SSID, strongest
+# first; connect via argv (no shell). Used by the portal and the broker.
+# ============================================================================
+
+import json, subprocess, time
+
+import proctrace
+
+SCAN_FIELDS = "IN-USE,BSSID,SSID,CHAN,SIGNAL,SECURITY"
+_NFIELDS = SCAN_FIELDS.count(",") + 1
+
+
+def split_terse(line: str) -> list:
+    """Splits one `nmcli -t` line on unescaped ':' and unescapes '\\:' and '\\\\'."""
+    if "\\" not in line:
+        return line.split(":")
+    # Terse mode escapes every BSSID, so this is the common path: mask the two
+    # escapes with control chars, split in C, restore only the fields that need it.
+    parts = line.replace("\\\\", "\x00").replace("\\:", "\x01").split(":")
+    return [p.replace("\x01", ":").replace("\x00", "\\") if ("\x01" in p or "\x00" in p) else p
+            for p in parts]
+
+
+def _int(s: str) -> int:
+    try:
+        return int(s)
+    except ValueError:
+        return 0
+
+
+def parse_scan(text: str) -> list:
+    """
+    Parses `nmcli -t -f IN-USE,BSSID,SSID,CHAN,SIGNAL,SECURITY dev wifi list` into
+      [{"ssid", "connected", "signal", "channel", "security", "bssids"}, ...]
+    one entry per SSID (strongest BSSID wins channel/security), sorted by signal.
+    Hidden networks (empty SSID) are skipped.
+    """
+    nets = {}
+    for line in text.splitlines():
+        if not line:
+            continue
+        f = split_terse(line)
+        if len(f) < _NFIELDS:
+            continue
+        in_use, _bssid, ssid, chan, signal, security = f[:_NFIELDS]
+        if not ssid:
+            continue
+        sig = _int(signal)
+        sec = "" if security in ("", "--") else security
+        n = nets.get(ssid)
+        if n is None:
+            nets[ssid] = {"ssid": ssid, "connected": in_use == "*", "signal": sig,
+                          "channel": _int(chan), "security": sec, "bssids": 1}
+            continue
+        n["bssids"] += 1
+        if in_use == "*":
+            n["connected"] = True
+        if sig > n["signal"]:
+            n.update(signal=sig, channel=_int(chan), security=sec)
+    return sorted(nets.values(), key=lambda n: n["signal"], reverse=True)
+
+
+def scan(rescan: bool = False, timeout: float = 20.0) -> dict:
+    """
+    Runs one nmcli listing. rescan=False reads NetworkManager's current list
+    (fast); rescan=True asks for a fresh radio scan first (seconds).
+    """
+    t0 = time.monotonic()
+    cmd = ["nmcli", "-t", "-f", SCAN_FIELDS, "dev", "wifi", "list", "--rescan", "yes" if rescan else "no"]
+    r = proctrace.run(cmd, capture_output=True, text=True, timeout=timeout)
+    if r.returncode != 0:
+        raise RuntimeError((r.stderr or "").strip() or f"nmcli rc={r.returncode}")
+    return {
+        "ok": True,
+        "networks": parse_scan(r.stdout),
+        "rescanned": rescan,
+        "scan_ms": round((time.monotonic() - t0) * 1000.0, 1),
+    }
+
+
+def connect(ssid: str, password: str = "", timeout: float = 30.0) -> dict:
+    """nmcli connect (argv, no shell). -> {"ok", "error"?}; error is "timeout", "failed: ..." or the exception."""
+    cmd = ["nmcli", "dev", "wifi", "connect", ssid]
+    if password:
+        cmd += ["password", password]
+    try:
+        r = proctrace.run(cmd, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"ok": False, "error": "timeout"}
+    if r.returncode != 0:
+        return {"ok": False, "error": "failed: " + ((r.stderr or r.stdout or "").strip() or f"rc={r.returncode}")}
+    return {"ok": True}
+
+
+if __name__ == "__main__":
+    import argparse, sys
+    ap = argparse.ArgumentParser(description="Anyone Stick Wi-Fi scan")
+    ap.add_argument("--rescan", action="store_true", help="trigger a fresh radio scan first")
+    ap.add_argument("--parse", action="store_true", help="parse terse nmcli output from stdin")
+    args = ap.parse_args()
+    if args.parse:
+        json.dump(parse_scan(sys.stdin.read()), sys.stdout, indent=2)
+    else:
+        json.dump(scan(args.rescan), sys.stdout, indent=2)
+    print()